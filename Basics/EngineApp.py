@@ -326,7 +326,7 @@ class App(object):
                     leg=plt.legend(fancybox=True,loc=options.get('legendloc',None))
                     leg.get_frame().set_alpha(0.5)
             else:
-                plt.plot(data[:,0],data[:,1:])
+                plt.plot(data[:,0],data[:,1:],options.get('style','-'))
                 if 'legend' in options:
                     leg=plt.legend(options['legend'],fancybox=True,loc=options.get('legendloc',None))
                     leg.get_frame().set_alpha(0.5)
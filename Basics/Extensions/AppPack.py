@@ -4,14 +4,15 @@ App pack
 --------
 
 App pack, including:
-    * classes: EB, POS, DOS, GF, FS, BC, BP, GP, CPFF
+    * classes: EB, POS, DOS, KPM, GF, FS, BC, BP, WCC, GP, CPFF
 '''
 
-__all__=['EB','POS','DOS','GF','FS','BC','BP','GP','CPFF']
+__all__=['EB','POS','DOS','KPM','GF','FS','BC','BP','WCC','GP','CPFF']
 
 import numpy as np
 from ..EngineApp import App
-from ..Utilities import berry_curvature,berry_phase
+from ..Utilities import berry_curvature,berry_flux,berry_phase,wilson_loops
+from ...Misc import kpmmoments,kpmdos
 
 class EB(App):
     '''
@@ -81,9 +82,14 @@ class DOS(App):
         The number of sample points in the energy range.
     eta : np.float64
         The damping factor.
+    method : 'L', 'H' or 'T'
+        The method to calculate the DOS of free systems.
+            * 'L': Lorentzian broadening of every eigenvalue;
+            * 'H': Lorentzian broadening of the histogram of the eigenvalues by fast Fourier transforms;
+            * 'T': linear tetrahedron method on a regular KSpace mesh of the Brillouin zone spanned by the lattice reciprocals, for which `eta` is not used.
     '''
 
-    def __init__(self,BZ=None,emin=None,emax=None,mu=0.0,ne=100,eta=0.05,**karg):
+    def __init__(self,BZ=None,emin=None,emax=None,mu=0.0,ne=100,eta=0.05,method='L',**karg):
         '''
         Constructor.
 
@@ -99,13 +105,97 @@ class DOS(App):
             The number of sample points in the energy range defined by emin and emax.
         eta : np.float64, optional
             The damping factor.
+        method : 'L', 'H' or 'T', optional
+            The method to calculate the DOS of free systems.
         '''
+        assert method in ('L','H','T')
         self.BZ=BZ
         self.emin=emin
         self.emax=emax
         self.mu=mu
         self.ne=ne
         self.eta=eta
+        self.method=method
+
+class KPM(App):
+    '''
+    Density of states by the kernel polynomial method.
+
+    Attributes
+    ----------
+    emin,emax : np.float64
+        The lower/upper bound of the energy range.
+    ne : integer
+        The number of sample points in the energy range.
+    nmoment : integer
+        The number of the Chebyshev moments.
+    nvector : integer
+        The number of the random-phase vectors for the stochastic evaluation of the traces.
+    kernel : 'jackson' or 'lorentz'
+        The kernel to damp the Gibbs oscillations.
+    lamb : np.float64
+        The parameter of the Lorentz kernel.
+    bounds : 2-tuple
+        The lower and upper bounds of the spectrum. When None, they will be estimated by Lanczos.
+    '''
+
+    def __init__(self,emin=None,emax=None,ne=400,nmoment=512,nvector=16,kernel='jackson',lamb=4.0,bounds=None,**karg):
+        '''
+        Constructor.
+
+        Parameters
+        ----------
+        emin,emax : np.float64, optional
+            The lower/upper bound of the energy range.
+        ne : integer, optional
+            The number of sample points in the energy range.
+        nmoment : integer, optional
+            The number of the Chebyshev moments.
+        nvector : integer, optional
+            The number of the random-phase vectors for the stochastic evaluation of the traces.
+        kernel : 'jackson' or 'lorentz', optional
+            The kernel to damp the Gibbs oscillations.
+        lamb : np.float64, optional
+            The parameter of the Lorentz kernel.
+        bounds : 2-tuple, optional
+            The lower and upper bounds of the spectrum.
+        '''
+        assert kernel in ('jackson','lorentz')
+        self.emin=emin
+        self.emax=emax
+        self.ne=ne
+        self.nmoment=nmoment
+        self.nvector=nvector
+        self.kernel=kernel
+        self.lamb=lamb
+        self.bounds=bounds
+
+    def set(self,matrix):
+        '''
+        Calculate the density of states of a Hermitian operator.
+
+        Parameters
+        ----------
+        matrix : csr_matrix, LinearOperator, etc
+            The Hermitian operator.
+
+        Returns
+        -------
+        2d ndarray
+            The energies, the density of states and its stochastic error, one row for each energy.
+
+        Notes
+        -----
+        The density of states is normalized in the same way as `DOS`, i.e. its integration over the energy is pi times the dimension of the operator.
+        The random-phase vectors are distributed over `self.np` processes.
+        '''
+        a,b,moments=kpmmoments(matrix,self.nmoment,nvector=self.nvector,bounds=self.bounds,nprocess=self.np)
+        result=np.zeros((self.ne,3))
+        result[:,0]=np.linspace(b-a if self.emin is None else self.emin,b+a if self.emax is None else self.emax,num=self.ne)
+        doses=kpmdos(moments,a,b,result[:,0],kernel=self.kernel,lamb=self.lamb)*np.pi
+        result[:,1]=doses.mean(axis=0)
+        result[:,2]=doses.std(axis=0,ddof=1)/np.sqrt(len(doses)) if len(doses)>1 else 0.0
+        return result
 
 class GF(App):
     '''
@@ -196,9 +286,11 @@ class BC(App):
     bcoff : logical, optional
         When True, only the Chern number will be included in the returned data.
         Otherwise, the Berry curvature will be included as well.
+    method : 'kubo' or 'fhs'
+        'kubo' for the Kubo formula and 'fhs' for the Fukui-Hatsugai-Suzuki method.
     '''
 
-    def __init__(self,BZ,mu=0.0,d=10**-6,bcoff=True,**karg):
+    def __init__(self,BZ,mu=0.0,d=10**-6,bcoff=True,method='kubo',**karg):
         '''
         Constructor.
 
@@ -213,20 +305,30 @@ class BC(App):
         bcoff : logical, optional
             When True, only the Chern number will be included in the returned data.
             Otherwise, the Berry curvature will be included as well.
+        method : 'kubo' or 'fhs', optional
+            'kubo' for the Kubo formula and 'fhs' for the Fukui-Hatsugai-Suzuki method.
+
+        Notes
+        -----
+        For the 'fhs' method, `BZ` must be a regular mesh covering a whole reciprocal cell, e.g. the one generated by `KSpace` with `end=False`.
         '''
+        assert method in ('kubo','fhs')
         self.BZ=BZ
         self.mu=mu
         self.d=d
         self.bcoff=bcoff
+        self.method=method
 
-    def set(self,H):
+    def set(self,H,Hs=None):
         '''
-        Using the Kubo formula to calculate the Berry curvature of the occupied bands for a Hamiltonian with the given chemical potential.
+        Calculate the Berry curvature of the occupied bands for a Hamiltonian with the given chemical potential.
 
         Parameters
         ----------
         H : callable
             Input function which returns the Hamiltonian as a 2D ndarray.
+        Hs : callable, optional
+            Input function which returns the Hamiltonians at a batch of k points as a 3D ndarray, used by the 'fhs' method instead of `H` when given.
 
         Returns
         -------
@@ -235,13 +337,74 @@ class BC(App):
         cn : np.float64
             The integration of the Berry curvature.
             When BZ is the first Brillouin zone, this number is the first Chern number.
+
+        Notes
+        -----
+        For the 'fhs' method, the Hamiltonians are diagonalized once on the mesh closed by its periodic images,
+        the value of the Berry curvature at a k point is the Berry flux through the plaquette starting from it divided by the area of the plaquette,
+        and the Chern number is an integer up to the rounding errors as long as the occupied bands are separated from the others by a gap.
         '''
-        bc=np.zeros(self.BZ.rank('k'))
-        for i,ks in enumerate(self.BZ()):
-            bc[i]=berry_curvature(H,ks['k'][0],ks['k'][1],self.mu,d=self.d)
+        if self.method=='kubo':
+            bc=np.zeros(self.BZ.rank('k'))
+            for i,ks in enumerate(self.BZ()):
+                bc[i]=berry_curvature(H,ks['k'][0],ks['k'][1],self.mu,d=self.d)
+        else:
+            grid,d1,d2=_kgrid_(self.BZ)
+            vs=_occupied_(H,Hs,grid,self.mu)
+            bc=(-berry_flux(vs)/np.cross(d1,d2)).reshape(-1)
         cn=np.sum(bc)*self.BZ.volume('k')/len(bc)/2/np.pi
         return bc,cn
 
+def _kgrid_(BZ):
+    '''
+    The grid of the k points of a regular 2D mesh closed by their periodic images.
+
+    Parameters
+    ----------
+    BZ : BaseSpace
+        The regular 2D mesh covering a whole reciprocal cell.
+
+    Returns
+    -------
+    grid : 3d ndarray
+        The k points, with the shape (n+1,n+1,2).
+    d1,d2 : 1d ndarray
+        The steps of the mesh along the two directions.
+    '''
+    kmesh,nk=BZ.mesh('k'),BZ.rank('k')
+    n=int(round(np.sqrt(nk)))
+    if n<2 or n**2!=nk or kmesh.shape[1]!=2: raise ValueError('_kgrid_ error: a regular 2D mesh is needed.')
+    d1,d2=kmesh[n]-kmesh[0],kmesh[1]-kmesh[0]
+    grid=kmesh[0]+np.arange(n+1)[:,None,None]*d1+np.arange(n+1)[None,:,None]*d2
+    if not np.allclose(grid[:n,:n].reshape((nk,2)),kmesh): raise ValueError('_kgrid_ error: a regular 2D mesh is needed.')
+    return grid,d1,d2
+
+def _occupied_(H,Hs,grid,mu):
+    '''
+    The eigenvectors of the occupied bands on a grid of k points.
+
+    Parameters
+    ----------
+    H : callable
+        Input function which returns the Hamiltonian as a 2D ndarray.
+    Hs : callable
+        Input function which returns the Hamiltonians at a batch of k points as a 3D ndarray, used instead of `H` when not None.
+    grid : 3d ndarray
+        The k points.
+    mu : np.float64
+        The Fermi level.
+
+    Returns
+    -------
+    4d ndarray
+        The eigenvectors, with the shape (n1,n2,ndim,nocc).
+    '''
+    ks=grid.reshape((-1,grid.shape[-1]))
+    es,vs=np.linalg.eigh(np.array([H(kx,ky) for kx,ky in ks]) if Hs is None else Hs(ks))
+    nocc=(es<=mu).sum(axis=1)
+    if nocc.min()!=nocc.max(): raise ValueError('_occupied_ error: the occupied bands are not separated by a gap at the Fermi level.')
+    return vs[:,:,:nocc[0]].reshape(grid.shape[:-1]+(vs.shape[1],nocc[0]))
+
 class BP(App):
     '''
     Berry phase.
@@ -286,6 +449,102 @@ class BP(App):
         '''
         return berry_phase(H,path,self.ns)
 
+class WCC(App):
+    '''
+    Wannier charge centers, i.e. the centers of the hybrid Wannier functions of the occupied bands.
+
+    Attributes
+    ----------
+    BZ : BaseSpace
+        The Brillouin zone, which must be a regular 2D mesh covering a whole reciprocal cell.
+    mu : np.float64
+        The Fermi level.
+    axis : 0 or 1
+        The direction of the mesh along which the Wilson loops are calculated.
+    '''
+
+    def __init__(self,BZ,mu=0.0,axis=0,**karg):
+        '''
+        Constructor.
+
+        Parameters
+        ----------
+        BZ : BaseSpace
+            The Brillouin zone, which must be a regular 2D mesh covering a whole reciprocal cell.
+        mu : np.float64, optional
+            The Fermi level.
+        axis : 0 or 1, optional
+            The direction of the mesh along which the Wilson loops are calculated.
+        '''
+        assert axis in (0,1)
+        self.BZ=BZ
+        self.mu=mu
+        self.axis=axis
+
+    def set(self,H,Hs=None,rcoords=None):
+        '''
+        Calculate the Wannier charge centers of the occupied bands for a Hamiltonian with the given chemical potential.
+
+        Parameters
+        ----------
+        H : callable
+            Input function which returns the Hamiltonian as a 2D ndarray.
+        Hs : callable, optional
+            Input function which returns the Hamiltonians at a batch of k points as a 3D ndarray, used instead of `H` when given.
+        rcoords : 2d ndarray, optional
+            The rcoords of the basis of the Hamiltonian, one row for each basis, when the phase factors of the Hamiltonian depend on them, i.e. `H(k+G)=D*H(k)*D^H` with `D=diag(exp(-iG*rcoords))`.
+            When None, the Hamiltonian is assumed to be periodic in the reciprocal space.
+
+        Returns
+        -------
+        2d ndarray
+            The first column is the relative position of each line along the other direction of the mesh,
+            and the other columns are the sorted Wannier charge centers in the interval [-0.5,0.5) in the unit of the corresponding lattice vector.
+
+        Notes
+        -----
+        The eigenvectors at the end of each line are not diagonalized again but obtained from those at the start by `D`, so that the Wilson loops are gauge invariant.
+        '''
+        grid,d1,d2=_kgrid_(self.BZ)
+        n=grid.shape[0]-1
+        vs=_occupied_(H,Hs,grid[:-1,:-1],self.mu)
+        if self.axis==0: vs=np.swapaxes(vs,0,1)
+        phases=np.ones(vs.shape[2]) if rcoords is None else np.exp(-1j*np.dot(rcoords,n*(d1 if self.axis==0 else d2)))
+        wccs=-wilson_loops(np.concatenate([vs,phases[:,np.newaxis]*vs[:,0:1]],axis=1))/2/np.pi
+        result=np.zeros((wccs.shape[0],wccs.shape[1]+1))
+        result[:,0]=np.arange(wccs.shape[0])*1.0/wccs.shape[0]-0.5
+        result[:,1:]=np.sort(np.where(wccs>=0.5,wccs-1,wccs),axis=-1)
+        return result
+
+    @staticmethod
+    def z2(result):
+        '''
+        The Z2 index from the flow of the Wannier charge centers of a time-reversal invariant system.
+
+        Parameters
+        ----------
+        result : 2d ndarray
+            The Wannier charge centers returned by `WCC.set`, whose number of lines should be even.
+
+        Returns
+        -------
+        int
+            The Z2 index.
+
+        Notes
+        -----
+        Over the half of the lines between the two time-reversal invariant ones, the parity of the number of times that the centers jump over the midpoint of their largest gap is counted along the shorter arc between the midpoints of neighbouring lines (PRB 83, 235401 (2011)).
+        '''
+        nline=result.shape[0]
+        assert nline%2==0
+        wccs=np.sort(np.concatenate([result[nline/2:,1:],result[0:1,1:]])%1.0,axis=1)
+        gaps=np.diff(np.concatenate([wccs,wccs[:,0:1]+1],axis=1),axis=1)
+        pos=gaps.argmax(axis=1)
+        zs=(wccs[np.arange(len(wccs)),pos]+gaps[np.arange(len(wccs)),pos]/2)%1.0
+        ds=((zs[1:]-zs[:-1]+0.5)%1.0-0.5)[:,np.newaxis]
+        xs=((wccs[1:]-zs[:-1,np.newaxis])*np.sign(ds))%1.0
+        return int(((xs>0)&(xs<np.abs(ds))).sum()%2)
+
 class GP(App):
     '''
     Grand potential.
@@ -14,7 +14,7 @@ from Basis import *
 from scipy.sparse import *
 from numba import jit
 
-def foptrep(operator,basis,transpose=False,dtype=np.complex128):
+def foptrep(operator,basis,transpose=False,dtype=np.complex128,rows=None):
     '''
     This function returns the csr_formed or csc_formed sparse matrix representation of an operator on the occupation number basis.
 
@@ -29,6 +29,8 @@ def foptrep(operator,basis,transpose=False,dtype=np.complex128):
         A flag to tag which form of sparse matrix the result is used. True for csr-formed and False for csc-formed.
     dtype : dtype, optional
         The data type of the non-zero values of the returned sparse matrix.
+    rows : 2-tuple of int, optional
+        When assigned, only the rows within [rows[0],rows[1]) of the csr-formed representation are constructed.
 
     Returns
     -------
@@ -42,20 +44,22 @@ def foptrep(operator,basis,transpose=False,dtype=np.complex128):
     '''
     value,nambus,seqs=operator.value,(np.array([index.nambu for index in operator.indices])>0)[::-1],np.array(operator.seqs)[::-1]
     if operator.rank%2==0:
-        content=foptrep_even(value,nambus,seqs,basis.table,basis.nbasis,dtype)
-        result=csr_matrix(content,shape=(basis.nbasis,basis.nbasis))
+        start,stop=(0,basis.nbasis) if rows is None else rows
+        content=foptrep_even(value,nambus,seqs,basis.table,start,stop,dtype)
+        result=csr_matrix(content,shape=(stop-start,basis.nbasis))
     else:
         assert len(basis)==2
-        content=foptrep_odd(value,nambus,seqs,basis[0].table,basis[1].table,basis[0].nbasis,dtype)
-        result=csr_matrix(content,shape=(basis[0].nbasis,basis[1].nbasis))
+        start,stop=(0,basis[0].nbasis) if rows is None else rows
+        content=foptrep_odd(value,nambus,seqs,basis[0].table,basis[1].table,start,stop,dtype)
+        result=csr_matrix(content,shape=(stop-start,basis[1].nbasis))
     return result.T if transpose else result
 
 @jit
-def foptrep_even(value,nambus,seqs,table,nbasis,dtype):
-    ndata,data,indices,indptr=0,np.zeros(nbasis,dtype=dtype),np.zeros(nbasis,dtype=np.int32),np.zeros(nbasis+1,dtype=np.int32)
+def foptrep_even(value,nambus,seqs,table,start,stop,dtype):
+    ndata,data,indices,indptr=0,np.zeros(stop-start,dtype=dtype),np.zeros(stop-start,dtype=np.int32),np.zeros(stop-start+1,dtype=np.int32)
     eye,temp=long(1),np.zeros(len(seqs)+1,dtype=np.int64)
-    for i in xrange(nbasis):
-        indptr[i]=ndata
+    for i in xrange(start,stop):
+        indptr[i-start]=ndata
         temp[0]=i if len(table)==0 else table[i]
         for j in xrange(len(seqs)):
             if bool(temp[j]&eye<<seqs[j])==nambus[j]: break
@@ -72,11 +76,11 @@ def foptrep_even(value,nambus,seqs,table,nbasis,dtype):
     return data,indices,indptr
 
 @jit
-def foptrep_odd(value,nambus,seqs,table1,table2,nbasis,dtype):
-    ndata,data,indices,indptr=0,np.zeros(nbasis,dtype=dtype),np.zeros(nbasis,dtype=np.int32),np.zeros(nbasis+1,dtype=np.int32)
+def foptrep_odd(value,nambus,seqs,table1,table2,start,stop,dtype):
+    ndata,data,indices,indptr=0,np.zeros(stop-start,dtype=dtype),np.zeros(stop-start,dtype=np.int32),np.zeros(stop-start+1,dtype=np.int32)
     eye,temp=long(1),np.zeros(len(seqs)+1,dtype=np.int64)
-    for i in xrange(nbasis):
-        indptr[i]=ndata
+    for i in xrange(start,stop):
+        indptr[i-start]=ndata
         temp[0]=i if len(table1)==0 else table1[i]
         for j in xrange(len(seqs)):
             if bool(temp[j]&eye<<seqs[j])==nambus[j]: break
@@ -6,10 +6,10 @@ Utilities
 The utilities of the subpackage, including:
     * constants: RZERO
     * classes: Arithmetic, Timer, Timers, Sheet, Log
-    * functions: parity, berry_curvature, berry_phase, decimaltostr, ordinal, mpirun
+    * functions: parity, berry_curvature, berry_flux, berry_phase, wilson_loops, decimaltostr, ordinal, mpirun
 '''
 
-__all__=['RZERO','Arithmetic','Timer','Timers','Sheet','Log','parity','berry_curvature','berry_phase','decimaltostr','ordinal','mpirun']
+__all__=['RZERO','Arithmetic','Timer','Timers','Sheet','Log','parity','berry_curvature','berry_flux','berry_phase','wilson_loops','decimaltostr','ordinal','mpirun']
 
 from copy import copy
 from mpi4py import MPI
@@ -849,6 +849,29 @@ def berry_curvature(H,kx,ky,mu,d=10**-6):
                 result-=2*(np.vdot(np.dot(Vx,Evs[:,n]),Evs[:,m])*np.vdot(Evs[:,m],np.dot(Vy,Evs[:,n]))/(Es[n]-Es[m])**2).imag
     return result
 
+def berry_flux(vs):
+    '''
+    Calculate the Berry fluxes of some bands through the plaquettes of a 2D mesh using the Fukui-Hatsugai-Suzuki method (JPSJ 74, 1674 (2005)).
+
+    Parameters
+    ----------
+    vs : 4d ndarray
+        The eigenvectors of the bands on the vertices of the mesh, with the shape (n1+1,n2+1,ndim,nband).
+
+    Returns
+    -------
+    2d ndarray
+        The Berry fluxes through the plaquettes, with the shape (n1,n2).
+
+    Notes
+    -----
+    The link variables are the determinants of the overlap matrices of the bands between neighbouring vertices.
+    The flux through a plaquette is the phase of the product of the link variables around it, which is independent of the gauges of the eigenvectors.
+    '''
+    overlap=lambda v1,v2: np.linalg.det(np.matmul(np.swapaxes(v1.conjugate(),-1,-2),v2))
+    u1,u2=overlap(vs[:-1,:],vs[1:,:]),overlap(vs[:,:-1],vs[:,1:])
+    return np.angle(u1[:,:-1]*u2[1:,:]*u1[:,1:].conjugate()*u2[:-1,:].conjugate())
+
 def berry_phase(H,path,ns):
     '''
     Calculate the Berry phase of some bands of a Hamiltonian along a certain path.
@@ -882,6 +905,31 @@ def berry_phase(H,path,ns):
             result[j]*=np.vdot(old[:,j],evs[:,j])
     return np.angle(result)/np.pi
 
+def wilson_loops(vs):
+    '''
+    Calculate the eigenphases of the Wilson loops of some bands along a batch of closed lines.
+
+    Parameters
+    ----------
+    vs : 4d ndarray
+        The eigenvectors of the bands on the points of the lines, with the shape (nline,npoint+1,ndim,nband), the last point of each line being the periodic image of the first one.
+
+    Returns
+    -------
+    2d ndarray
+        The sorted eigenphases in the interval (-pi,pi] of the Wilson loops, one row for each line.
+
+    Notes
+    -----
+    The Wilson loop of a line is the ordered product of the overlap matrices of the bands between neighbouring points, whose eigenphases reduce to `pi*berry_phase` for a single band.
+    The overlap matrices of all the links are computed at once and multiplied pairwise in `log2(npoint)` stacked steps.
+    '''
+    ms=np.matmul(np.swapaxes(vs[:,:-1].conjugate(),-1,-2),vs[:,1:])
+    while ms.shape[1]>1:
+        head=np.matmul(ms[:,0:ms.shape[1]-1:2],ms[:,1::2])
+        ms=np.concatenate([head,ms[:,-1:]],axis=1) if ms.shape[1]%2==1 else head
+    return np.sort(np.angle(np.linalg.eigvals(ms[:,0])),axis=-1)
+
 def decimaltostr(number,n=5):
     '''
     Convert a number to string.
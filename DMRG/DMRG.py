@@ -323,7 +323,7 @@ class DMRG(Engine):
         self.target=next(iter(mps[-1].labels[MPS.R].qns)) if mps.mode=='QN' else None
         self.set_Hs_()
 
-    def iterate(self,info='',sp=True,nmax=200,tol=hm.TOL,piechart=True):
+    def iterate(self,info='',sp=True,nmax=200,tol=hm.TOL,piechart=True,method='arpack'):
         '''
         The two site dmrg step.
 
@@ -339,6 +339,8 @@ class DMRG(Engine):
             The tolerance of the singular values.
         piechart : logical, optional
             True for showing the piechart of self.timers while False for not.
+        method : 'arpack' or 'lobpcg', optional
+            The eigensolver, 'arpack' for the ARPACK Lanczos solver and 'lobpcg' for the block solver.
         '''
         self.log<<'%s%s\n%s\n'%(self.state,info,self.graph)
         eold=self.info['Esite']
@@ -415,7 +417,7 @@ class DMRG(Engine):
                 v0=np.asarray(contract([u,s,v],engine='einsum').merge(([La,Sa],Lsys,syspt),([Sb,Rb],Lenv,envpt))).reshape(-1)[subslice]
             else:
                 v0=None
-            es,vs=hm.eigsh(matrix,which='SA',v0=v0,k=1)
+            es,vs=hm.eigsh(matrix,which='SA',v0=v0,k=1,method=method)
             energy,Psi=es[0],vs[:,0]
             self.info['Etotal']=energy,'%.6f'
             self.info['Esite']=energy/self.mps.nsite,'%.8f'
@@ -588,7 +590,7 @@ class DMRG(Engine):
             The info passed to self.log.
         path : list of str, optional
             The path along which the sweep is performed.
-        karg : 'nmax','tol','piechart'
+        karg : 'nmax','tol','piechart','method'
             See DMRG.iterate for details.
         '''
         for move in it.chain(['<<']*(self.mps.cut-1),['>>']*(self.mps.nsite-2),['<<']*(self.mps.nsite-self.mps.cut-1)) if path is None else path:
@@ -4,19 +4,19 @@ Exact diagonalization
 =====================
 
 Base class for exact diagonalization, including:
-    * classes: ED, EL, BGF, GF, EIGS
-    * functions: EDEIGS, EDEL, EDGFP, EDGF, EDDOS
+    * classes: ED, EL, BGF, GF, EIGS, KPM
+    * functions: EDEIGS, EDEL, gfckey, gfcdump, gfcload, EDGFP, EDGF, EDDOS, EDKPM
 '''
 
-__all__=['ED','EIGS','EDEIGS','EL','EDEL','BGF','GF','EDGFP','EDGF','EDDOS']
+__all__=['ED','EIGS','EDEIGS','EL','EDEL','BGF','GF','gfckey','gfcdump','gfcload','EDGFP','EDGF','EDDOS','KPM','EDKPM']
 
 import numpy as np
-import pickle as pk
 import scipy.linalg as sl
 import HamiltonianPy as HP
 import HamiltonianPy.Misc as HM
 import matplotlib.pyplot as plt
 import os,sys,time
+import hashlib,struct,tempfile,zipfile
 from mpi4py import MPI
 
 class ED(HP.Engine):
@@ -41,6 +41,11 @@ class ED(HP.Engine):
         The generator of the Hamiltonian.
     operators : Operators
         The operators of the Hamiltonian.
+    ooc : dict
+        The out-of-core settings of the matrix representation of the Hamiltonian, None for in-core matrices. Its entries are
+            * 'nrow': int, the number of rows of each chunk;
+            * 'dir': str, optional, the scratch directory of the chunks;
+            * 'nthread': int, optional, the number of threads used in the multiplications.
     timers : Timers
         The timers of the ED processes.
 
@@ -60,6 +65,7 @@ class ED(HP.Engine):
         Constructor.
         '''
         result=HP.Engine.__new__(cls,*arg,**karg)
+        result.ooc=karg.get('ooc',None)
         result.timers=HP.Timers('Matrix','ES')
         return result
 
@@ -90,7 +96,7 @@ class ED(HP.Engine):
         '''
         raise NotImplementedError("%s matrix err: not implemented."%self.__class__.__name__)
 
-    def eigs(self,sector,v0=None,k=1,return_eigenvectors=False,reset_matrix=True,reset_timers=True,show_evs=True):
+    def eigs(self,sector,v0=None,k=1,return_eigenvectors=False,reset_matrix=True,reset_timers=True,show_evs=True,method='arpack'):
         '''
         Lowest k eigenvalues and optionally, the corresponding eigenvectors.
 
@@ -110,6 +116,8 @@ class ED(HP.Engine):
             True for resetting the timers and False for not.
         show_evs : logical, optional
             True for showing the calculated eigenvalues and False for not.
+        method : 'arpack' or 'lobpcg', optional
+            The eigensolver, 'arpack' for the ARPACK Lanczos solver and 'lobpcg' for the block solver.
 
         Returns
         -------
@@ -131,7 +139,7 @@ class ED(HP.Engine):
             for i,sector in enumerate(self.sectors):
                 with self.timers.get('Matrix'): matrix=self.matrix(sector,reset=reset_matrix)
                 V0=None if v0 is None or matrix.shape[0]!=v0.shape[0] else v0
-                with self.timers.get('ES'): eigs=HM.eigsh(matrix,v0=V0,k=min(k,matrix.shape[0]),which='SA',return_eigenvectors=return_eigenvectors)
+                with self.timers.get('ES'): eigs=HM.eigsh(matrix,v0=V0,k=min(k,matrix.shape[0]),which='SA',return_eigenvectors=return_eigenvectors,method=method)
                 self.timers.record()
                 sectors.extend([sector]*min(k,matrix.shape[0]))
                 es.extend(eigs[0] if return_eigenvectors else eigs)
@@ -153,7 +161,7 @@ class ED(HP.Engine):
             with self.timers.get('Matrix'): matrix=self.matrix(sector,reset=reset_matrix)
             self.log<<'::<Information>:: sector=%s, nopt=%s, dim=%s, nnz=%s, '%(sector,len(self.operators),matrix.shape[0],matrix.nnz)
             V0=None if v0 is None or matrix.shape[0]!=v0.shape[0] else v0
-            with self.timers.get('ES'): eigs=HM.eigsh(matrix,v0=V0,k=k,which='SA',return_eigenvectors=return_eigenvectors)
+            with self.timers.get('ES'): eigs=HM.eigsh(matrix,v0=V0,k=k,which='SA',return_eigenvectors=return_eigenvectors,method=method)
             self.timers.record()
             sectors=[sector]*k
             es=eigs[0] if return_eigenvectors else eigs
@@ -177,9 +185,11 @@ class EIGS(HP.App):
         The number of lowest eigen values to compute.
     evon : logical
         True for calculating the eigenvectors and False for not.
+    method : 'arpack' or 'lobpcg'
+        The eigensolver.
     '''
 
-    def __init__(self,sector=None,ne=1,evon=True,**karg):
+    def __init__(self,sector=None,ne=1,evon=True,method='arpack',**karg):
         '''
         Constructor.
 
@@ -191,17 +201,20 @@ class EIGS(HP.App):
             The number of lowest eigen values to compute.
         evon : logical, optional
             True for calculating the eigenvectors and False for not.
+        method : 'arpack' or 'lobpcg', optional
+            The eigensolver.
         '''
         super(EIGS,self).__init__(**karg)
         self.sector=sector
         self.ne=ne
         self.evon=evon
+        self.method=method
 
 def EDEIGS(engine,app):
     '''
     This method calculates the lowest eigenvalues and optionally the corresponding eigenvectors of the engine.
     '''
-    eigs=engine.eigs(sector=app.sector,k=app.ne,return_eigenvectors=app.evon,reset_matrix=True,reset_timers=True)
+    eigs=engine.eigs(sector=app.sector,k=app.ne,return_eigenvectors=app.evon,reset_matrix=True,reset_timers=True,method=app.method)
     engine.log<<'::<Time>:: matrix=%.4es, gse=%.4es\n'%(engine.timers.time('Matrix'),engine.timers.time('ES'))
     engine.log<<HP.Sheet(
                     corner=     'Energy',
@@ -223,9 +236,11 @@ class EL(HP.EB):
         The order of derivatives to be computed.
     ns : integer
         The number of energy levels.
+    method : 'arpack' or 'lobpcg'
+        The eigensolver.
     '''
 
-    def __init__(self,sector=None,nder=0,ns=6,**karg):
+    def __init__(self,sector=None,nder=0,ns=6,method='arpack',**karg):
         '''
         Constructor.
 
@@ -237,11 +252,14 @@ class EL(HP.EB):
             The order of derivatives to be computed.
         ns : integer, optional
             The number of energy levels.
+        method : 'arpack' or 'lobpcg', optional
+            The eigensolver.
         '''
         super(EL,self).__init__(**karg)
         self.sector=sector
         self.nder=nder
         self.ns=ns
+        self.method=method
 
 def EDEL(engine,app):
     '''
@@ -252,7 +270,7 @@ def EDEL(engine,app):
     result[:,0]=app.path.mesh(0) if len(app.path.tags)==1 and app.path.mesh(0).ndim==1 else np.array(xrange(app.path.rank(0)))
     for i,paras in enumerate(app.path('+')):
         engine.update(**paras)
-        result[i,1:app.ns+1]=engine.eigs(sector=app.sector,k=app.ns,return_eigenvectors=False,reset_matrix=True if i==0 else False,reset_timers=True if i==0 else False)[1]
+        result[i,1:app.ns+1]=engine.eigs(sector=app.sector,k=app.ns,return_eigenvectors=False,reset_matrix=True if i==0 else False,reset_timers=True if i==0 else False,method=app.method)[1]
         engine.log<<'%s\n\n'%engine.timers.tostr(HP.Timers.ALL)
         if app.plot: engine.timers.graph(parents=HP.Timers.ALL)
     else:
@@ -308,6 +326,32 @@ class BGF(object):
         self.controllers={'sign':sign,'matrix':matrix,'operators':operators}
         self.data={}
 
+    @staticmethod
+    def fromdata(method,indices,data):
+        '''
+        Construct a block directly from its cached data.
+
+        Parameters
+        ----------
+        method : 'S' or 'B'
+            'S' for simple Lanczos method and 'B' for block Lanczos method.
+        indices : 1d ndarray
+            The block's indices in the Green's function.
+        data : dict
+            The cached data to calculate the block valus of the Green's function.
+
+        Returns
+        -------
+        BGF
+            The constructed block.
+        '''
+        assert method in ('S','B')
+        result=BGF.__new__(BGF)
+        result.method=method
+        result.indices=indices
+        result.data=data
+        return result
+
     def prepare(self,groundstate,nstep):
         '''
         Prepare the lanczos representation of the block.
@@ -426,22 +470,51 @@ class BGF(object):
 
         Parameters
         ----------
-        omega : number
-            The frequency.
+        omega : number or 1d ndarray
+            The frequency/frequencies.
 
         Returns
         -------
-        2d ndarray
-            The values of the block.
+        2d ndarray or 3d ndarray
+            The values of the block. When `omega` is an array, the first axis runs over the frequencies.
         '''
         if self.method=='S':
             niters,Lambdas,Qs,QTs=self.data['niters'],self.data['Lambdas'],self.data['Qs'],self.data['QTs']
-            result=np.zeros((Lambdas.shape[0],Lambdas.shape[0]),dtype=np.complex128)
-            for i in xrange(Lambdas.shape[0]):
-                result[i,:]=(Qs[i,:,0:niters[i]]/(omega-Lambdas[i,0:niters[i]])[np.newaxis,:]).dot(QTs[i,0:niters[i]])
+            if np.ndim(omega)==0:
+                result=np.zeros((Lambdas.shape[0],Lambdas.shape[0]),dtype=np.complex128)
+                for i in xrange(Lambdas.shape[0]):
+                    result[i,:]=(Qs[i,:,0:niters[i]]/(omega-Lambdas[i,0:niters[i]])[np.newaxis,:]).dot(QTs[i,0:niters[i]])
+            else:
+                mask=np.arange(Lambdas.shape[1])[np.newaxis,:]<niters[:,np.newaxis]
+                weights=(Qs*np.where(mask,QTs,0)[:,np.newaxis,:]).transpose(0,2,1)
+                denominators=np.where(mask[np.newaxis,:,:],np.asarray(omega)[:,np.newaxis,np.newaxis]-Lambdas[np.newaxis,:,:],1.0)
+                result=np.matmul(np.where(mask[np.newaxis,:,:],1.0/denominators,0.0).transpose(1,0,2),weights).transpose(1,0,2)
             return result
         else:
-            return (self.data['Q']/(omega-self.data['Lambda'])[np.newaxis,:]).dot(self.data['QT'])
+            if np.ndim(omega)==0:
+                return (self.data['Q']/(omega-self.data['Lambda'])[np.newaxis,:]).dot(self.data['QT'])
+            else:
+                return np.matmul(self.data['Q'][np.newaxis,:,:]/(np.asarray(omega)[:,np.newaxis]-self.data['Lambda'][np.newaxis,:])[:,np.newaxis,:],self.data['QT'])
+
+    def poles(self):
+        '''
+        The pole representation of the block.
+
+        Returns
+        -------
+        Lambda : 1d ndarray
+            The poles of the block.
+        L,R : 2d ndarray
+            The left and right factors of the residues, so that the block equals ``L.dot(np.diag(1/(omega-Lambda))).dot(R)``.
+        '''
+        if self.method=='S':
+            niters,Lambdas,Qs,QTs=self.data['niters'],self.data['Lambdas'],self.data['Qs'],self.data['QTs']
+            rows,cols=np.nonzero(np.arange(Lambdas.shape[1])[np.newaxis,:]<niters[:,np.newaxis])
+            L=np.zeros((Lambdas.shape[0],len(rows)),dtype=QTs.dtype)
+            L[rows,np.arange(len(rows))]=QTs[rows,cols]
+            return Lambdas[rows,cols],L,Qs[rows,:,cols]
+        else:
+            return self.data['Lambda'],self.data['Q'],self.data['QT']
 
 class GF(HP.GF):
     '''
@@ -487,15 +560,113 @@ class GF(HP.GF):
         self.nstep=nstep
         self.method=method
 
+GFC_VERSION=1
+
+def gfckey(engine,app):
+    '''
+    The content-addressed key of the cached coefficients of a Green's function.
+
+    Parameters
+    ----------
+    engine : ED
+        The engine.
+    app : GF
+        The Green's function.
+
+    Returns
+    -------
+    str
+        The key, which is the sha1 digest of the parameters and terms of the generators, the lattice geometry, the basis and the operators of the Green's function.
+    '''
+    contents=[GFC_VERSION,engine.__class__.__name__,np.dtype(engine.dtype).name,app.method,app.nstep]
+    for key,value in engine.parameters.iteritems(): contents.extend([key,np.asarray(value)])
+    for name,generator in sorted((name,value) for name,value in vars(engine).iteritems() if isinstance(value,HP.Generator)):
+        for term in generator.terms['const']+generator.terms['alter']: contents.extend([name,term.id,np.asarray(term.value)])
+    for operator in sorted(engine.operators.itervalues(),key=lambda operator: repr(operator.id)): contents.extend([operator.id,np.asarray(operator.value)])
+    contents.extend([engine.lattice.pids,np.asarray(engine.lattice.rcoords,dtype=np.float64),np.asarray(engine.lattice.icoords,dtype=np.float64),np.asarray(engine.lattice.vectors,dtype=np.float64)])
+    contents.extend(sorted('%r:%r'%(pid,internal) for pid,internal in engine.config.iteritems()))
+    contents.extend(sorted(repr(sector) for sector in engine.sectors))
+    for operator in app.operators: contents.extend([operator.id,np.asarray(operator.value)])
+    result=hashlib.sha1()
+    for content in contents:
+        result.update(np.ascontiguousarray(content).tobytes() if isinstance(content,np.ndarray) else repr(content))
+    return result.hexdigest()
+
+def gfcdump(path,gse,blocks):
+    '''
+    Dump the coefficients of a Green's function into an npz store atomically.
+
+    Parameters
+    ----------
+    path : str
+        The path of the store.
+    gse : number
+        The groundstate energy.
+    blocks : list of BGF
+        The blocks of the Green's function.
+    '''
+    data={'version':np.array(GFC_VERSION),'gse':np.array(gse),'methods':np.array([block.method for block in blocks])}
+    for i,block in enumerate(blocks):
+        data['%s_indices'%i]=np.asarray(block.indices)
+        for key,value in block.data.iteritems(): data['%s_%s'%(i,key)]=value
+    fd,temp=tempfile.mkstemp(suffix='.tmp',dir=os.path.dirname(os.path.abspath(path)))
+    with os.fdopen(fd,'wb') as fout:
+        np.savez(fout,**data)
+        fout.flush()
+        os.fsync(fout.fileno())
+    try:
+        os.rename(temp,path)
+    except OSError:
+        os.remove(path)
+        os.rename(temp,path)
+
+def gfcload(path):
+    '''
+    Load the coefficients of a Green's function from an npz store, with the arrays of the blocks memory-mapped.
+
+    Parameters
+    ----------
+    path : str
+        The path of the store.
+
+    Returns
+    -------
+    None or tuple
+        None if the store does not exist or is stale, otherwise
+        * gse : number
+            The groundstate energy.
+        * blocks : list of BGF
+            The blocks of the Green's function.
+    '''
+    if not os.path.isfile(path): return None
+    data={}
+    with zipfile.ZipFile(path) as fzip, open(path,'rb') as fin:
+        for info in fzip.infolist():
+            fin.seek(info.header_offset)
+            header=fin.read(30)
+            fin.seek(info.header_offset+30+sum(struct.unpack('<HH',header[26:30])))
+            version=np.lib.format.read_magic(fin)
+            shape,fortran,dtype=(np.lib.format.read_array_header_1_0 if version==(1,0) else np.lib.format.read_array_header_2_0)(fin)
+            if info.compress_type==zipfile.ZIP_STORED and len(shape)>0 and np.prod(shape)>0 and not dtype.hasobject:
+                data[info.filename[:-4]]=np.memmap(path,dtype=dtype,mode='r',offset=fin.tell(),shape=shape,order='F' if fortran else 'C')
+            else:
+                data[info.filename[:-4]]=np.lib.format.read_array(fzip.open(info.filename))
+    if 'version' not in data or data['version']!=GFC_VERSION: return None
+    blocks=[]
+    for i,method in enumerate(data['methods']):
+        prefix='%s_'%i
+        blocks.append(BGF.fromdata(str(method),np.asarray(data[prefix+'indices']),{key[len(prefix):]:value for key,value in data.iteritems() if key.startswith(prefix) and key!=prefix+'indices'}))
+    return data['gse'][()],blocks
+
 def EDGFP(engine,app):
     '''
     This method prepares the GF.
     '''
-    if os.path.isfile('%s/%s_coeff.dat'%(engine.din,engine.tostr(ndecimal=14))):
+    path='%s/%s_coeff.npz'%(engine.din,gfckey(engine,app))
+    coeff=gfcload(path)
+    if coeff is not None:
         engine.log<<'::<Parameters>:: %s\n'%(', '.join('%s=%s'%(key,HP.decimaltostr(value,n=10)) for key,value in engine.parameters.iteritems()))
-        with open('%s/%s_coeff.dat'%(engine.din,engine.tostr(ndecimal=14)),'rb') as fin:
-            app.gse=pk.load(fin)
-            app.blocks=pk.load(fin)
+        app.gse,app.blocks=coeff
         return
     sectors,es,vs=engine.eigs(sector=None,v0=app.v0,k=1,return_eigenvectors=True,reset_matrix=True,reset_timers=True)
     engine.sector,app.gse,app.v0=sectors[0],es[0],vs[0]
@@ -532,10 +703,7 @@ def EDGFP(engine,app):
     for key in ['Preparation','Iteration','Diagonalization','Total']:
         info[('Summary',key)]=timers.time(key),'%.5e'
     engine.log<<'%s\n%s\n'%(info.rowtostr('Summary'),info.frame())
-    if app.savedata:
-        with open('%s/%s_coeff.dat'%(engine.din,engine.tostr(ndecimal=14)),'wb') as fout:
-            pk.dump(app.gse,fout,2)
-            pk.dump(app.blocks,fout,2)
+    if app.savedata: gfcdump(path,app.gse,app.blocks)
 
 def EDGF(engine,app):
     '''
@@ -565,3 +733,45 @@ def EDDOS(engine,app):
     if app.savedata: np.savetxt('%s/%s.dat'%(engine.dout,name),result)
     if app.plot: app.figure('L',result,'%s/%s'%(engine.dout,name))
     if app.returndata: return result
+
+class KPM(HP.KPM):
+    '''
+    Many-body density of states by the kernel polynomial method.
+
+    Attributes
+    ----------
+    sector : any hashable object
+        The sector of the density of states. When None, the contributions of all the sectors are summed.
+    '''
+
+    def __init__(self,sector=None,**karg):
+        '''
+        Constructor.
+
+        Parameters
+        ----------
+        sector : any hashable object, optional
+            The sector of the density of states.
+        '''
+        super(KPM,self).__init__(**karg)
+        self.sector=sector
+
+def EDKPM(engine,app):
+    '''
+    This method calculates the many-body density of states by the kernel polynomial method.
+    '''
+    sectors=engine.sectors.keys() if app.sector is None else [app.sector]
+    if len(sectors)>1 and (app.emin is None or app.emax is None): raise ValueError('EDKPM error: emin and emax must be given for more than one sector.')
+    result=0
+    for sector in sectors:
+        data=app.set(engine.matrix(sector,reset=True))
+        if len(sectors)>1: data[:,2]=data[:,2]**2
+        result+=data
+    if len(sectors)>1:
+        result[:,0]/=len(sectors)
+        result[:,2]=np.sqrt(result[:,2])
+    engine.log<<'::<KPM>:: nmoment=%s, nvector=%s, maximum stochastic error=%.4e\n'%(app.nmoment,app.nvector,result[:,2].max())
+    name='%s_%s'%(engine,app.name)
+    if app.savedata: np.savetxt('%s/%s.dat'%(engine.dout,name),result)
+    if app.plot: app.figure('L',result[:,0:2],'%s/%s'%(engine.dout,name))
+    if app.returndata: return result
@@ -5,10 +5,10 @@ Fermionic exact diagonalization
 
 Exact diagonalization for fermionic systems, including:
     * classes: FED
-    * functions: fedspgen, fedspcom, FGF
+    * functions: fedspgen, fedspcom, fedsppoles, FGF
 '''
 
-__all__=['FED','fedspgen','fedspcom','FGF']
+__all__=['FED','fedspgen','fedspcom','fedsppoles','FGF']
 
 from ED import *
 from copy import deepcopy
@@ -17,6 +17,7 @@ import HamiltonianPy as HP
 import HamiltonianPy.Misc as HM
 import HamiltonianPy.FreeSystem as TBA
 import numpy as np
+import scipy.sparse as sp
 
 class FED(ED):
     '''
@@ -64,14 +65,46 @@ class FED(ED):
 
         Returns
         -------
-        csr_matrix
+        csr_matrix or OOCCSR
             The matrix representation of the Hamiltonian.
         '''
+        if self.ooc is not None: return self.oocmatrix(sector)
         if reset: self.generator.set_matrix(sector,HP.foptrep,self.sectors[sector],transpose=False,dtype=self.dtype)
         self.sector=sector
         matrix=self.generator.matrix(sector)
         return matrix.T+matrix.conjugate()
 
+    def oocmatrix(self,sector):
+        '''
+        The out-of-core matrix representation of the Hamiltonian.
+
+        Parameters
+        ----------
+        sector : str
+            The sector of the matrix representation of the Hamiltonian.
+
+        Returns
+        -------
+        OOCCSR
+            The matrix representation of the Hamiltonian.
+
+        Notes
+        -----
+        The chunks are generated one by one, and each chunk is built from the rows of the representations of the operators and their Hermitian conjugates,
+        so that the cost does not grow with the number of chunks and only one chunk stays in memory.
+        '''
+        self.sector=sector
+        basis=self.sectors[sector]
+        operators=[operator for operator in self.operators.itervalues()]+[operator.dagger for operator in self.operators.itervalues()]
+        def chunks():
+            for start in xrange(0,basis.nbasis,self.ooc['nrow']):
+                rows=(start,min(start+self.ooc['nrow'],basis.nbasis))
+                ms=[HP.foptrep(operator,basis,transpose=False,dtype=self.dtype,rows=rows) for operator in operators]
+                data=np.concatenate([m.data for m in ms]).conjugate()
+                indices=np.concatenate([np.repeat(np.arange(rows[1]-rows[0]),np.diff(m.indptr)) for m in ms]),np.concatenate([m.indices for m in ms])
+                yield sp.coo_matrix((data,indices),shape=(rows[1]-rows[0],basis.nbasis)).tocsr()
+        return HM.OOCCSR(chunks(),shape=(basis.nbasis,basis.nbasis),dtype=self.dtype,dir=self.ooc.get('dir',None),nthread=self.ooc.get('nthread',None))
+
     def __replace_basis__(self,nambu,spin):
         '''
         Return a new ED instance with the basis replaced.
@@ -180,21 +213,68 @@ def fedspcom(blocks,omega):
     ----------
     blocks : list of BGF
         The blocks of the Green's function.
-    omega : number
-        The frequency.
+    omega : number or 1d ndarray
+        The frequency/frequencies.
 
     Returns
     -------
-    2d ndarray
-        The composed Green's function.
+    2d ndarray or 3d ndarray
+        The composed Green's function. When `omega` is an array, the first axis runs over the frequencies.
     '''
     assert len(blocks) in (2,4)
     if len(blocks)==2:
-        return blocks[0].gf(omega).T+blocks[1].gf(omega)
+        return np.swapaxes(blocks[0].gf(omega),-1,-2)+blocks[1].gf(omega)
+    else:
+        gfdw,indsdw=np.swapaxes(blocks[0].gf(omega),-1,-2)+blocks[1].gf(omega),blocks[0].indices
+        gfup,indsup=np.swapaxes(blocks[2].gf(omega),-1,-2)+blocks[3].gf(omega),blocks[2].indices
+        if gfdw.ndim==2:
+            result=HM.block_diag(gfdw,gfup)
+        else:
+            ndw,nup=gfdw.shape[-1],gfup.shape[-1]
+            result=np.zeros(gfdw.shape[:-2]+(ndw+nup,ndw+nup),dtype=np.find_common_type([gfdw.dtype,gfup.dtype],[]))
+            result[...,:ndw,:ndw]=gfdw
+            result[...,ndw:,ndw:]=gfup
+        return HM.reorder(result,axes=[-2,-1],permutation=np.argsort(np.concatenate((indsdw,indsup))))
+
+def fedsppoles(blocks,tol=10**-8):
+    '''
+    This function composes the pole representation of the zero-temperature single-particle Green's function of a fermionic system from its blocks.
+
+    Parameters
+    ----------
+    blocks : list of BGF
+        The blocks of the Green's function.
+    tol : float, optional
+        The tolerance to merge degenerate poles and to drop vanishing residues.
+
+    Returns
+    -------
+    Lambda : 1d ndarray
+        The poles of the Green's function.
+    Q : 2d ndarray
+        The factor of the residues, so that the Green's function equals ``Q.dot(np.diag(1/(omega-Lambda))).dot(Q.T.conjugate())``.
+    '''
+    assert len(blocks) in (2,4)
+    parts=[]
+    for i in xrange(0,len(blocks),2):
+        (E1,L1,R1),(E2,L2,R2)=blocks[i].poles(),blocks[i+1].poles()
+        E,L,R=np.concatenate((E1,E2)),np.concatenate((R1.T,L2),axis=1),np.concatenate((L1.T,R2),axis=0)
+        permutation=np.argsort(E)
+        E,L,R=E[permutation],L[:,permutation],R[permutation,:]
+        bounds=np.concatenate(([0],np.nonzero(np.diff(E)>tol)[0]+1,[len(E)]))
+        Lambda,Q=[],[]
+        for start,stop in zip(bounds[:-1],bounds[1:]):
+            residue=L[:,start:stop].dot(R[start:stop,:])
+            es,vs=np.linalg.eigh((residue+residue.T.conjugate())/2)
+            mask=es>tol
+            Lambda.append(np.full(mask.sum(),E[start:stop].mean()))
+            Q.append(vs[:,mask]*np.sqrt(es[mask]))
+        parts.append((np.concatenate(Lambda),np.concatenate(Q,axis=1)))
+    if len(parts)==1:
+        return parts[0]
     else:
-        gfdw,indsdw=blocks[0].gf(omega).T+blocks[1].gf(omega),blocks[0].indices
-        gfup,indsup=blocks[2].gf(omega).T+blocks[3].gf(omega),blocks[2].indices
-        return HM.reorder(HM.block_diag(gfdw,gfup),axes=[0,1],permutation=np.argsort(np.concatenate((indsdw,indsup))))
+        permutation=np.argsort(np.concatenate((blocks[0].indices,blocks[2].indices)))
+        return np.concatenate((parts[0][0],parts[1][0])),HM.block_diag(parts[0][1],parts[1][1])[permutation,:]
 
 def FGF(**karg):
     '''
@@ -1,10 +1,12 @@
 '''
-FED test (1 test in total).
+FED test (4 tests in total).
 '''
 
 __all__=['fed']
 
 import numpy as np
+import os,shutil,tempfile
+import HamiltonianPy.Misc as HM
 from HamiltonianPy import *
 from HamiltonianPy.ED import *
 from unittest import TestCase,TestLoader,TestSuite
@@ -32,6 +34,76 @@ class TestFED(TestCase):
         fed.register(DOS(name='DOS-2',parameters={'U':8.0},mu=4.0,emin=-10,emax=10,ne=501,eta=0.05,savedata=False,run=EDDOS,dependences=['GF']))
         fed.summary()
 
+    def test_gfc(self):
+        print
+        din=tempfile.mkdtemp()
+        def construct(t=-1.0,U=8.0,m=2,n=2,basis=None,nopt=None):
+            basis=FBasis(2*m*n,m*n,0.0) if basis is None else basis
+            lattice=Square('S1')('%sO-%sO'%(m,n))
+            config=IDFConfig(priority=DEFAULT_FERMIONIC_PRIORITY,pids=lattice.pids,map=lambda pid: Fermi(atom=0,norbital=1,nspin=2,nnambu=1))
+            fed=FED(name='WG-GFC',din=din,sectors=[basis],lattice=lattice,config=config,terms=[Hopping('t',t,neighbour=1),Hubbard('U',U)],dtype=np.float64)
+            gf=FGF(name='GF',method='S',operators=fspoperators(config.table(),lattice)[:nopt],nstep=50,savedata=True,prepare=EDGFP,run=EDGF)
+            fed.add(gf)
+            return fed,gf
+        try:
+            fed,gf=construct()
+            key=gfckey(fed,gf)
+            self.assertEqual(key,gfckey(*construct()))
+            for karg in [{'t':-1.0+1e-12},{'U':8.5},{'m':1,'n':4},{'basis':FBasis(8,4,1.0)},{'nopt':4}]:
+                self.assertNotEqual(key,gfckey(*construct(**karg)))
+            path='%s/%s_coeff.npz'%(din,key)
+            self.assertIsNone(gfcload(path))
+            EDGFP(fed,gf)
+            self.assertTrue(os.path.isfile(path))
+            nfed,ngf=construct()
+            ngf.gse,ngf.blocks=None,None
+            EDGFP(nfed,ngf)
+            self.assertEqual(ngf.gse,gf.gse)
+            self.assertTrue(all(isinstance(value,np.memmap) for block in ngf.blocks for key,value in block.data.iteritems() if key!='niters'))
+            omega=0.5+0.1j
+            self.assertTrue(np.allclose(fedspcom(ngf.blocks,omega),fedspcom(gf.blocks,omega)))
+            np.savez(path,version=np.array(0),gse=np.array(gf.gse),methods=np.array([]))
+            self.assertIsNone(gfcload(path))
+        finally:
+            shutil.rmtree(din)
+
+    def test_ooc(self):
+        print
+        t,U,m,n=-1.0,8.0,2,3
+        basis=FBasis(2*m*n,m*n,0.0)
+        lattice=Square('S1')('%sO-%sO'%(m,n))
+        config=IDFConfig(priority=DEFAULT_FERMIONIC_PRIORITY,pids=lattice.pids,map=lambda pid: Fermi(atom=0,norbital=1,nspin=2,nnambu=1))
+        fed=FED(name='WG-OOC',sectors=[basis],lattice=lattice,config=config,terms=[Hopping('t',t,neighbour=1),Hubbard('U',U)],dtype=np.float64)
+        matrix=fed.matrix(basis.rep)
+        fed.ooc={'nrow':33,'nthread':2}
+        ooc=fed.matrix(basis.rep)
+        v=np.random.random(basis.nbasis)
+        self.assertEqual(ooc.nchunk,(basis.nbasis-1)/33+1)
+        self.assertAlmostEqual(np.abs(ooc.dot(v)-matrix.dot(v)).max(),0.0)
+        self.assertAlmostEqual(fed.eigs(basis.rep)[1][0],HM.eigsh(matrix,k=1,which='SA',return_eigenvectors=False)[0])
+        self.assertAlmostEqual(np.abs(ooc.dot(np.identity(basis.nbasis))-matrix.toarray()).max(),0.0)
+        ooc.close()
+
+    def test_kpm(self):
+        print
+        t,U,m,n=-1.0,4.0,2,3
+        basis=FBasis(2*m*n,m*n,0.0)
+        lattice=Square('S1')('%sO-%sO'%(m,n))
+        config=IDFConfig(priority=DEFAULT_FERMIONIC_PRIORITY,pids=lattice.pids,map=lambda pid: Fermi(atom=0,norbital=1,nspin=2,nnambu=1))
+        fed=FED(name='WG-KPM',sectors=[basis],lattice=lattice,config=config,terms=[Hopping('t',t,neighbour=1),Hubbard('U',U)],dtype=np.float64)
+        eigvals=np.linalg.eigvalsh(fed.matrix(basis.rep).toarray())
+        bounds=(eigvals[0]-0.1,eigvals[-1]+0.1)
+        a,b=(bounds[1]-bounds[0])/2,(bounds[1]+bounds[0])/2
+        np.random.seed(3)
+        fed.register(KPM(name='KPM',sector=basis.rep,ne=201,nmoment=128,nvector=32,bounds=bounds,savedata=False,plot=False,run=EDKPM))
+        es,dos,err=fed.records['KPM'].T
+        exact=np.pi*HM.kpmdos(np.cos(np.arange(128)[:,np.newaxis]*np.arccos((eigvals-b)/a)[np.newaxis,:]).sum(axis=1),a,b,es)
+        self.assertTrue(np.all(np.abs(dos-exact)<=5*err+10**-10))
+        fed.ooc={'nrow':97,'nthread':2}
+        np.random.seed(3)
+        fed.register(KPM(name='KPM-OOC',sector=basis.rep,ne=201,nmoment=128,nvector=32,bounds=bounds,savedata=False,plot=False,run=EDKPM))
+        self.assertTrue(np.allclose(fed.records['KPM-OOC'],fed.records['KPM']))
+
 fed=TestSuite([
             TestLoader().loadTestsFromTestCase(TestFED),
             ])
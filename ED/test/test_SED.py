@@ -1,10 +1,12 @@
 '''
-SED test (1 test in total).
+SED test (2 tests in total).
 '''
 
 __all__=['sed']
 
 import numpy as np
+import time
+import HamiltonianPy.Misc as HM
 from HamiltonianPy import *
 from HamiltonianPy.ED import *
 from unittest import TestCase,TestLoader,TestSuite
@@ -32,6 +34,21 @@ class TestSED(TestCase):
         sed.register(EL(name='EL',path=BaseSpace(('h',np.linspace(0.4,0.8,41))),ns=2,nder=0,savedata=False,run=EDEL))
         sed.summary()
 
+    def test_lobpcg(self):
+        print
+        J,k,m,n=1.0,10,4,4
+        lattice=Square('S1')('%sP-%sP'%(m,n))
+        config=IDFConfig(pids=lattice.pids,priority=DEFAULT_SPIN_PRIORITY,map=lambda pid: Spin(S=0.5))
+        qnses=QNSConfig(indices=config.table().keys(),priority=DEFAULT_SPIN_PRIORITY,map=lambda index: SQNS(0.5))
+        sed=SED(name='WG-%s'%lattice.name,lattice=lattice,config=config,qnses=qnses,sectors=[SQN(0.0)],terms=[SpinTerm('J',J,neighbour=1,indexpacks=Heisenberg())],dtype=np.float64)
+        matrix,ess=sed.matrix(SQN(0.0)),[]
+        for method in ['arpack','lobpcg']:
+            operator=HM.LinearOperator(shape=matrix.shape,matvec=matrix.dot,dtype=matrix.dtype)
+            t0=time.time()
+            ess.append(np.sort(HM.eigsh(operator,k=k,which='SA',return_eigenvectors=False,method=method,**({'diagonal':matrix.diagonal()} if method=='lobpcg' else {}))))
+            print '%s: dim=%s, k=%s, time=%.3es, nmatvec=%s'%(method,matrix.shape[0],k,time.time()-t0,operator.count)
+        self.assertAlmostEqual(np.max(np.abs(ess[0]-ess[1])),0.0)
+
 sed=TestSuite([
             TestLoader().loadTestsFromTestCase(TestSED),
             ])
\ No newline at end of file
@@ -5,11 +5,11 @@ Flat band ferromagnets
 
 Spin excitations for flat band ferromagnets, including:
     * constants: FBFM_PRIORITY
-    * classes: FBFMBasis, FBFM, EB
-    * functions: optrep, FBFMEB, FBFMPOS, FBFMBP
+    * classes: FBFMBasis, FBFMOperator, FBFM, EB
+    * functions: optrep, optkernel, FBFMEB, FBFMPOS, FBFMBP
 '''
 
-__all__=['FBFM_PRIORITY','FBFMBasis','optrep','FBFM','EB','FBFMEB','FBFMPOS','FBFMBP']
+__all__=['FBFM_PRIORITY','FBFMBasis','optrep','optkernel','FBFMOperator','FBFM','EB','FBFMEB','FBFMPOS','FBFMBP']
 
 import numpy as np
 import HamiltonianPy as HP
@@ -18,6 +18,7 @@ import scipy.linalg as sl
 import numpy.linalg as nl
 import itertools as it
 import matplotlib.pyplot as plt
+from scipy.sparse.linalg import LinearOperator
 from fmatrix import *
 from collections import OrderedDict
 from fractions import Fraction
@@ -191,6 +192,125 @@ def optrep(operator,k,basis):
     else:
         raise ValueError('optrep error: not supported operator type(%s).'%operator.__class__.__name__)
 
+def optkernel(operator,k,basis):
+    '''
+    The factorized matrix representation of an operator.
+
+    Parameters
+    ----------
+    operator : FOperator or None
+        The operator whose matrix representation is wanted.
+        ``None`` represents the whole single particle Hamiltonian.
+    k : QuantumNumber
+        The quantum-number-formed k point.
+    basis : FBFMBasis
+        The basis of the projected single particle space.
+
+    Returns
+    -------
+    blocks : 3d ndarray
+        The blocks diagonal in the k points of the particle-hole pairs, with the shape (nk,nsp**2,nsp**2).
+    vectors : 2d ndarray
+        The vectors of the coupling between different k points, one column for each vector.
+    coeffs : 1d ndarray
+        The coefficients of the coupling.
+
+    Notes
+    -----
+    The matrix representation equals that of `optrep`, i.e. `blockdiag(blocks)+vectors*diag(coeffs)*vectors^H`.
+    The total momentum is conserved by every operator, and a Hubbard operator only couples the pairs at different k points through a rank-1 term,
+    so that the memory is of the order `nk*nsp**4` instead of `(nk*nsp**2)**2`.
+    '''
+    nk,nsp=basis.nk,basis.nsp
+    permutation=np.array([0]) if basis.BZ is None else np.argsort((basis.BZ-k).sorted(history=True)[1])
+    blocks,vectors,coeffs=np.zeros((nk,nsp**2,nsp**2),dtype=basis.dtype),np.zeros((nk*nsp**2,0),dtype=basis.dtype),np.zeros(0,dtype=basis.dtype)
+    if operator is None:
+        blocks[:,np.arange(nsp**2),np.arange(nsp**2)]=(basis.E1[permutation,:,np.newaxis]-basis.E2[:,np.newaxis,:]).reshape((nk,nsp**2))
+    elif isinstance(operator,HP.FQuadratic):
+        (index1,index2),(seq1,seq2)=operator.indices,operator.seqs
+        assert index1.spin==index2.spin and index1.nambu==HP.CREATION and index2.nambu==HP.ANNIHILATION
+        value,identity=operator.value*(1 if len(k)==0 else np.exp(-1j*np.inner(basis.BZ.kcoord(k),operator.icoord))),np.identity(nsp,dtype=basis.dtype)
+        if index1.spin==(0 if basis.polarization=='up' else 1):
+            ms=basis.U1[seq2,:,:,np.newaxis]*basis.U1[seq1,:,np.newaxis,:].conjugate()
+            blocks+=(value*ms[:,:,np.newaxis,:,np.newaxis]*identity[np.newaxis,np.newaxis,:,np.newaxis,:]).reshape((nk,nsp**2,nsp**2))
+        else:
+            diagsum=(basis.U2[seq1,:,:].conjugate()*basis.U2[seq2,:,:]).sum()
+            ms=diagsum*identity-basis.U2[seq1,:,:,np.newaxis].conjugate()*basis.U2[seq2,:,np.newaxis,:]
+            blocks+=(value*identity[np.newaxis,:,np.newaxis,:,np.newaxis]*ms[:,np.newaxis,:,np.newaxis,:]).reshape((nk,nsp**2,nsp**2))
+    elif isinstance(operator,HP.FHubbard):
+        assert len(set(operator.seqs))==1
+        assert operator.indices[1].replace(nambu=HP.CREATION)==operator.indices[0]
+        assert operator.indices[3].replace(nambu=HP.CREATION)==operator.indices[2]
+        seq,value=next(iter(operator.seqs)),operator.value*1.0/nk
+        us,ws=basis.U1[seq,:,:],basis.U2[seq,permutation,:].conjugate()
+        diagsum=(basis.U2[seq,:,:].conjugate()*basis.U2[seq,:,:]).sum()
+        ms=us[:,:,np.newaxis]*us[:,np.newaxis,:].conjugate()
+        blocks+=(value*diagsum*ms[:,:,np.newaxis,:,np.newaxis]*np.identity(nsp)[np.newaxis,np.newaxis,:,np.newaxis,:]).reshape((nk,nsp**2,nsp**2))
+        vectors=(us[:,:,np.newaxis]*ws[:,np.newaxis,:]).reshape((nk*nsp**2,1))
+        coeffs=np.array([-value])
+    else:
+        raise ValueError('optkernel error: not supported operator type(%s).'%operator.__class__.__name__)
+    return blocks,vectors,coeffs
+
+class FBFMOperator(LinearOperator):
+    '''
+    The matrix-free representation of the spin excitations, i.e. `blockdiag(blocks)+vectors*diag(coeffs)*vectors^H`.
+
+    Attributes
+    ----------
+    blocks : 3d ndarray
+        The blocks diagonal in the k points of the particle-hole pairs.
+    vectors : 2d ndarray
+        The vectors of the coupling between different k points, one column for each vector.
+    coeffs : 1d ndarray
+        The coefficients of the coupling.
+    '''
+
+    def __init__(self,blocks,vectors,coeffs):
+        '''
+        Constructor.
+
+        Parameters
+        ----------
+        blocks : 3d ndarray
+            The blocks diagonal in the k points of the particle-hole pairs.
+        vectors : 2d ndarray
+            The vectors of the coupling between different k points, one column for each vector.
+        coeffs : 1d ndarray
+            The coefficients of the coupling.
+        '''
+        n=blocks.shape[0]*blocks.shape[1]
+        super(FBFMOperator,self).__init__(dtype=np.result_type(blocks,vectors,coeffs),shape=(n,n))
+        self.blocks=blocks
+        self.vectors=vectors
+        self.coeffs=coeffs
+
+    def _matmat(self,v):
+        '''
+        The product of the operator and a block of vectors.
+        '''
+        nk,nb=self.blocks.shape[0],self.blocks.shape[1]
+        v=np.asarray(v).reshape((nk*nb,-1))
+        return np.matmul(self.blocks,v.reshape((nk,nb,-1))).reshape((nk*nb,-1))+self.vectors.dot(self.coeffs[:,np.newaxis]*self.vectors.T.conjugate().dot(v))
+
+    def _matvec(self,v):
+        '''
+        The product of the operator and a vector.
+        '''
+        return self._matmat(v).reshape(-1)
+
+    def _adjoint(self):
+        '''
+        The adjoint of the operator, which is itself.
+        '''
+        return self
+
+    def diagonal(self):
+        '''
+        The diagonal of the operator.
+        '''
+        return (np.diagonal(self.blocks,axis1=1,axis2=2).reshape(-1)+(np.abs(self.vectors)**2*self.coeffs).sum(axis=1)).real
+
 class FBFM(HP.Engine):
     '''
     Attributes
@@ -311,6 +431,51 @@ class FBFM(HP.Engine):
             result+=optrep(operator,k,self.basis)
         return result
 
+    def kernel(self,k=None,**karg):
+        '''
+        The factorized matrix representation of the spin excitations.
+
+        Parameters
+        ----------
+        k : QuantumNumber, optional
+
+        Returns
+        -------
+        blocks : 3d ndarray
+            The blocks diagonal in the k points of the particle-hole pairs, with the shape (nk,nsp**2,nsp**2).
+        vectors : 2d ndarray
+            The vectors of the coupling between different k points, one column for each vector.
+        coeffs : 1d ndarray
+            The coefficients of the coupling.
+
+        Notes
+        -----
+        The blocks of the operators are accumulated one at a time, so that at most two arrays of the shape (nk,nsp**2,nsp**2) are alive.
+        '''
+        if len(karg)>0: self.update(**karg)
+        blocks,vectors,coeffs=0,[],[]
+        for operator in it.chain([None],self.igenerator.operators.itervalues()):
+            block,vector,coeff=optkernel(operator,k,self.basis)
+            blocks+=block
+            vectors.append(vector)
+            coeffs.append(coeff)
+        return blocks,np.concatenate(vectors,axis=1),np.concatenate(coeffs)
+
+    def linearoperator(self,k=None,**karg):
+        '''
+        The matrix-free representation of the spin excitations.
+
+        Parameters
+        ----------
+        k : QuantumNumber, optional
+
+        Returns
+        -------
+        FBFMOperator
+            The matrix-free representation of the spin excitations, which equals `self.matrix(k)` without storing it.
+        '''
+        return FBFMOperator(*self.kernel(k,**karg))
+
     def view(self,mode='P',path=None,show=True,suspend=False,close=True):
         '''
         View the single particle energy levels along a path in the k space.
@@ -360,8 +525,8 @@ class EB(HP.EB):
     ----------
     ne : integer
         The number of energy spectrums.
-    method : 'eigh','eigsh'
-        The function used to calculate the spectrums. 'eigh' for `sl.eigh` and 'eigsh' for `HM.eigsh`.
+    method : 'eigh','eigsh','lobpcg'
+        The function used to calculate the spectrums. 'eigh' for `sl.eigh`, 'eigsh' for `HM.eigsh` and 'lobpcg' for `HM.lobpcg`.
     '''
 
     def __init__(self,ne=6,method='eigh',**karg):
@@ -372,13 +537,26 @@ class EB(HP.EB):
         ----------
         ne : integer, optional
             The number of energy spectrums.
-        method : 'eigh','eigsh'
-            The function used to calculate the spectrums. 'eigh' for `sl.eigh` and 'eigsh' for `HM.eigsh`.
+        method : 'eigh','eigsh','lobpcg'
+            The function used to calculate the spectrums. 'eigh' for `sl.eigh`, 'eigsh' for `HM.eigsh` and 'lobpcg' for `HM.lobpcg`.
         '''
         super(EB,self).__init__(**karg)
         self.ne=ne
         self.method=method
 
+def _spectrum_(engine,app,ne,**paras):
+    '''
+    The lowest energy spectrums of the spin excitations.
+    '''
+    if app.method=='eigh':
+        return sl.eigh(engine.matrix(**paras),eigvals_only=True)[:ne]
+    else:
+        operator=engine.linearoperator(**paras)
+        if app.method=='lobpcg':
+            return np.sort(HM.eigsh(operator,k=ne,return_eigenvectors=False,method='lobpcg'))
+        else:
+            return np.sort(HM.eigsh(operator,k=ne,which='SA',return_eigenvectors=False,method='arpack'))
+
 def FBFMEB(engine,app):
     '''
     This method calculates the energy spectrums of the spin excitations.
@@ -392,13 +570,12 @@ def FBFMEB(engine,app):
         engine.log<<'%s: '%len(parameters)
         for i,paras in enumerate(parameters):
             engine.log<<'%s%s'%(i,'..' if i<len(parameters)-1 else '')
-            m=engine.matrix(**paras)
-            result[i,1:]=sl.eigh(m,eigvals_only=False)[0][:ne] if app.method=='eigh' else HM.eigsh(m,k=ne,return_eigenvectors=False)
+            result[i,1:]=_spectrum_(engine,app,ne,**paras)
         engine.log<<'\n'
     else:
         result=np.zeros((2,ne+1))
         result[:,0]=np.array(xrange(2))
-        result[0,1:]=sl.eigh(engine.matrix(),eigvals_only=True)[:ne] if app.method=='eigh' else HM.eigsh(engine.matrix(),k=ne,return_eigenvectors=False)
+        result[0,1:]=_spectrum_(engine,app,ne)
         result[1,1:]=result[0,1:]
     name='%s_%s'%(engine.tostr(mask=path.tags if isinstance(path,HP.BaseSpace) else ()),app.name)
     if app.savedata: np.savetxt('%s/%s.dat'%(engine.dout,name),result)
@@ -1,5 +1,5 @@
 '''
-FBFM test (2 tests in total).
+FBFM test (3 tests in total).
 '''
 
 __all__=['fbfm']
@@ -47,6 +47,23 @@ class TestFBFM(TestCase):
         fbfm.register(BP(name='BP',path='L:G1-G2',ns=(0,1),savedata=False,run=FB.FBFMBP))
         fbfm.summary()
 
+    def test_kernel(self):
+        print
+        t,sd,Us,Ud=1.0,1.4,0.1,0.1
+        S2x=Square('S2x')('1P-1P',nneighbour=2)
+        fbfm=self.fbfmconstruct(t,sd,Us,Ud,FB.FBFMBasis(BZ=FBZ(S2x.reciprocals,nks=(6,6)),polarization='up'),S2x)
+        for k in [fbfm.basis.BZ[pos] for pos in (0,7,21)]:
+            matrix,operator=fbfm.matrix(k=k),fbfm.linearoperator(k=k)
+            self.assertEqual(operator.shape,matrix.shape)
+            self.assertAlmostEqual(np.abs(operator.matmat(np.identity(matrix.shape[0]))-matrix).max(),0.0,delta=10**-12)
+            self.assertAlmostEqual(np.abs(operator.diagonal()-matrix.diagonal().real).max(),0.0,delta=10**-12)
+        fbfm.register(FB.EB(name='EB_eigh',path='S:G-X,X-M,M-G',ne=4,plot=False,savedata=False,run=FB.FBFMEB))
+        fbfm.register(FB.EB(name='EB_eigsh',path='S:G-X,X-M,M-G',ne=1,method='eigsh',plot=False,savedata=False,run=FB.FBFMEB))
+        fbfm.register(FB.EB(name='EB_lobpcg',path='S:G-X,X-M,M-G',ne=4,method='lobpcg',plot=False,savedata=False,run=FB.FBFMEB))
+        self.assertAlmostEqual(np.abs(fbfm.records['EB_eigsh']-fbfm.records['EB_eigh'][:,:2]).max(),0.0,delta=10**-8)
+        self.assertAlmostEqual(np.abs(fbfm.records['EB_lobpcg']-fbfm.records['EB_eigh']).max(),0.0,delta=10**-6)
+        fbfm.summary()
+
 fbfm=TestSuite([
             TestLoader().loadTestsFromTestCase(TestFBFM),
             ])
@@ -12,7 +12,8 @@ __all__=['FLQT','QEB','FLQTQEB']
 
 from numpy import *
 from TBA import *
-from scipy.linalg import expm,eig
+from numpy.linalg import eigh,eigvals
+from scipy.linalg import expm
 import itertools as it
 import matplotlib.pyplot as plt
 import HamiltonianPy as HP
@@ -27,7 +28,13 @@ class FLQT(TBA):
         =========     ================================
         `FLQTQEB`     calculate the quasi-energy bands
         =========     ================================
+
+    Attributes
+    ----------
+    NREFINE : int
+        The maximum number of the successive halvings of the time steps in the error control of the quasi-energy bands.
     '''
+    NREFINE=6
 
     def evolution(self,ts=(),**karg):
         '''
@@ -50,6 +57,76 @@ class FLQT(TBA):
             result=dot(expm(-1j*self.matrix(t=ts[i],**karg)*(ts[i+1]-ts[i])),result)
         return result
 
+    def evolutions(self,ts=(),ks=None,method='trotter',**karg):
+        '''
+        This method returns the matrix representations of the time evolution operator at a batch of k points.
+
+        Parameters
+        ----------
+        ts : 1d array-like
+            The time mesh.
+        ks : 2d array-like, optional
+            The coords of the k points, one row for each point.
+        method : 'trotter', 'magnus4' or 'expm', optional
+            The integrator of the time evolution.
+        karg : dict, optional
+            Other parameters.
+
+        Returns
+        -------
+        3d ndarray
+            The matrix representations of the time evolution operator, with the shape (nk,nmatrix,nmatrix).
+
+        Notes
+        -----
+            * 'trotter': the time-ordered product of `exp(-iH(t_i)(t_{i+1}-t_i))`, which is the same as `FLQT.evolution`
+              and is exact for piecewise constant Hamiltonians whose jumps lie on the time mesh.
+            * 'magnus4': the fourth order commutator-free Magnus integrator `exp(-idt(a1*H1+a2*H2))exp(-idt(a2*H1+a1*H2))`,
+              where H1 and H2 are the Hamiltonians at the Gauss-Legendre points of each step and `a1,a2=(3-+2sqrt(3))/12`.
+            * 'expm': `FLQT.evolution` for each k point.
+            * For 'trotter' and 'magnus4', the exponentials are evaluated by stacked eigendecompositions
+              and the k points are processed in stacks of at most `TBA.NSTACK` elements in total.
+        '''
+        ts,ks=asarray(ts),None if ks is None else asarray(ks,dtype=float64)
+        if method=='expm':
+            return array([self.evolution(ts,**karg)] if ks is None else [self.evolution(ts,k=k,**karg) for k in ks])
+        nmatrix,nk=self.nmatrix,1 if ks is None else ks.shape[0]
+        nbatch=max(self.NSTACK/nmatrix**2,1)
+        result=zeros((nk,nmatrix,nmatrix),dtype=complex128)
+        result[...]=identity(nmatrix)
+        for t0,t1 in zip(ts[:-1],ts[1:]):
+            dt=t1-t0
+            if method=='trotter':
+                times,weights=[t0],[[1.0]]
+            elif method=='magnus4':
+                times,weights=[t0+(0.5-sqrt(3.0)/6)*dt,t0+(0.5+sqrt(3.0)/6)*dt],[[(3+2*sqrt(3.0))/12,(3-2*sqrt(3.0))/12],[(3-2*sqrt(3.0))/12,(3+2*sqrt(3.0))/12]]
+            else:
+                raise ValueError('FLQT evolutions error: not supported method(%s).'%method)
+            for i in xrange(0,nk,nbatch):
+                hs=[self.matrix_batch(ks=None if ks is None else ks[i:i+nbatch],t=t,**karg) for t in times]
+                for ws in weights:
+                    result[i:i+nbatch]=matmul(_expmh_(tensordot(ws,hs,axes=1),dt),result[i:i+nbatch])
+        return result
+
+def _expmh_(hs,dt):
+    '''
+    The exponentials `exp(-i*hs*dt)` of a stack of Hermitian matrices.
+
+    Parameters
+    ----------
+    hs : 3d ndarray
+        The stack of Hermitian matrices.
+    dt : float
+        The time step.
+
+    Returns
+    -------
+    3d ndarray
+        The exponentials.
+    '''
+    es,vs=eigh(hs)
+    return matmul(vs*exp(-1j*dt*es)[:,newaxis,:],conjugate(swapaxes(vs,1,2)))
+
 class QEB(HP.EB):
     '''
     Floquet quasi-energy bands.
@@ -58,9 +135,13 @@ class QEB(HP.EB):
     ----------
     ts : BaseSpace
         The time domain of the Floquet process.
+    method : 'trotter', 'magnus4' or 'expm'
+        The integrator of the time evolution.
+    tol : float
+        The tolerance of the time evolution operators, None for no error control.
     '''
 
-    def __init__(self,ts,**karg):
+    def __init__(self,ts,method='trotter',tol=None,**karg):
         '''
         Constructor.
 
@@ -68,25 +149,53 @@ class QEB(HP.EB):
         ----------
         ts : BaseSpace
             The time domain of the Floquet process.
+        method : 'trotter', 'magnus4' or 'expm', optional
+            The integrator of the time evolution.
+        tol : float, optional
+            The tolerance of the time evolution operators, None for no error control.
+
+        Notes
+        -----
+        When `tol` is not None, the time steps are halved until the time evolution operators change less than `tol`, at most `FLQT.NREFINE` times.
         '''
+        assert method in ('trotter','magnus4','expm')
         super(QEB,self).__init__(**karg)
         self.ts=ts
+        self.method=method
+        self.tol=tol
 
 def FLQTQEB(engine,app):
     '''
     This method calculates the Floquet quasi-energy bands.
     '''
+    def evolutions(ts):
+        if app.path is None:
+            return engine.evolutions(ts,method=app.method)
+        elif app.path.tags==['k']:
+            return engine.evolutions(ts,ks=app.path.mesh('k'),method=app.method)
+        else:
+            return concatenate([engine.evolutions(ts,ks=[paras.pop('k')] if 'k' in paras else None,method=app.method,**paras) for paras in app.path('+')])
+    ts=app.ts.mesh('t')
+    us=evolutions(ts)
+    if app.tol is not None:
+        for i in xrange(engine.NREFINE):
+            ts=concatenate([ts,(ts[:-1]+ts[1:])/2])
+            ts.sort()
+            fine=evolutions(ts)
+            error,us=abs(fine-us).max(),fine
+            if error<=app.tol: break
+        engine.log<<'::<QEB>:: method=%s, nstep=%s, error=%.4e%s\n'%(app.method,len(ts)-1,error,'' if error<=app.tol else ' (not converged)')
+    qes=sort(angle(eigvals(us)),axis=-1)/app.ts.volume('t')
     if app.path is None:
         result=zeros((2,engine.nmatrix+1))
         result[:,0]=array(xrange(2))
-        result[0,1:]=angle(eig(engine.evolution(ts=app.ts.mesh('t')))[0])/app.ts.volume('t')
+        result[0,1:]=qes[0]
         result[1,1:]=result[0,1:]
     else:
         rank,mesh=app.path.rank(0),app.path.mesh(0)
         result=zeros((rank,engine.nmatrix+1))
         result[:,0]=mesh if mesh.ndim==1 else array(xrange(rank))
-        for i,paras in app.path('+'):
-            result[i,1:]=angle(eig(engine.evolution(ts=app.ts.mesh('t'),**paras))[0])/app.ts.volume('t')
+        result[:,1:]=qes
     name='%s_%s'%(engine.tostr(mask=set(it.chain(('t'),() if app.path is None else app.path.tags))),app.name)
     if app.savedata: savetxt('%s/%s.dat'%(engine.dout,name),result)
     if app.plot: app.figure('L',result,'%s/%s'%(engine.dout,name))
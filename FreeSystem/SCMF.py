@@ -15,7 +15,8 @@ from TBA import *
 from copy import deepcopy
 from collections import OrderedDict
 from scipy.optimize import broyden2
-from scipy.linalg import eigh
+from scipy.special import expit
+from numpy.linalg import eigh,lstsq
 import itertools as it
 
 class OP(object):
@@ -101,6 +102,8 @@ class SCMF(TBA):
         self.terms=terms
         self.orders=orders
         self.mask=mask
+        self.sparse=False
+        self.cache={}
         self.parameters.update({'filling':filling,'temperature':temperature})
         self.parameters.update(OrderedDict((term.id,term.value) for term in it.chain(terms if self.map is None else (),orders)))
         self.generator=Generator(bonds=lattice.bonds,config=config,table=config.table(mask=mask),terms=terms+orders,half=True)
@@ -122,21 +125,32 @@ class SCMF(TBA):
         ----------
         kspace : BaseSpace, optional
             The Brillouin zone of the system.
+
+        Notes
+        -----
+        The matrices on the kspace are diagonalized as stacks of at most `TBA.NSTACK` elements in total, and the density matrix `<c_i^dagger c_j>` is accumulated as one contraction over the k points and the bands for each stack.
         '''
         self.update(**{name:order.value for name,order in self.ops.iteritems()})
-        self.mu,nmatrix=super(SCMF,self).mu(self.filling,kspace),self.nmatrix
-        f=(lambda e,mu: 1 if e<=mu else 0) if abs(self.temperature)<RZERO else (lambda e,mu: 1/(exp((e-mu)/self.temperature)+1))
-        m=zeros((nmatrix,nmatrix),dtype=complex128)
-        for matrix in self.matrices(kspace):
-            eigs,eigvecs=eigh(matrix)
-            for eig,eigvec in zip(eigs,eigvecs.T):
-                m+=dot(eigvec.conj().reshape((nmatrix,1)),eigvec.reshape((1,nmatrix)))*f(eig,self.mu)
-        nstate=(1 if kspace is None else kspace.rank('k'))*nmatrix/self.config.values()[0].nspin
+        nmatrix,nk=self.nmatrix,1 if kspace is None else kspace.rank('k')
+        es,vs=zeros((nk,nmatrix),dtype=float64),zeros((nk,nmatrix,nmatrix),dtype=complex128)
+        if kspace is None:
+            es[...],vs[...]=eigh(self.matrix_batch())
+        elif kspace.tags==['k']:
+            ks,nbatch=kspace.mesh('k'),max(self.NSTACK/nmatrix**2,1)
+            for i in xrange(0,nk,nbatch):
+                es[i:i+nbatch],vs[i:i+nbatch]=eigh(self.matrix_batch(ks=ks[i:i+nbatch]))
+        else:
+            es[...],vs[...]=eigh(asarray(list(self.matrices(kspace))))
+        eigvals,nelectron=sort(es.reshape(-1)),int(round(self.filling*nk*nmatrix))
+        self.mu=(eigvals[nelectron]+eigvals[nelectron-2])/2
+        f=(es<=self.mu).astype(float64) if abs(self.temperature)<RZERO else expit((self.mu-es)/self.temperature)
+        m=tensordot(vs.conjugate()*f[:,newaxis,:],vs,axes=([0,2],[0,2]))
+        nstate=nk*nmatrix/self.config.values()[0].nspin
         for key in self.ops.keys():
             self.ops[key].value=sum(m*self.ops[key].matrix)/nstate
             if self.ops[key].dtype in (float32,float64): self.ops[key].value=self.ops[key].value.real
 
-    def iterate(self,kspace=None,tol=10**-6,maxiter=200):
+    def iterate(self,kspace=None,tol=10**-6,maxiter=200,method='broyden',nhistory=8,damping=0.5):
         '''
         Iterate the SCMF to get converged order parameters.
 
@@ -148,14 +162,58 @@ class SCMF(TBA):
             The tolerance of the order parameter.
         maxiter : integer, optional
             The maximum times of the iteration.
+        method : 'broyden' or 'diis', optional
+            'broyden' for the scipy `broyden2` solver and 'diis' for the Anderson/Pulay mixing.
+        nhistory : int, optional
+            The number of the previous iterations kept in the Anderson/Pulay mixing, 0 for the simple linear mixing.
+        damping : float64, optional
+            The fraction of the new order parameters mixed into the old ones in the Anderson/Pulay mixing.
+
+        Returns
+        -------
+        1d ndarray
+            The maximum absolute residuals of the order parameters, one for each evaluation of the self-consistent map.
+
+        Notes
+        -----
+        In the Anderson/Pulay mixing, the next input is `x+damping*r-(dX+damping*dR)*gamma`, where `x` and `r` are the current input and residual,
+        `dX` and `dR` are the differences of the inputs and the residuals of the last `nhistory` iterations,
+        and `gamma` minimizes the norm of `r-dR*gamma` in the least-square sense.
+        An extrapolated step against the residual, which heads for a solution unstable under the simple mixing (e.g. the paramagnetic one of an ordered phase),
+        is replaced by the damped step `damping*r` and the history is restarted.
         '''
+        residuals=[]
         def gx(values):
             for op,value in zip(self.ops.values(),values):
                 op.value=value
             self.update_ops(kspace)
-            return array([self.ops[key].value for key in self.ops.keys()])-values
+            result=array([self.ops[key].value for key in self.ops.keys()])-values
+            residuals.append(abs(result).max())
+            self.log<<'::<SCMF>:: iteration=%s, residual=%.4e\n'%(len(residuals),residuals[-1])
+            return result
         with self.timers.get('Iteration'):
             x0=array([self.ops[key].value for key in self.ops.keys()])
-            ops=broyden2(gx,x0,verbose=True,reduction_method='svd',maxiter=maxiter,x_tol=tol)
+            if method=='broyden':
+                ops=broyden2(gx,x0,verbose=True,reduction_method='svd',maxiter=maxiter,x_tol=tol)
+            elif method=='diis':
+                xs,rs,x=[],[],x0
+                for i in xrange(maxiter):
+                    r=gx(x)
+                    ops=x+r
+                    if residuals[-1]<tol: break
+                    xs,rs,step=(xs+[x])[-nhistory-1:],(rs+[r])[-nhistory-1:],damping*r
+                    if len(xs)>1:
+                        dX,dR=diff(array(xs),axis=0).T,diff(array(rs),axis=0).T
+                        trial=step-(dX+damping*dR).dot(lstsq(dR,r,rcond=None)[0])
+                        if vdot(trial,r).real>0:
+                            step=trial
+                        else:
+                            xs,rs=[x],[r]
+                            self.log<<'::<SCMF>:: extrapolation against the residual, history restarted.\n'
+                    x=x+step
+            else:
+                raise ValueError('SCMF iterate error: not supported method(%s).'%method)
+        if residuals[-1]>=tol: self.log<<'::<SCMF>:: warning: not converged, residual=%.4e after %s iterations.\n'%(residuals[-1],len(residuals))
         self.log<<'Order parameters:\n%s\n'%Sheet.from_ordereddict(OrderedDict([(name,op) for name,op in zip(self.ops.keys(),ops)]))
-        self.log<<'Iterate: time consumed %ss.\n\n'%self.timers.time('Iteration')
+        self.log<<'Iterate: %s iterations, time consumed %ss.\n\n'%(len(residuals),self.timers.time('Iteration'))
+        return array(residuals)
@@ -4,19 +4,49 @@ TBA and BdG
 ===========
 
 Tight Binding Approximation for fermionic systems, including:
-    * classes: TBA, GSE
-    * functions: TBAEB, TBAGSE, TBADOS, TBABC
+    * classes: TBA, GSE, GAP
+    * functions: TBAEB, TBAGSE, TBADOS, TBAKPM, TBABC, TBAWCC, TBAGAP
 '''
 
-__all__=['TBA','GSE','TBAGSE','TBAEB','TBADOS','TBABC']
+__all__=['TBA','GSE','GAP','TBAGSE','TBAEB','TBADOS','TBAKPM','TBABC','TBAWCC','TBAGAP']
 
 from ..Basics import *
 from numpy import *
+from numpy.linalg import eigvalsh
 from scipy.linalg import eigh
+from scipy.signal import fftconvolve
+from scipy.special import expit
+import scipy.sparse as sp
 from collections import OrderedDict
+import itertools as it
+import hashlib
 import HamiltonianPy as HP
+import HamiltonianPy.Misc as HM
 import matplotlib.pyplot as plt
 
+def _chebstep_(moments,x):
+    '''
+    The number of states and the energy below an energy by the Chebyshev expansion of the step function with the Jackson kernel.
+
+    Parameters
+    ----------
+    moments : 1d/2d ndarray
+        The Chebyshev moments of the rescaled Hamiltonian, one row for each set when 2d.
+    x : float
+        The rescaled energy, which should lie in [-1,1].
+
+    Returns
+    -------
+    count : float/1d ndarray
+        The number of states below `x`.
+    energy : float/1d ndarray
+        The sum of the rescaled energies of the states below `x`.
+    '''
+    n=moments.shape[-1]-1
+    ns,theta=arange(n),arccos(x)
+    coeffs=concatenate([[1-theta/pi],-2*sin(ns[1:]*theta)/(ns[1:]*pi)])*HM.kpmkernel(n,'jackson')
+    return moments[...,:n].dot(coeffs),(moments[...,1:]+moments[...,abs(ns-1)]).dot(coeffs)/2
+
 class TBA(Engine):
     '''
     Tight-binding approximation for fermionic systems. Also support BdG systems (phenomenological superconducting systems at the mean-field level).
@@ -33,6 +63,20 @@ class TBA(Engine):
         ['nambu'] for not using the nambu space and [] for using the nambu space.
     generator : Generator
         The operator generator for the Hamiltonian.
+    sparse : logical
+        True for the real-space mode, in which the filling, chemical potential and ground state energy are obtained by the Chebyshev expansions of the Fermi function with the sparse matrix representation of the Hamiltonian.
+    cache : dict
+        The cache during the process of calculation, usually to store the array representation of the operators and the spectra.
+    NSTACK : int
+        The maximum number of the matrix elements of a stack of matrices to be diagonalized at once.
+    NSPECTRUM : int
+        The maximum number of the cached spectra.
+    NCHEBYSHEV : int
+        The number of the Chebyshev moments used in the real-space mode.
+    NPROBE : int
+        The number of the random vectors to estimate the traces in the real-space mode, whose spread gives the stochastic errors reported by `TBA.chebstderr`. When the dimension of the Hamiltonian is not larger than it, the traces are evaluated exactly.
+    CHEBPAD : float
+        The relative padding of the spectral bounds in the rescaling of the Hamiltonian for the Chebyshev expansions.
 
 
     Supported methods:
@@ -42,11 +86,19 @@ class TBA(Engine):
         `TBAGSE`    calculate the ground state energy
         `TBAEB`     calculate the energy bands
         `TBADOS`    calculate the density of states
+        `TBAKPM`    calculate the density of states by KPM
         `TBABC`     calculate the Berry curvature and Chern number
+        `TBAWCC`    calculate the Wannier charge centers
+        `TBAGAP`    calculate the self-consistent pairing gap
         ========    ==============================================
     '''
+    NSTACK=2**22
+    NSPECTRUM=4
+    NCHEBYSHEV=1024
+    NPROBE=32
+    CHEBPAD=0.01
 
-    def __init__(self,lattice=None,config=None,terms=None,mask=('nambu',),**karg):
+    def __init__(self,lattice=None,config=None,terms=None,mask=('nambu',),sparse=False,**karg):
         '''
         Constructor.
 
@@ -60,11 +112,15 @@ class TBA(Engine):
             The terms of the system.
         mask : ['nambu'] or [], optional
             ['nambu'] for not using the nambu space and [] for using the nambu space.
+        sparse : logical, optional
+            True for the real-space mode and False for not.
         '''
         self.lattice=lattice
         self.config=config
         self.terms=terms
         self.mask=mask
+        self.sparse=sparse
+        self.cache={}
         if self.map is None: self.parameters.update(OrderedDict((term.id,term.value) for term in terms))
         self.generator=Generator(bonds=lattice.bonds,config=config,table=config.table(mask=mask),terms=terms,half=True)
         self.logging()
@@ -75,7 +131,12 @@ class TBA(Engine):
         '''
         if len(karg)>0:
             super(TBA,self).update(**karg)
+            values=[term.value for term in self.generator.terms['alter']]
             self.generator.update(**self.data)
+            if any(term.value is not value for term,value in zip(self.generator.terms['alter'],values)):
+                self.cache.pop('hoppings',None)
+                self.cache.pop('spectrum',None)
+                self.cache.pop('chebyshev',None)
 
     @property
     def nmatrix(self):
@@ -84,6 +145,47 @@ class TBA(Engine):
         '''
         return len(self.generator.table)
 
+    def hoppings(self):
+        '''
+        Returns the array representation of the generated operators.
+
+        Returns
+        -------
+        rcoords : 2d ndarray
+            The rcoords of the operators, one row for each operator.
+        values : 1d ndarray
+            The values of the operators.
+        starts : 1d ndarray of int
+            The starting positions of the groups of the operators sharing the same matrix element.
+        seqs : 1d ndarray of int
+            The flattened positions of the matrix elements of the groups.
+
+        Notes
+        -----
+            * The operators are sorted by their flattened positions so that the matrix elements can be accumulated by `add.reduceat`.
+            * For BdG systems, the particle-hole partners of the hopping operators are included with the negative values and the opposite rcoords.
+            * The arrays are cached and renewed only when the alterable terms change.
+        '''
+        if 'hoppings' not in self.cache:
+            nmatrix,bdg=self.nmatrix,len(self.mask)==0
+            rcoords,values,seqs=[],[],[]
+            for opt in self.generator.operators.itervalues():
+                i,j=opt.seqs
+                rcoords.append(opt.rcoord)
+                values.append(opt.value)
+                seqs.append(i*nmatrix+j)
+                if bdg and i<nmatrix/2 and j<nmatrix/2:
+                    rcoords.append(-asarray(opt.rcoord))
+                    values.append(-opt.value)
+                    seqs.append((j+nmatrix/2)*nmatrix+i+nmatrix/2)
+            rcoords=asarray(rcoords,dtype=float64).reshape((len(seqs),-1 if len(seqs)>0 else self.lattice.rcoords.shape[1]))
+            values,seqs=asarray(values,dtype=complex128),asarray(seqs,dtype=int64)
+            permutation=argsort(seqs,kind='mergesort')
+            rcoords,values,seqs=rcoords[permutation],values[permutation],seqs[permutation]
+            starts=flatnonzero(concatenate([[True],seqs[1:]!=seqs[:-1]])) if len(seqs)>0 else zeros(0,dtype=int64)
+            self.cache['hoppings']=(rcoords,values,starts,seqs[starts])
+        return self.cache['hoppings']
+
     def matrix(self,k=(),**karg):
         '''
         This method returns the matrix representation of the Hamiltonian.
@@ -100,18 +202,97 @@ class TBA(Engine):
         2d ndarray
             The matrix representation of the Hamiltonian.
         '''
+        return self.matrix_batch(ks=None if len(k)==0 else [k],**karg)[0]
+
+    def matrix_batch(self,ks=None,**karg):
+        '''
+        This method returns the matrix representations of the Hamiltonian at a batch of k points.
+
+        Parameters
+        ----------
+        ks : 2d array-like, optional
+            The coords of the k points, one row for each point.
+        karg : dict, optional
+            Other parameters.
+
+        Returns
+        -------
+        3d ndarray
+            The matrix representations of the Hamiltonian, with the shape (nk,nmatrix,nmatrix).
+
+        Notes
+        -----
+        When `ks` is None, only one matrix, i.e. the one without the phase factors, will be returned.
+        '''
         self.update(**karg)
         nmatrix=self.nmatrix
-        result=zeros((nmatrix,nmatrix),dtype=complex128)
-        for opt in self.generator.operators.values():
-            phase=1 if len(k)==0 else exp(-1j*inner(k,opt.rcoord))
-            result[opt.seqs]+=opt.value*phase
-            if len(self.mask)==0:
-                i,j=opt.seqs
-                if i<nmatrix/2 and j<nmatrix/2: result[j+nmatrix/2,i+nmatrix/2]+=-opt.value*conjugate(phase)
-        result+=conjugate(result.T)
+        rcoords,values,starts,seqs=self.hoppings()
+        if ks is None:
+            result=zeros((1,nmatrix**2),dtype=complex128)
+            if len(seqs)>0: result[0,seqs]=add.reduceat(values,starts)
+        else:
+            ks=asarray(ks,dtype=float64).reshape((-1,rcoords.shape[1]))
+            result=zeros((ks.shape[0],nmatrix**2),dtype=complex128)
+            if len(seqs)>0:
+                nbatch=max(2**22/len(values),1)
+                for i in xrange(0,ks.shape[0],nbatch):
+                    result[i:i+nbatch,seqs]=add.reduceat(exp(-1j*ks[i:i+nbatch].dot(rcoords.T))*values,starts,axis=1)
+        result=result.reshape((-1,nmatrix,nmatrix))
+        result+=conjugate(swapaxes(result,1,2))
         return result
 
+    def csrmatrix(self,pairings=None,**karg):
+        '''
+        This method returns the sparse matrix representation of the Hamiltonian in the real space.
+
+        Parameters
+        ----------
+        pairings : 1d ndarray, optional
+            The values of the pairing matrix elements of a BdG system replacing the generated ones, in the order of `TBA.pairings`.
+        karg : dict, optional
+            Other parameters.
+
+        Returns
+        -------
+        csr_matrix
+            The sparse matrix representation of the Hamiltonian, which equals `self.matrix()` without the phase factors.
+        '''
+        self.update(**karg)
+        nmatrix=self.nmatrix
+        rcoords,values,starts,seqs=self.hoppings()
+        data=add.reduceat(values,starts) if len(seqs)>0 else zeros(0,dtype=complex128)
+        if pairings is not None: data[self.pairings(mask=True)]=pairings
+        result=sp.csr_matrix((data,divmod(seqs,nmatrix)),shape=(nmatrix,nmatrix))
+        return result+result.T.conjugate()
+
+    def pairings(self,mask=False):
+        '''
+        This method returns the pairing matrix elements of a BdG system in the real space.
+
+        Parameters
+        ----------
+        mask : logical, optional
+            True for returning the mask of the pairing matrix elements among all the matrix elements of `TBA.hoppings` and False for not.
+
+        Returns
+        -------
+        rows,cols : 1d ndarray of int
+            The rows and the columns of the pairing matrix elements, i.e. the ones in the lower-left block of the matrix representation.
+        values : 1d ndarray
+            The values of the pairing matrix elements without the phase factors.
+
+        Notes
+        -----
+        The upper-right block of the matrix representation is the Hermitian conjugate of the lower-left block.
+        '''
+        assert len(self.mask)==0
+        nmatrix=self.nmatrix
+        rcoords,values,starts,seqs=self.hoppings()
+        rows,cols=divmod(seqs,nmatrix)
+        flags=(rows>=nmatrix/2)&(cols<nmatrix/2)
+        if mask: return flags
+        return rows[flags],cols[flags],(add.reduceat(values,starts)[flags] if len(seqs)>0 else zeros(0,dtype=complex128))
+
     def matrices(self,basespace=None,mode='*'):
         '''
         This method returns a generator iterating over the matrix representations of the Hamiltonian defined on the input basespace.
@@ -148,13 +329,193 @@ class TBA(Engine):
         -------
         1d ndarray
             All the eigenvalues.
+
+        Notes
+        -----
+        When the base space is a pure K-space, the matrices are diagonalized as stacks of at most `TBA.NSTACK` elements in total.
         '''
         if basespace is None:
             result=eigh(self.matrix(),eigvals_only=True)
+        elif basespace.tags==['k']:
+            ks,nmatrix=basespace.mesh('k'),self.nmatrix
+            result,nbatch=zeros((len(ks),nmatrix),dtype=float64),max(self.NSTACK/nmatrix**2,1)
+            for i in xrange(0,len(ks),nbatch):
+                result[i:i+nbatch]=eigvalsh(self.matrix_batch(ks=ks[i:i+nbatch]))
+            result=result.reshape(-1)
         else:
             result=asarray([eigh(self.matrix(**paras),eigvals_only=True) for paras in basespace(mode)]).reshape(-1)
         return result
 
+    def eigs(self,sigma=0.0,k=6,return_eigenvectors=False):
+        '''
+        This method returns the eigenvalues of the real-space Hamiltonian near a target energy by the shift-invert Lanczos method.
+
+        Parameters
+        ----------
+        sigma : float, optional
+            The target energy.
+        k : int, optional
+            The number of the wanted eigenvalues.
+        return_eigenvectors : logical, optional
+            True for returning the eigenvectors and False for not.
+
+        Returns
+        -------
+        es : 1d ndarray
+            The sorted eigenvalues.
+        vs : 2d ndarray, optional
+            The corresponding eigenvectors, one column for each eigenvalue.
+        '''
+        result=HM.eigsh(self.csrmatrix(),k=k,sigma=sigma,which='LM',return_eigenvectors=return_eigenvectors)
+        if return_eigenvectors:
+            indices=argsort(result[0])
+            return result[0][indices],result[1][:,indices]
+        else:
+            return sort(result)
+
+    def bdgeigs(self,k=6,pairings=None,return_eigenvectors=False):
+        '''
+        This method returns the lowest non-negative quasi-particle energies of the real-space BdG Hamiltonian.
+
+        Parameters
+        ----------
+        k : int, optional
+            The number of the wanted quasi-particle energies.
+        pairings : 1d ndarray, optional
+            The values of the pairing matrix elements replacing the generated ones, in the order of `TBA.pairings`.
+        return_eigenvectors : logical, optional
+            True for returning the eigenvectors and False for not.
+
+        Returns
+        -------
+        es : 1d ndarray
+            The sorted quasi-particle energies.
+        vs : 2d ndarray, optional
+            The corresponding eigenvectors, one column for each quasi-particle energy.
+
+        Notes
+        -----
+        The spectrum of a BdG Hamiltonian is symmetric with respect to zero, the partner of the eigenvector `(u,v)` at `E` being `(v^*,u^*)` at `-E`.
+        Therefore, in the sparse mode, only the positive branch is solved by the shift-invert Lanczos method with the largest algebraic `1/E`.
+        Otherwise, or when `2k` is not smaller than the dimension of the Hamiltonian, the dense matrix is diagonalized.
+        '''
+        matrix,nmatrix=self.csrmatrix(pairings=pairings),self.nmatrix
+        if self.sparse and 2*k<nmatrix-1:
+            es,vs=HM.eigsh(matrix,k=k,sigma=0.0,which='LA',return_eigenvectors=True)
+            indices=argsort(es)
+        else:
+            es,vs=eigh(matrix.toarray())
+            indices=argsort(es)[len(es)/2:len(es)/2+k]
+        return (es[indices],vs[:,indices]) if return_eigenvectors else es[indices]
+
+    def chebyshev(self):
+        '''
+        Return the Chebyshev moments of the real-space Hamiltonian.
+
+        Returns
+        -------
+        a,b : float
+            The rescaling of the Hamiltonian, i.e. `(H-b)/a` has its spectrum in (-1,1).
+        moments : 2d ndarray
+            The estimations of the traces of the first `TBA.NCHEBYSHEV+1` Chebyshev polynomials of the rescaled Hamiltonian, one row for each random vector, whose mean is the estimation of the traces.
+
+        Notes
+        -----
+            * The moments are cached with the keys determined by the parameters of the engine.
+            * When the traces are evaluated exactly, there is only one row.
+        '''
+        key=tuple(self.parameters.iteritems())
+        moments=self.cache.setdefault('chebyshev',OrderedDict())
+        if key not in moments:
+            matrix,nmatrix=self.csrmatrix(),self.nmatrix
+            a,b=HM.kpmbounds(matrix,pad=self.CHEBPAD)
+            if nmatrix<=self.NPROBE:
+                result=HM.chebmoments(matrix,identity(nmatrix,dtype=complex128),self.NCHEBYSHEV+1,a,b).sum(axis=0)[newaxis,:]
+            else:
+                result=HM.chebmoments(matrix,exp(2j*pi*random.random((nmatrix,self.NPROBE))),self.NCHEBYSHEV+1,a,b)
+            moments[key]=(a,b,result)
+            while len(moments)>self.NSPECTRUM: moments.popitem(last=False)
+        return moments[key]
+
+    def chebfermi(self,filling):
+        '''
+        Return the rescaled Fermi energy of the real-space Hamiltonian.
+
+        Parameters
+        ----------
+        filling : float
+            The filling factor of the system.
+
+        Returns
+        -------
+        float
+            The rescaled Fermi energy, at which the Chebyshev expansion of the number of states equals the number of electrons.
+        '''
+        nelectron,moments=int(round(filling*self.nmatrix)),self.chebyshev()[2].mean(axis=0)
+        xmin,xmax=-1.0,1.0
+        while xmax-xmin>RZERO:
+            x=(xmin+xmax)/2
+            if _chebstep_(moments,x)[0]<nelectron:
+                xmin=x
+            else:
+                xmax=x
+        return (xmin+xmax)/2
+
+    def chebstderr(self,filling):
+        '''
+        Return the stochastic errors of the real-space estimations of the filling factor, the chemical potential and the ground state energy.
+
+        Parameters
+        ----------
+        filling : float
+            The filling factor of the system.
+
+        Returns
+        -------
+        dfilling,dmu,dgse : float
+            The standard errors of the filling factor at the Fermi energy, of the chemical potential and of the ground state energy.
+
+        Notes
+        -----
+            * The errors are obtained from the spread of the moments over the random vectors, and they are zero when the traces are evaluated exactly.
+            * The errors of the chemical potential and the ground state energy follow from that of the number of states at a fixed number of electrons, i.e. `dmu=dN/rho` and `dgse=d(E-mu*N)` with `rho` the density of states at the Fermi energy.
+        '''
+        a,b,moments=self.chebyshev()
+        if len(moments)<2: return 0.0,0.0,0.0
+        x=self.chebfermi(filling)
+        counts,energies=_chebstep_(moments,x)
+        dcount=counts.std(ddof=1)/sqrt(len(counts))
+        rho=HM.kpmdos(moments.mean(axis=0),a,b,[a*x+b])[0]
+        return dcount/self.nmatrix,dcount/rho,a*(energies-x*counts).std(ddof=1)/sqrt(len(counts))
+
+    def spectrum(self,kspace=None):
+        '''
+        Return the sorted eigenvalues of the Hamiltonian.
+
+        Parameters
+        ----------
+        kspace : BaseSpace, optional
+            The first Brillouin zone.
+
+        Returns
+        -------
+        1d ndarray
+            The sorted eigenvalues.
+
+        Notes
+        -----
+        The spectra are cached with the keys determined by the mesh of the kspace and the parameters of the engine, and at most `TBA.NSPECTRUM` of them are kept.
+        The cached spectra are read-only.
+        '''
+        key=(None if kspace is None else tuple((tag,kspace.mesh(tag).shape,hashlib.sha1(ascontiguousarray(kspace.mesh(tag)).tobytes()).hexdigest()) for tag in kspace.tags),tuple(self.parameters.iteritems()))
+        spectra=self.cache.setdefault('spectrum',OrderedDict())
+        if key not in spectra:
+            result=sort(self.eigvals(kspace))
+            result.flags.writeable=False
+            spectra[key]=result
+            while len(spectra)>self.NSPECTRUM: spectra.popitem(last=False)
+        return spectra[key]
+
     def filling(self,mu,kspace=None):
         '''
         Return the filling factor of the system.
@@ -171,7 +532,11 @@ class TBA(Engine):
         float
             The filling factor of the system.
         '''
-        eigvals=sort(self.eigvals(kspace))
+        if self.sparse:
+            assert kspace is None
+            a,b,moments=self.chebyshev()
+            return _chebstep_(moments.mean(axis=0),clip((mu-b)/a,-1.0,1.0))[0]/self.nmatrix
+        eigvals=self.spectrum(kspace)
         return searchsorted(eigvals,mu)*1.0/len(eigvals)
 
     def mu(self,filling,kspace=None):
@@ -190,7 +555,11 @@ class TBA(Engine):
         float
             The chemical potential of the system.
         '''
-        nelectron,eigvals=int(round(filling*(1 if kspace is None else kspace.rank('k'))*self.nmatrix)),sort(self.eigvals(kspace))
+        if self.sparse:
+            assert kspace is None
+            a,b=self.chebyshev()[:2]
+            return a*self.chebfermi(filling)+b
+        nelectron,eigvals=int(round(filling*(1 if kspace is None else kspace.rank('k'))*self.nmatrix)),self.spectrum(kspace)
         return (eigvals[nelectron]+eigvals[nelectron-2])/2
 
     def gse(self,filling,kspace=None):
@@ -209,7 +578,12 @@ class TBA(Engine):
         float
             The ground state energy of the system.
         '''
-        return sort(self.eigvals(kspace))[0:int(round(filling*(1 if kspace is None else kspace.rank('k'))*self.nmatrix))].sum()
+        if self.sparse:
+            assert kspace is None
+            a,b,moments=self.chebyshev()
+            count,energy=_chebstep_(moments.mean(axis=0),self.chebfermi(filling))
+            return a*energy+b*count
+        return self.spectrum(kspace)[0:int(round(filling*(1 if kspace is None else kspace.rank('k'))*self.nmatrix))].sum()
 
 class GSE(HP.App):
     '''
@@ -238,12 +612,70 @@ class GSE(HP.App):
         self.filling=filling
         self.kspace=kspace
 
+class GAP(HP.App):
+    '''
+    The self-consistent pairing gap of a real-space BdG system with attractive density-density interactions.
+
+    Attributes
+    ----------
+    coupling : float
+        The strength of the attractive interactions between the orbitals of the pairing matrix elements.
+    cutoff : float
+        The energy cutoff of the quasi-particles contributing to the pairing amplitudes.
+    smearing : float
+        The width below the cutoff over which the contributions of the quasi-particles are smoothly switched off.
+    temperature : float
+        The temperature of the system.
+    nqp : int
+        The initial number of the quasi-particles solved in the sparse mode.
+    tol : float
+        The tolerance of the pairing matrix elements.
+    maxiter : int
+        The maximum times of the iteration.
+    mixing : float
+        The fraction of the new pairing matrix elements mixed into the old ones.
+    '''
+
+    def __init__(self,coupling,cutoff=None,smearing=0.1,temperature=0.0,nqp=16,tol=10**-6,maxiter=200,mixing=1.0,**karg):
+        '''
+        Constructor.
+
+        Parameters
+        ----------
+        coupling : float
+            The strength of the attractive interactions between the orbitals of the pairing matrix elements.
+        cutoff : float, optional
+            The energy cutoff of the quasi-particles contributing to the pairing amplitudes. When None, all the quasi-particles contribute.
+        smearing : float, optional
+            The width below the cutoff over which the contributions of the quasi-particles are smoothly switched off, 0 for a sharp cutoff.
+        temperature : float, optional
+            The temperature of the system.
+        nqp : int, optional
+            The initial number of the quasi-particles solved in the sparse mode.
+        tol : float, optional
+            The tolerance of the pairing matrix elements.
+        maxiter : int, optional
+            The maximum times of the iteration.
+        mixing : float, optional
+            The fraction of the new pairing matrix elements mixed into the old ones.
+        '''
+        super(GAP,self).__init__(**karg)
+        self.coupling=coupling
+        self.cutoff=cutoff
+        self.smearing=smearing
+        self.temperature=temperature
+        self.nqp=nqp
+        self.tol=tol
+        self.maxiter=maxiter
+        self.mixing=mixing
+
 def TBAGSE(engine,app):
     '''
     This method calculates the ground state energy.
     '''
     gse=engine.gse(filling=app.filling,kspace=app.kspace)
     engine.log<<engine<<'\n'
+    if engine.sparse: engine.log<<'::<Chebyshev>:: nmoment=%s, nprobe=%s, stochastic error=%.4e\n'%(engine.NCHEBYSHEV,engine.NPROBE,engine.chebstderr(app.filling)[2])
     engine.log<<Sheet.from_ordereddict({'Total':gse,'Site':gse/len(engine.lattice)/(1 if app.kspace is None else app.kspace.rank('k'))})<<'\n'
     if app.returndata: return gse
 
@@ -259,8 +691,11 @@ def TBAEB(engine,app):
             result[:,0]=app.path.mesh(0)
         else:
             result[:,0]=array(xrange(app.path.rank(0)))
-        for i,paras in enumerate(app.path()):
-            result[i,1:]=eigh(engine.matrix(**paras),eigvals_only=True)
+        if app.path.tags==['k']:
+            result[:,1:]=engine.eigvals(app.path).reshape((app.path.rank(0),nmatrix))
+        else:
+            for i,paras in enumerate(app.path()):
+                result[i,1:]=eigh(engine.matrix(**paras),eigvals_only=True)
     else:
         result=zeros((2,nmatrix+1))
         result[:,0]=array(xrange(2))
@@ -271,6 +706,70 @@ def TBAEB(engine,app):
     if app.plot: app.figure('L',result,'%s/%s'%(engine.dout,name))
     if app.returndata: return result
 
+def _simplices_(nk,ndim):
+    '''
+    The Kuhn triangulation of a periodic regular mesh with `nk` points along each of the `ndim` directions.
+
+    Parameters
+    ----------
+    nk : int
+        The number of mesh points along each direction.
+    ndim : 1, 2 or 3
+        The dimension of the mesh.
+
+    Returns
+    -------
+    2d ndarray of int
+        The flattened indices of the vertices of the simplices, one row for each simplex.
+
+    Notes
+    -----
+    The mesh points are flattened in the same order as `KSpace`, i.e. the last index runs fastest.
+    Every cell is divided into `ndim!` simplices along its main diagonal.
+    '''
+    corners=indices((nk,)*ndim).reshape((ndim,-1)).T
+    strides=nk**arange(ndim-1,-1,-1)
+    result=[]
+    for permutation in it.permutations(xrange(ndim)):
+        vertices,vertex=[corners.dot(strides)],corners.copy()
+        for axis in permutation:
+            vertex[:,axis]+=1
+            vertices.append((vertex%nk).dot(strides))
+        result.append(array(vertices).T)
+    return concatenate(result)
+
+def _simplexcounts_(es,E):
+    '''
+    The integrated numbers of states of linearly interpolated simplices.
+
+    Parameters
+    ----------
+    es : 2d ndarray
+        The sorted energies on the vertices of the simplices, one row for each simplex.
+    E : 1d ndarray
+        The energies at which to count the states, one for each simplex, which should lie within the energy range of the corresponding simplex.
+
+    Returns
+    -------
+    1d ndarray
+        The numbers of states of the simplices below the energies, each simplex contributing one state in total.
+    '''
+    ndim=es.shape[1]-1
+    safe=lambda de: where(de>0,de,1.0)
+    if ndim==1:
+        e1,e2=es.T
+        result=(E-e1)/safe(e2-e1)
+    elif ndim==2:
+        e1,e2,e3=es.T
+        result=where(E>e2,1-(e3-E)**2/safe((e3-e1)*(e3-e2)),(E-e1)**2/safe((e2-e1)*(e3-e1)))
+    else:
+        e1,e2,e3,e4=es.T
+        n1=(E-e1)**3/safe((e2-e1)*(e3-e1)*(e4-e1))
+        n2=((e2-e1)**2+3*(e2-e1)*(E-e2)+3*(E-e2)**2-(e3-e1+e4-e2)*(E-e2)**3/safe((e3-e2)*(e4-e2)))/safe((e3-e1)*(e4-e1))
+        n3=1-(e4-E)**3/safe((e4-e1)*(e4-e2)*(e4-e3))
+        result=where(E>e3,n3,where(E>e2,n2,n1))
+    return result
+
 def TBADOS(engine,app):
     '''
     This method calculates the density of states of the Hamiltonian.
@@ -279,19 +778,68 @@ def TBADOS(engine,app):
     eigvals=engine.eigvals(app.BZ)
     emin=eigvals.min() if app.emin is None else app.emin
     emax=eigvals.max() if app.emax is None else app.emax
-    for i,v in enumerate(linspace(emin,emax,num=app.ne)):
-       result[i,0]=v
-       result[i,1]=sum(app.eta/((v-eigvals)**2+app.eta**2))
+    result[:,0]=linspace(emin,emax,num=app.ne)
+    if app.method=='L':
+        nbatch=max(engine.NSTACK/app.ne,1)
+        for i in xrange(0,len(eigvals),nbatch):
+            result[:,1]+=(app.eta/((result[:,0,newaxis]-eigvals[newaxis,i:i+nbatch])**2+app.eta**2)).sum(axis=1)
+    elif app.method=='H':
+        de=result[1,0]-result[0,0]
+        start=int(floor(min(eigvals.min()-emin,0.0)/de))
+        xs=(eigvals-emin)/de-start
+        ns=floor(xs).astype(int64)
+        nmesh=max(ns.max()+2,app.ne-start)
+        hist=bincount(ns,weights=ns+1-xs,minlength=nmesh)+bincount(ns+1,weights=xs-ns,minlength=nmesh)
+        lags=arange(-nmesh+1,nmesh)*de
+        result[:,1]=fftconvolve(hist,app.eta/(lags**2+app.eta**2))[nmesh-1-start:nmesh-1-start+app.ne]
+    else:
+        ndim,nk=len(engine.lattice.reciprocals),app.BZ.rank('k')
+        nside=int(round(nk**(1.0/ndim)))
+        if app.BZ.tags!=['k'] or nside<2 or nside**ndim!=nk: raise ValueError('TBADOS error: the tetrahedron method needs a regular mesh of the Brillouin zone.')
+        kmesh=app.BZ.mesh('k')
+        steps=array([kmesh[nside**(ndim-1-i)]-kmesh[0] for i in xrange(ndim)])
+        grid=kmesh[0]+indices((nside,)*ndim).reshape((ndim,-1)).T.dot(steps)
+        if not (allclose(grid,kmesh) and allclose(steps*nside,engine.lattice.reciprocals)):
+            raise ValueError('TBADOS error: the tetrahedron method needs a regular mesh of the Brillouin zone spanned by the reciprocals in the KSpace order.')
+        de=result[1,0]-result[0,0]
+        edges=concatenate([result[:,0]-de/2,[result[-1,0]+de/2]])
+        simplices,eigvals=_simplices_(nside,ndim),eigvals.reshape((nk,-1))
+        counts=zeros(app.ne+1)
+        for n in xrange(eigvals.shape[1]):
+            es=sort(eigvals[simplices,n],axis=1)
+            starts,stops=searchsorted(edges,es[:,0],side='right'),searchsorted(edges,es[:,-1],side='left')
+            counts+=cumsum(bincount(stops,minlength=app.ne+2))[:app.ne+1]
+            bounds=cumsum(stops-starts)
+            pos=0
+            while pos<len(es):
+                end=max(searchsorted(bounds,bounds[pos]-(stops[pos]-starts[pos])+engine.NSTACK,side='right'),pos+1)
+                lengths=stops[pos:end]-starts[pos:end]
+                sids=repeat(arange(pos,end),lengths)
+                eids=starts[sids]+arange(len(sids))-repeat(cumsum(lengths)-lengths,lengths)
+                counts+=bincount(eids,weights=_simplexcounts_(es[sids],edges[eids]),minlength=app.ne+1)
+                pos=end
+        result[:,1]=diff(counts)*pi*nk/len(simplices)/de
     name='%s_%s'%(engine,app.name)
     if app.savedata: savetxt('%s/%s.dat'%(engine.dout,name),result)
     if app.plot: app.figure('L',result,'%s/%s'%(engine.dout,name))
     if app.returndata: return result
 
+def TBAKPM(engine,app):
+    '''
+    This method calculates the density of states of the real-space Hamiltonian by the kernel polynomial method.
+    '''
+    result=app.set(engine.csrmatrix())
+    engine.log<<'::<KPM>:: nmoment=%s, nvector=%s, maximum stochastic error=%.4e\n'%(app.nmoment,app.nvector,result[:,2].max())
+    name='%s_%s'%(engine,app.name)
+    if app.savedata: savetxt('%s/%s.dat'%(engine.dout,name),result)
+    if app.plot: app.figure('L',result[:,0:2],'%s/%s'%(engine.dout,name))
+    if app.returndata: return result
+
 def TBABC(engine,app):
     '''
     This method calculates the total Berry curvature and Chern number of the filled bands of the Hamiltonian.
     '''
-    bc,cn=app.set(lambda kx,ky: engine.matrix(k=[kx,ky]))
+    bc,cn=app.set(lambda kx,ky: engine.matrix(k=[kx,ky]),Hs=lambda ks: engine.matrix_batch(ks=ks))
     engine.log<<'Chern number(mu): %s(%s)'%(cn,app.mu)<<'\n'
     if app.savedata or app.plot or app.returndata:
         result=zeros((app.BZ.rank('k'),3))
@@ -301,3 +849,47 @@ def TBABC(engine,app):
         if app.savedata: savetxt('%s/%s.dat'%(engine.dout,name),result)
         if app.plot: app.figure('P',result.reshape((int(sqrt(result.shape[0])),int(sqrt(result.shape[0])),3)),'%s/%s'%(engine.dout,name),axis='equal')
         if app.returndata: return cn if app.bcoff else cn,result
+
+def TBAWCC(engine,app):
+    '''
+    This method calculates the Wannier charge centers of the occupied bands of the Hamiltonian.
+    '''
+    table=engine.generator.table
+    rcoords=array([engine.lattice.rcoord(index.pid) for index in sorted(table,key=table.get)])
+    result=app.set(lambda kx,ky: engine.matrix(k=[kx,ky]),Hs=lambda ks: engine.matrix_batch(ks=ks),rcoords=rcoords)
+    engine.log<<'::<WCC>:: nline=%s, nocc=%s\n'%(result.shape[0],result.shape[1]-1)
+    name='%s_%s'%(engine,app.name)
+    if app.savedata: savetxt('%s/%s.dat'%(engine.dout,name),result)
+    if app.plot: app.figure('L',result,'%s/%s'%(engine.dout,name),style='b.')
+    if app.returndata: return result
+
+def TBAGAP(engine,app):
+    '''
+    This method calculates the self-consistent pairing gap of a real-space BdG system.
+    '''
+    if engine.sparse and app.cutoff is None: raise ValueError('TBAGAP error: the cutoff is needed in the sparse mode.')
+    nmatrix,nqp=engine.nmatrix,app.nqp if engine.sparse else engine.nmatrix/2
+    rows,cols,gaps=engine.pairings()
+    rows=rows-nmatrix/2
+    for i in xrange(app.maxiter):
+        while True:
+            es,ws=engine.bdgeigs(k=nqp,pairings=gaps,return_eigenvectors=True)
+            if app.cutoff is None or es[-1]>app.cutoff or 2*nqp>=nmatrix-1: break
+            nqp*=2
+        if app.cutoff is not None: es,ws=es[es<=app.cutoff],ws[:,es<=app.cutoff]
+        f=zeros(len(es)) if abs(app.temperature)<RZERO else expit(-es/app.temperature)
+        weights=ones(len(es)) if app.cutoff is None or app.smearing<=0 else cos(pi/2*clip((es-app.cutoff)/app.smearing+1,0.0,1.0))**2
+        us,vs=ws[:nmatrix/2],ws[nmatrix/2:]*weights
+        amplitudes=(vs[rows].conjugate()*us[cols]*f+us[rows]*vs[cols].conjugate()*(1-f)).sum(axis=1)
+        delta=-app.coupling*amplitudes.conjugate()-gaps
+        residual=abs(delta).max() if len(delta)>0 else 0.0
+        engine.log<<'::<GAP>:: iteration=%s, nqp=%s, residual=%.4e\n'%(i+1,len(es),residual)
+        if residual<app.tol:
+            gaps=gaps+delta
+            break
+        gaps=gaps+app.mixing*delta
+    else:
+        engine.log<<'::<GAP>:: warning: not converged, residual=%.4e after %s iterations.\n'%(residual,app.maxiter)
+    engine.log<<'::<GAP>:: mean gap=%.6f, lowest quasi-particle energy=%.6f\n'%(abs(gaps).mean() if len(gaps)>0 else 0.0,engine.bdgeigs(k=1,pairings=gaps)[0])
+    if app.savedata: savetxt('%s/%s_%s.dat'%(engine.dout,engine,app.name),concatenate([rows[:,newaxis]+nmatrix/2,cols[:,newaxis],gaps.real[:,newaxis],gaps.imag[:,newaxis]],axis=1))
+    if app.returndata: return gaps
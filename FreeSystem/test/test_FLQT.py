@@ -1,5 +1,5 @@
 '''
-FLQT test (1 test in total).
+FLQT test (2 tests in total).
 '''
 
 __all__=['flqt']
@@ -33,6 +33,32 @@ class TestFLQT(TestCase):
         flqt.register(QEB(name='QEB',ts=TSpace(np.array([0,0.5,1])),savedata=False,run=FLQTQEB))
         flqt.summary()
 
+    def test_evolution(self):
+        print
+        lattice=Lattice(name='ssh',rcoords=[np.array([0.0]),np.array([0.5])],vectors=[np.array([1.0])])
+        config=IDFConfig(priority=DEFAULT_FERMIONIC_PRIORITY,pids=lattice.pids,map=lambda pid: Fermi(atom=pid.site%2,norbital=1,nspin=1,nnambu=1))
+        flqt=FLQT(
+            name=       'ssh',
+            parameters= OrderedDict([('t1',-1.0),('m',0.8),('t',None)]),
+            map=        lambda parameters: {'mu': parameters['m']*np.cos(2*np.pi*parameters['t'])},
+            lattice=    lattice,
+            config=     config,
+            terms=[     Hopping('t1',-1.0),
+                        Onsite('mu',0.0,indexpacks=sigmaz('sl'),modulate=True),
+                        ],
+            mask=       ['nambu']
+            )
+        path=KSpace(reciprocals=lattice.reciprocals,nk=20)
+        ks=path.mesh('k')
+        self.assertTrue(np.allclose(flqt.evolutions(np.linspace(0,1,41),ks,method='trotter'),flqt.evolutions(np.linspace(0,1,41),ks,method='expm'),atol=10**-12))
+        exact=flqt.evolutions(np.linspace(0,1,641),ks,method='magnus4')
+        errors=[np.abs(flqt.evolutions(np.linspace(0,1,n+1),ks,method='magnus4')-exact).max() for n in (20,40)]
+        self.assertGreater(errors[0]/errors[1],12.0)
+        for method,nstep,tol in (('expm',40,None),('trotter',40,None),('magnus4',640,None),('magnus4',10,10**-8)):
+            flqt.register(QEB(name='QEB_%s_%s'%(method,nstep),path=path,ts=TSpace(np.linspace(0,1,nstep+1)),method=method,tol=tol,savedata=False,plot=False,returndata=True,run=FLQTQEB))
+        self.assertTrue(np.allclose(flqt.records['QEB_trotter_40'],flqt.records['QEB_expm_40'],atol=10**-12))
+        self.assertTrue(np.allclose(flqt.records['QEB_magnus4_10'],flqt.records['QEB_magnus4_640'],atol=10**-7))
+
 flqt=TestSuite([
             TestLoader().loadTestsFromTestCase(TestFLQT),
             ])
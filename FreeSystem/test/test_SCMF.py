@@ -1,5 +1,5 @@
 '''
-SCMF test (1 test in total).
+SCMF test (2 tests in total).
 '''
 
 __all__=['scmf']
@@ -7,6 +7,8 @@ __all__=['scmf']
 from HamiltonianPy.Basics import *
 from HamiltonianPy.FreeSystem.SCMF import *
 from HamiltonianPy.FreeSystem.TBA import *
+from scipy.linalg import eigh
+import numpy as np
 from unittest import TestCase,TestLoader,TestSuite
 
 class TsetSCMF(TestCase):
@@ -36,6 +38,39 @@ class TsetSCMF(TestCase):
         scmf.register(BC(name='BC',BZ=KSpace(reciprocals=scmf.lattice.reciprocals,nk=200),mu=scmf.mu,d=10**-6,savedata=False,run=TBABC))
         scmf.summary()
 
+    def test_mixing(self):
+        print
+        U=4.0
+        lattice=Hexagon(name='H2')('1P-1P',2)
+        config=IDFConfig(priority=DEFAULT_FERMIONIC_PRIORITY,pids=lattice.pids,map=lambda pid: Fermi(atom=pid.site%2,norbital=1,nspin=2,nnambu=1))
+        BZ=KSpace(reciprocals=lattice.reciprocals,nk=30)
+        results={}
+        for method in ('broyden','diis'):
+            scmf=SCMF(
+                name=       'H2_SCMF_%s'%method,
+                parameters= {'U':U},
+                lattice=    lattice,
+                config=     config,
+                filling=    0.5,
+                terms=[     Hopping('t1',-1.0)],
+                orders=[    Onsite('afm',0.2,indexpacks=sigmaz('sp')*sigmaz('sl'),modulate=lambda **karg: -U*karg['afm']/2 if 'afm' in karg else None)],
+                mask=       ['nambu']
+                )
+            scmf.update_ops(BZ)
+            m=np.zeros((scmf.nmatrix,scmf.nmatrix),dtype=np.complex128)
+            for matrix in scmf.matrices(BZ):
+                es,vs=eigh(matrix)
+                for e,v in zip(es,vs.T):
+                    if e<=scmf.mu: m+=np.outer(v.conj(),v)
+            self.assertAlmostEqual(scmf.ops['afm'].value,np.sum(m*scmf.ops['afm'].matrix).real/BZ.rank('k')/scmf.nmatrix*2)
+            scmf.ops['afm'].value=0.2
+            residuals=scmf.iterate(BZ,tol=10**-9,maxiter=200,method=method)
+            print '%s: %s iterations'%(method,len(residuals))
+            self.assertLess(residuals[-1],10**-9)
+            results[method]=scmf.ops['afm'].value
+        self.assertGreater(results['broyden'],0.1)
+        self.assertAlmostEqual(results['broyden'],results['diis'],places=6)
+
 scmf=TestSuite([
             TestLoader().loadTestsFromTestCase(TsetSCMF),
             ])
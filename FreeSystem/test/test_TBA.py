@@ -1,12 +1,14 @@
 '''
-TBA test (2 tests in total).
+TBA test (10 tests in total).
 '''
 
 __all__=['tba']
 
 import numpy as np
 from HamiltonianPy.Basics import *
+import HamiltonianPy.Misc as HM
 from HamiltonianPy.FreeSystem.TBA import *
+from scipy.linalg import eigh
 from unittest import TestCase,TestLoader,TestSuite
 
 class TestTBA(TestCase):
@@ -45,6 +47,185 @@ class TestTBA(TestCase):
         pd.register(DOS(name='DOS',parameters={'mu':0.0},BZ=KSpace(reciprocals=pd.lattice.reciprocals,nk=10000),eta=0.01,ne=400,savedata=False,run=TBADOS))
         pd.summary()
 
+    def test_batch(self):
+        print
+        for bc in ('op','pd'):
+            tba=self.tbaconstruct(bc=bc,t1=-1.0,t2=-0.5,mu=0.0,delta=0.4)
+            nmatrix=tba.nmatrix
+            for mu in (0.0,0.3):
+                ks=np.random.random((50,2))*[2*np.pi,0] if bc=='pd' else None
+                result=tba.matrix_batch(ks=ks,mu=mu)
+                for i,k in enumerate([()] if ks is None else ks):
+                    matrix=np.zeros((nmatrix,nmatrix),dtype=np.complex128)
+                    for opt in tba.generator.operators.values():
+                        phase=1 if len(k)==0 else np.exp(-1j*np.inner(k,opt.rcoord))
+                        matrix[opt.seqs]+=opt.value*phase
+                        i1,i2=opt.seqs
+                        if i1<nmatrix/2 and i2<nmatrix/2: matrix[i2+nmatrix/2,i1+nmatrix/2]+=-opt.value*np.conjugate(phase)
+                    matrix+=np.conjugate(matrix.T)
+                    self.assertTrue(np.allclose(result[i],matrix,atol=10**-12))
+                    self.assertTrue(np.allclose(tba.matrix(k=k),matrix,atol=10**-12))
+
+    def test_spectrum(self):
+        print
+        for bc,kspace in (('op',None),('pd',KSpace(reciprocals=[np.array([2*np.pi,0.0])],nk=2000))):
+            tba=self.tbaconstruct(bc=bc,t1=-1.0,t2=-0.5,mu=0.0,delta=0.4)
+            for mu in (0.0,0.3):
+                tba.update(mu=mu)
+                eigvals=np.sort(np.asarray([eigh(tba.matrix(**paras),eigvals_only=True) for paras in ([{}] if kspace is None else kspace())]).reshape(-1))
+                nk=1 if kspace is None else kspace.rank('k')
+                for filling in (0.25,0.5):
+                    nelectron=int(round(filling*nk*tba.nmatrix))
+                    self.assertAlmostEqual(tba.mu(filling,kspace),(eigvals[nelectron]+eigvals[nelectron-2])/2,delta=10**-12)
+                    self.assertAlmostEqual(tba.gse(filling,kspace),eigvals[0:nelectron].sum(),delta=10**-12*nk*tba.nmatrix)
+                for e in (-0.123,0.456):
+                    self.assertEqual(tba.filling(e,kspace),np.searchsorted(eigvals,e)*1.0/len(eigvals))
+                self.assertTrue(tba.spectrum(kspace) is tba.spectrum(kspace))
+
+    def test_dos(self):
+        print
+        for ndim,nk,nkd in ((2,100,1000),(3,30,120)):
+            lattice=Lattice(name='C%s'%ndim,rcoords=[np.zeros(ndim)],vectors=list(np.eye(ndim)),neighbours=2)
+            config=IDFConfig(priority=DEFAULT_FERMIONIC_PRIORITY,pids=lattice.pids,map=lambda pid: Fermi(norbital=1,nspin=1,nnambu=1))
+            tba=TBA(name='C%s'%ndim,lattice=lattice,config=config,terms=[Hopping('t1',-1.0),Hopping('t2',0.2,neighbour=2)])
+            BZ,dense=KSpace(reciprocals=lattice.reciprocals,nk=nk),KSpace(reciprocals=lattice.reciprocals,nk=nkd)
+            for method in ('L','H','T'):
+                tba.register(DOS(name='DOS%s'%method,BZ=BZ,emin=-9.0,emax=9.0,ne=1801,eta=0.05,method=method,savedata=False,plot=False,run=TBADOS))
+            tba.summary()
+            L,H,T=tba.records['DOSL'],tba.records['DOSH'],tba.records['DOST']
+            eigvals,de,nstate=tba.eigvals(BZ),L[1,0]-L[0,0],BZ.rank('k')*tba.nmatrix
+            self.assertTrue(np.allclose(L[:,1],[np.sum(0.05/((v-eigvals)**2+0.05**2)) for v in L[:,0]],rtol=10**-10))
+            self.assertLess(np.abs(H[:,1]-L[:,1]).max(),5*10**-3*L[:,1].max())
+            self.assertAlmostEqual(T[:,1].sum()*de/np.pi/nstate,1.0,delta=10**-10)
+            for i in (700,900,1100):
+                mu=T[i,0]-de/2
+                self.assertAlmostEqual(T[:i,1].sum()*de/np.pi/nstate,tba.filling(mu,dense),delta=5*10**-4 if ndim==2 else 2*10**-3)
+        lattice=Hexagon('H2')('1P-1P',nneighbour=1)
+        config=IDFConfig(priority=DEFAULT_FERMIONIC_PRIORITY,pids=lattice.pids,map=lambda pid: Fermi(norbital=1,nspin=1,nnambu=1))
+        tba=TBA(name='H2',lattice=lattice,config=config,terms=[Hopping('t1',-1.0)])
+        for BZ in (hexagon_bz(reciprocals=lattice.reciprocals,nk=30),KSpace(reciprocals=lattice.reciprocals[::-1],nk=30)):
+            self.assertRaises(ValueError,TBADOS,tba,DOS(name='DOST',BZ=BZ,ne=101,eta=0.05,method='T',savedata=False,plot=False,run=TBADOS))
+
+    def test_sparse(self):
+        print
+        np.random.seed(1)
+        lattice=Square('S1')('40O-40O',nneighbour=1)
+        disorder=np.random.uniform(-1.0,1.0,len(lattice))
+        config=IDFConfig(priority=DEFAULT_FERMIONIC_PRIORITY,pids=lattice.pids,map=lambda pid: Fermi(norbital=1,nspin=1,nnambu=1))
+        tba=TBA(name='S40',lattice=lattice,config=config,terms=[Hopping('t1',-1.0),Onsite('w',1.0,amplitude=lambda bond: disorder[bond.spoint.pid.site])],sparse=True)
+        tba.NPROBE=256
+        eigvals=np.linalg.eigvalsh(tba.matrix())
+        self.assertTrue(np.allclose(tba.csrmatrix().toarray(),tba.matrix()))
+        self.assertTrue(np.allclose(tba.eigs(sigma=0.1,k=6),np.sort(eigvals[np.argsort(np.abs(eigvals-0.1))[:6]]),atol=10**-10))
+        for filling in (0.2,0.5):
+            nelectron=int(round(filling*tba.nmatrix))
+            dfilling,dmu,dgse=tba.chebstderr(filling)
+            print 'filling=%s: dgse=%.3e, dmu=%.3e, dfilling=%.3e'%(filling,dgse,dmu,dfilling)
+            self.assertAlmostEqual(tba.gse(filling),eigvals[:nelectron].sum(),delta=4*dgse+0.1)
+            self.assertAlmostEqual(tba.mu(filling),(eigvals[nelectron]+eigvals[nelectron-2])/2,delta=4*dmu+5*10**-3)
+        for mu in (-1.0,0.5):
+            self.assertAlmostEqual(tba.filling(mu),np.searchsorted(eigvals,mu)*1.0/len(eigvals),delta=4*tba.chebstderr(tba.filling(mu))[0]+1.0/tba.nmatrix)
+
+    def test_bdg(self):
+        print
+        np.random.seed(3)
+        lattice=Square('S1')('8O-8O',nneighbour=1)
+        disorder=np.random.uniform(-1.0,1.0,len(lattice))
+        config=IDFConfig(priority=DEFAULT_FERMIONIC_PRIORITY,pids=lattice.pids,map=lambda pid: Fermi(norbital=1,nspin=2,nnambu=2))
+        gaps={}
+        for sparse in (False,True):
+            tba=TBA(
+                name=       'S8(%s)'%('sparse' if sparse else 'dense'),
+                lattice=    lattice,
+                config=     config,
+                terms=[     Hopping('t',-1.0),
+                            Onsite('mu',-0.5),
+                            Onsite('w',1.0,amplitude=lambda bond: disorder[bond.spoint.pid.site]),
+                            Pairing('D',0.3,neighbour=0,indexpacks=sigmay('sp')*1j)
+                            ],
+                mask=       [],
+                sparse=     sparse
+                )
+            eigvals=np.linalg.eigvalsh(tba.matrix())
+            self.assertTrue(np.allclose(tba.csrmatrix().toarray(),tba.matrix()))
+            self.assertTrue(np.allclose(tba.bdgeigs(k=6),eigvals[tba.nmatrix/2:tba.nmatrix/2+6],atol=10**-10))
+            tba.register(GAP(name='GAP',coupling=2.5,cutoff=0.8,nqp=8,tol=10**-9,savedata=False,run=TBAGAP))
+            gaps[sparse]=tba.records['GAP']
+        self.assertGreater(np.abs(gaps[True]).mean(),0.1)
+        self.assertTrue(np.allclose(gaps[True],gaps[False],atol=10**-7))
+        rows,cols,_=tba.pairings()
+        es,vs=np.linalg.eigh(tba.csrmatrix(pairings=gaps[True]).toarray())
+        weights=np.cos(np.pi/2*np.clip((-es[es<0]-0.8)/0.1+1,0.0,1.0))**2
+        rho=(vs[:,es<0].conjugate()*weights).dot(vs[:,es<0].T)
+        self.assertTrue(np.allclose(gaps[True],-2.5*rho[rows,cols].conjugate(),atol=10**-7))
+
+    def test_kpm(self):
+        print
+        np.random.seed(2)
+        lattice=Square('S1')('30O-30O',nneighbour=2)
+        config=IDFConfig(priority=DEFAULT_FERMIONIC_PRIORITY,pids=lattice.pids,map=lambda pid: Fermi(norbital=1,nspin=1,nnambu=1))
+        tba=TBA(name='S30',lattice=lattice,config=config,terms=[Hopping('t1',-1.0),Hopping('t2',0.3,neighbour=2)],sparse=True)
+        eigvals=np.linalg.eigvalsh(tba.matrix())
+        tba.register(KPM(name='KPM',ne=401,nmoment=256,nvector=32,np=3,savedata=False,plot=False,run=TBAKPM))
+        es,dos,err=tba.records['KPM'].T
+        a,b,de=(es[-1]-es[0])/2,(es[-1]+es[0])/2,es[1]-es[0]
+        exact=np.pi*HM.kpmdos(np.cos(np.arange(256)[:,np.newaxis]*np.arccos((eigvals-b)/a)[np.newaxis,:]).sum(axis=1),a,b,es)
+        self.assertTrue(np.all(np.abs(dos-exact)<=5*err+10**-10))
+        for e in (-1.0,0.5,2.0):
+            i=np.searchsorted(es,e)
+            self.assertAlmostEqual(dos[:i].sum()*de/np.pi,np.searchsorted(eigvals,es[i]-de/2),delta=10**-2*len(eigvals))
+
+    def test_chern(self):
+        print
+        def haldane_hopping(bond):
+            theta=azimuthd(bond.rcoord)
+            return 1 if abs(theta)<RZERO or abs(theta-120)<RZERO or abs(theta-240)<RZERO else -1
+        lattice=Hexagon(name='H2')('1P-1P',2)
+        config=IDFConfig(priority=DEFAULT_FERMIONIC_PRIORITY,pids=lattice.pids,map=lambda pid: Fermi(atom=pid.site%2,norbital=1,nspin=1,nnambu=1))
+        for m,cn in ((0.3,1),(1.0,0)):
+            tba=TBA(
+                name=       'Haldane',
+                lattice=    lattice,
+                config=     config,
+                terms=[     Hopping('t1',-1.0),
+                            Hopping('t2',0.1j,indexpacks=sigmaz('sl'),amplitude=haldane_hopping,neighbour=2),
+                            Onsite('m',m,indexpacks=sigmaz('sl')),
+                            ],
+                mask=       ['nambu']
+                )
+            tba.register(BC(name='FHS',BZ=KSpace(reciprocals=lattice.reciprocals,nk=8),mu=0.0,method='fhs',savedata=False,plot=False,returndata=True,run=TBABC))
+            tba.register(BC(name='Kubo',BZ=KSpace(reciprocals=lattice.reciprocals,nk=40),mu=0.0,method='kubo',savedata=False,plot=False,returndata=True,run=TBABC))
+            self.assertAlmostEqual(tba.records['FHS'][0],cn,delta=10**-10)
+            self.assertAlmostEqual(tba.records['Kubo'][0],cn,delta=10**-4)
+
+    def test_wcc(self):
+        print
+        def haldane_hopping(bond):
+            theta=azimuthd(bond.rcoord)
+            return 1 if abs(theta)<RZERO or abs(theta-120)<RZERO or abs(theta-240)<RZERO else -1
+        def rashba(bond):
+            d=bond.rcoord/np.linalg.norm(bond.rcoord)
+            return sigmax('sp')*d[1]-sigmay('sp')*d[0]
+        lattice=Hexagon(name='H2')('1P-1P',2)
+        config=IDFConfig(priority=DEFAULT_FERMIONIC_PRIORITY,pids=lattice.pids,map=lambda pid: Fermi(atom=pid.site%2,norbital=1,nspin=2,nnambu=1))
+        for lv,z2 in ((0.1,1),(1.5,0)):
+            tba=TBA(
+                name=       'KM',
+                lattice=    lattice,
+                config=     config,
+                terms=[     Hopping('t',-1.0),
+                            Hopping('lso',0.2j,indexpacks=sigmaz('sl')*sigmaz('sp'),amplitude=haldane_hopping,neighbour=2),
+                            Hopping('lr',0.05j,indexpacks=rashba),
+                            Onsite('lv',lv,indexpacks=sigmaz('sl')),
+                            ],
+                mask=       ['nambu']
+                )
+            for axis in (0,1):
+                tba.register(WCC(name='WCC-%s'%axis,BZ=KSpace(reciprocals=lattice.reciprocals,nk=40),mu=0.0,axis=axis,savedata=False,plot=False,returndata=True,run=TBAWCC))
+                result=tba.records['WCC-%s'%axis]
+                self.assertTrue(np.allclose(result[[0,20],1],result[[0,20],2],atol=10**-8))
+                self.assertEqual(WCC.z2(result),z2)
+
 tba=TestSuite([
             TestLoader().loadTestsFromTestCase(TestTBA),
             ])
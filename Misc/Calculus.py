@@ -4,10 +4,10 @@ Calculus
 ========
 
 Calculus related functions, including
-    * functions: bisect, derivatives, fpapprox, quadapprox, line_search_stable, newton, fstable
+    * functions: bisect, derivatives, fpapprox, quadapprox, glquad, quadvec, line_search_stable, newton, fstable
 '''
 
-__all__=['bisect','derivatives','fpapprox','quadapprox','line_search_stable','newton','fstable']
+__all__=['bisect','derivatives','fpapprox','quadapprox','glquad','quadvec','line_search_stable','newton','fstable']
 
 import numpy as np
 import numpy.linalg as nl
@@ -15,6 +15,59 @@ import scipy.interpolate as ip
 import scipy.optimize as op
 import warnings
 
+class _FCall_(object):
+    '''
+    A picklable function call `fun(x,*args)` to be dispatched by an executor.
+    '''
+
+    def __init__(self,fun,args=()):
+        self.fun=fun
+        self.args=args
+
+    def __call__(self,x):
+        return self.fun(x,*self.args)
+
+class _FRecord_(object):
+    '''
+    A function with its evaluations recorded, so that points evaluated before, up to rounding, are reused.
+    '''
+    TOL=10**-12
+
+    def __init__(self,fun,args=(),executor=None):
+        self.fun=fun
+        self.args=args
+        self.executor=executor
+        self.xs=[]
+        self.fs=[]
+
+    def __len__(self):
+        return len(self.fs)
+
+    def find(self,x):
+        x=np.asarray(x)
+        for i,y in enumerate(self.xs):
+            if np.max(np.abs(x-y))<=self.TOL*(1+np.max(np.abs(x))): return i
+        return None
+
+    def map(self,xs):
+        todos=[]
+        for x in xs:
+            if self.find(x) is None and all(np.max(np.abs(np.asarray(x)-todo))>self.TOL*(1+np.max(np.abs(x))) for todo in todos): todos.append(np.array(x))
+        self.fs.extend(_fmap_(self.fun,todos,self.args,self.executor))
+        self.xs.extend(todos)
+        return [self.fs[self.find(x)] for x in xs]
+
+    def __call__(self,x):
+        return self.map([x])[0]
+
+def _fmap_(fun,xs,args=(),executor=None):
+    '''
+    Evaluate a function at a batch of points, serially or concurrently by an executor.
+    '''
+    if isinstance(fun,_FRecord_): return fun.map(xs)
+    if executor is None or len(xs)<2: return [fun(x,*args) for x in xs]
+    return list(executor.map(_FCall_(fun,args),xs))
+
 def bisect(f,xs,args=()):
     '''
     Find the minimum interval that contains the root of a function using the bisection method.
@@ -81,7 +134,7 @@ def derivatives(xs,ys,ders=(1,)):
         result[i]=ip.splev(xs,tck,der=der)
     return result
 
-def fpapprox(fun,x0,args=(),eps=1.49e-06,fpmode=0):
+def fpapprox(fun,x0,args=(),eps=1.49e-06,fpmode=0,executor=None,basis=None):
     '''
     Finite-difference approximation of the gradient of a scalar function at a given point.
 
@@ -98,21 +151,29 @@ def fpapprox(fun,x0,args=(),eps=1.49e-06,fpmode=0):
     fpmode : 0 or 1, optional
         * 0 use ``(f(x+eps)-f(x))/eps`` to approximate fp;
         * 1 use ``(f(x+eps)-f(x-eps))/2/eps`` to approximate fp.
+    executor : object with a `map` method, optional
+        The executor, e.g. a ``multiprocessing.Pool``, to evaluate the function at all the stencil points concurrently.
+    basis : 2d ndarray, optional
+        The orthonormal directions of the finite differences as columns, default the Cartesian ones.
 
     Returns
     -------
     1d ndarray
         The approximated gradient.
     '''
-    if fpmode==0:
+    x0=np.asarray(x0)
+    if fpmode==0 and executor is None and basis is None and not isinstance(fun,_FRecord_):
         return op.approx_fprime(x0,fun,eps,*args)
+    dx=np.eye(len(x0)) if basis is None else np.asarray(basis).T
+    if fpmode==0:
+        fs=np.asarray(_fmap_(fun,[x0]+[x0+eps*d for d in dx],args,executor))
+        result=(fs[1:]-fs[0])/eps
     else:
-        result,dx=np.zeros(len(x0)),np.eye(len(x0))
-        for i in xrange(len(x0)):
-            result[i]=(fun(x0+eps*dx[i],*args)-fun(x0-eps*dx[i],*args))/2/eps
-        return result
+        fs=np.asarray(_fmap_(fun,[x0+eps*d for d in dx]+[x0-eps*d for d in dx],args,executor))
+        result=(fs[:len(dx)]-fs[len(dx):])/2/eps
+    return result if basis is None else dx.T.dot(result)
 
-def quadapprox(fun,x0,args=(),eps=1.49e-06):
+def quadapprox(fun,x0,args=(),eps=1.49e-06,executor=None,basis=None):
     '''
     Quadratic approximation of a function at a given point.
 
@@ -126,6 +187,10 @@ def quadapprox(fun,x0,args=(),eps=1.49e-06):
         The extra arguments of the function ``fun``.
     eps : float, optional
         The step size.
+    executor : object with a `map` method, optional
+        The executor, e.g. a ``multiprocessing.Pool``, to evaluate the function at all the stencil points concurrently.
+    basis : 2d ndarray, optional
+        The orthonormal directions of the stencil as columns, default the Cartesian ones.
 
     Returns
     -------
@@ -136,26 +201,28 @@ def quadapprox(fun,x0,args=(),eps=1.49e-06):
     fp2 : 2d ndarray
         The approximated second order derivatives at the given point.
     '''
-    N,xs,diffs=len(x0),[],[]
+    x0,N,xs,diffs=np.asarray(x0),len(x0),[],[]
     es,eps=np.eye(N),[eps]*N if isinstance(eps,float) else eps
+    ds=es if basis is None else np.asarray(basis).T
     for i in xrange(N):
-        xs.append(x0+eps[i]*es[i])
+        xs.append(x0+eps[i]*ds[i])
         diffs.append(eps[i]*es[i])
-        xs.append(x0-eps[i]*es[i])
+        xs.append(x0-eps[i]*ds[i])
         diffs.append(-eps[i]*es[i])
         for j in xrange(i):
-            xs.append(x0+eps[i]*es[i]+eps[j]*es[j])
+            xs.append(x0+eps[i]*ds[i]+eps[j]*ds[j])
             diffs.append(eps[i]*es[i]+eps[j]*es[j])
-    f0,nfev=fun(x0,*args),len(xs)+1
+    fs=_fmap_(fun,[x0]+xs,args,executor)
     a,b=np.zeros((N*(N+3)/2,N*(N+3)/2)),np.zeros(N*(N+3)/2)
-    for n,(x,diff) in enumerate(zip(xs,diffs)):
+    for n,(f,diff) in enumerate(zip(fs[1:],diffs)):
         count=0
         for i,di in enumerate(diff):
             a[n,i]=di
             a[n,N+count:N+count+i+1]=di*diff[:i+1]
             count+=i+1
-        b[n]=fun(x,*args)
-    coeff,count=nl.solve(a,b-f0),0
+        b[n]=f
+    f0,count=fs[0],0
+    coeff=nl.solve(a,b-f0)
     fp1,fp2=coeff[:N],np.zeros((N,N))
     for i in xrange(N):
         for j in xrange(i+1):
@@ -165,9 +232,98 @@ def quadapprox(fun,x0,args=(),eps=1.49e-06):
                 fp2[i,j]=coeff[N+count]
                 fp2[j,i]=fp2[i,j]
             count+=1
+    if basis is not None: fp1,fp2=ds.T.dot(fp1),ds.T.dot(fp2).dot(ds)
     return f0,fp1,fp2
 
-def line_search_stable(fun,x0,dx,fp1,fp2,args=(),eps=1.49e-06,fpmode=0,c1=1e-4):
+def glquad(n,scale=1.0):
+    '''
+    Gauss-Legendre quadrature rule on the semi-infinite interval [0,inf), with an embedded lower-order rule for error estimation.
+
+    Parameters
+    ----------
+    n : int
+        The order of the rule, i.e. the number of nodes.
+    scale : float, optional
+        The scale of the map `x=scale*t/(1-t)` from [0,1) to [0,inf).
+
+    Returns
+    -------
+    xs : 1d ndarray
+        The nodes.
+    ws : 1d ndarray
+        The weights.
+    ews : 1d ndarray
+        The weights of the embedded interpolatory rule built on every other node, zero on the unused ones.
+
+    Notes
+    -----
+    For the integrand values `fs` at the nodes, `ws.dot(fs)` gives the integral and `abs((ws-ews).dot(fs))` a conservative estimate of its error.
+    '''
+    assert n>1 and scale>0
+    ts,ws=np.polynomial.legendre.leggauss(n)
+    sub=np.arange(0,n,2)
+    ews,moments=np.zeros(n),np.zeros(len(sub))
+    moments[0]=2.0
+    ews[sub]=nl.solve(np.polynomial.legendre.legvander(ts[sub],len(sub)-1).T,moments)
+    ts=(ts+1)/2
+    jacobian=scale/(1-ts)**2/2
+    return scale*ts/(1-ts),ws*jacobian,ews*jacobian
+
+_GK15_=np.array([0.991455371120812639206854697526329,0.949107912342758524526189684047851,0.864864423359769072789712788640926,0.741531185599394439863864773280788,
+                 0.586087235467691130294144845693013,0.405845151377397166906606412076961,0.207784955007898467600689403773245,0.0])
+_WK15_=np.array([0.022935322010529224963732008058970,0.063092092629978553290700663189204,0.104790010322250183839876322541518,0.140653259715525918745189590510238,
+                 0.169004726639267902826583426598550,0.190350578064785409913256402421014,0.204432940075298892414161999234649,0.209482141084727828012999174891714])
+_WG7_=np.array([0.0,0.129484966168869693270611432679082,0.0,0.279705391489276667901467771423780,0.0,0.381830050505118944950369775488975,0.0,0.417959183673469387755102040816327])
+
+def quadvec(fun,a=0.0,b=np.inf,epsabs=1.49e-8,epsrel=1.49e-8,limit=200):
+    '''
+    Adaptive Gauss-Kronrod quadrature of a batched vector-valued function over a finite or semi-infinite interval.
+
+    Parameters
+    ----------
+    fun : callable
+        The batched integrand, which maps a 1d ndarray of nodes to an ndarray whose first axis is for the nodes.
+    a,b : float, optional
+        The lower and upper limits of the integral, `b` can be `np.inf`.
+    epsabs,epsrel : float, optional
+        The absolute and relative tolerances of the integral in the max norm.
+    limit : int, optional
+        The maximum number of subintervals.
+
+    Returns
+    -------
+    result : ndarray
+        The integral.
+    err : np.float64
+        The estimated error of the integral in the max norm.
+    neval : int
+        The number of the evaluated nodes.
+
+    Notes
+    -----
+        * All the components share the same subdivision, which is refined at the subinterval with the largest error, and the 15 Kronrod nodes of each subinterval are evaluated in one call of `fun`.
+        * When `b` is infinite, the interval is mapped to (0,1] by `x=a+(1-t)/t` and bisected in the same way as QUADPACK's `qagi`, so that the nodes coincide with those of `scipy.integrate.quad` on the shared subintervals.
+    '''
+    ts,kws,gws=np.concatenate([-_GK15_,_GK15_[-2::-1]]),np.concatenate([_WK15_,_WK15_[-2::-1]]),np.concatenate([_WG7_,_WG7_[-2::-1]])
+    def integrate(lo,hi):
+        xs,hw=0.5*(lo+hi)+0.5*(hi-lo)*ts,0.5*(hi-lo)
+        if np.isinf(b): xs,kw,gw=a+(1-xs)/xs,hw*kws/xs**2,hw*gws/xs**2
+        else: kw,gw=hw*kws,hw*gws
+        fs=np.asarray(fun(xs))
+        result=np.tensordot(kw,fs,axes=(0,0))
+        return [lo,hi,result,np.abs(result-np.tensordot(gw,fs,axes=(0,0))).max()]
+    intervals=[integrate(*((0.0,1.0) if np.isinf(b) else (a,b)))]
+    while True:
+        result,err=sum(interval[2] for interval in intervals),sum(interval[3] for interval in intervals)
+        if err<=max(epsabs,epsrel*np.abs(result).max()): break
+        if len(intervals)>=limit:
+            warnings.warn('quadvec warning: the maximum number of subintervals(%s) is reached with the estimated error %.2e.'%(limit,err))
+            break
+        lo,hi=intervals.pop(max(xrange(len(intervals)),key=lambda i: intervals[i][3]))[:2]
+        intervals.extend([integrate(lo,0.5*(lo+hi)),integrate(0.5*(lo+hi),hi)])
+    return result,err,(2*len(intervals)-1)*len(ts)
+
+def line_search_stable(fun,x0,dx,fp1,fp2,args=(),eps=1.49e-06,fpmode=0,c1=1e-4,executor=None):
     '''
     Use the Armijo condition to search the stationary point of a function along a direction.
 
@@ -192,6 +348,8 @@ def line_search_stable(fun,x0,dx,fp1,fp2,args=(),eps=1.49e-06,fpmode=0,c1=1e-4):
         * 1 use ``(f(x+eps)-f(x-eps))/2/eps`` to approximate fp.
     c1 : float, optional
         Parameter for Armijo condition rule.
+    executor : object with a `map` method, optional
+        The executor, e.g. a ``multiprocessing.Pool``, to evaluate the function at the two points of each finite difference concurrently.
 
     Returns
     -------
@@ -204,8 +362,10 @@ def line_search_stable(fun,x0,dx,fp1,fp2,args=(),eps=1.49e-06,fpmode=0,c1=1e-4):
     '''
     eps=eps/nl.norm(dx)
     record=[]
-    fa=lambda alpha: fun(x0+alpha*dx,*args)
-    fap=(lambda alpha:(fa(alpha+eps)-fa(alpha))/eps) if fpmode==0 else (lambda alpha:(fa(alpha+eps)-fa(alpha-eps))/2/eps)
+    fa=lambda alpha: _fmap_(fun,[x0+alpha*dx],args)[0]
+    def fap(alpha):
+        fs=_fmap_(fun,[x0+(alpha+eps)*dx,x0+alpha*dx] if fpmode==0 else [x0+(alpha+eps)*dx,x0+(alpha-eps)*dx],args,executor)
+        return (fs[0]-fs[1])/eps if fpmode==0 else (fs[0]-fs[1])/2/eps
     def phi(alpha):
         record.append(alpha)
         return fap(alpha)**2
@@ -216,7 +376,7 @@ def line_search_stable(fun,x0,dx,fp1,fp2,args=(),eps=1.49e-06,fpmode=0,c1=1e-4):
     fop,fp1op=fa(alpha),fap(alpha)
     return alpha,fop,fp1op
 
-def newton(fun,x0,args=(),tol=10**-4,callback=None,disp=False,eps=1.49e-06,fpmode=0,hesmode='quadapprox',return_all=False,maxiter=50):
+def newton(fun,x0,args=(),tol=10**-4,callback=None,disp=False,eps=1.49e-06,fpmode=0,hesmode='quadapprox',return_all=False,maxiter=50,executor=None,reuse=False):
     '''
     Find the stable point of a function.
 
@@ -246,22 +406,22 @@ def newton(fun,x0,args=(),tol=10**-4,callback=None,disp=False,eps=1.49e-06,fpmod
         True for returning all the convergence information.
     maxiter : int, optional
         The maximum number of iterations.
+    executor : object with a `map` method, optional
+        The executor, e.g. a ``multiprocessing.Pool``, to evaluate the function at all the stencil points of a step concurrently.
+    reuse : logical, optional
+        True for aligning the stencil of each step with the previous step, so that the points evaluated by the line search are reused in the quadratic model.
 
     Returns
     -------
     OptimizeResult
         The result.
     '''
-    record={}
-    def fx(x):
-        xt=tuple(x)
-        if xt not in record: record[xt]=fun(x,*args)
-        return record[xt]
+    fx,basis=_FRecord_(fun,args,executor),None
     def fpquadapprox(f,x):
-        f,fp1,fp2=quadapprox(f,x,eps=eps)
+        f,fp1,fp2=quadapprox(f,x,eps=eps,basis=basis)
         return fp1,fp2
     def fpbfgs(f,x,dx,fp1,fp2):
-        nfp=fpapprox(f,x,eps=eps,fpmode=fpmode)
+        nfp=fpapprox(f,x,eps=eps,fpmode=fpmode,basis=basis)
         dfp=nfp-fp1
         fp1=nfp
         fp2+=np.einsum('i,j->ij',dfp,dfp)/dfp.dot(dx)-np.einsum('i,j->ij',fp2.dot(dx),fp2.T.dot(dx))/dx.dot(fp2.dot(dx))
@@ -283,8 +443,11 @@ def newton(fun,x0,args=(),tol=10**-4,callback=None,disp=False,eps=1.49e-06,fpmod
         x+=alpha*diff
         if callable(callback): callback(x)
         if err<=tol: break
+        if reuse:
+            basis=nl.qr(np.column_stack([diff,np.eye(len(x))]))[0]
+            basis[:,0]*=np.sign(basis[:,0].dot(diff))
         fp1,fp2=fpquadapprox(fx,x) if hesmode=='quadapprox' else fpbfgs(fx,x,alpha*diff,fp1,fp2)
-    result.x,result.fun,result.nfev,result.nit=x,fx(x),len(record),niter+1
+    result.x,result.fun,result.nfev,result.nit=x,fx(x),len(fx),niter+1
     if err>tol:
         message='newton warning: not converged after %s iterations with current err being %s.'%(niter,err)
         warnings.warn(message)
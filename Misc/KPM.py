@@ -0,0 +1,202 @@
+'''
+========================
+Kernel polynomial method
+========================
+
+Kernel polynomial method for the spectral densities of large Hermitian operators, including
+    * functions: chebmoments, kpmbounds, kpmmoments, kpmkernel, kpmdos
+'''
+
+__all__=['chebmoments','kpmbounds','kpmmoments','kpmkernel','kpmdos']
+
+import numpy as np
+import multiprocessing as mp
+from scipy.fftpack import dct
+from Linalg import eigsh
+
+def chebmoments(A,v,n,a=1.0,b=0.0):
+    '''
+    The Chebyshev moments of a rescaled Hermitian operator.
+
+    Parameters
+    ----------
+    A : csr_matrix, LinearOperator, etc
+        The Hermitian operator.
+    v : 1d/2d ndarray
+        The probe vector(s), one column for each vector.
+    n : int
+        The number of the moments.
+    a,b : float, optional
+        The rescaling of the operator, i.e. the moments are those of `(A-b)/a`, whose spectrum should lie in (-1,1).
+
+    Returns
+    -------
+    1d/2d ndarray
+        The moments `v^H T_m((A-b)/a) v` for m in range(n), one row for each probe vector when `v` is 2d.
+
+    Notes
+    -----
+    The relations `T_{2m}=2T_m^2-T_0` and `T_{2m+1}=2T_{m+1}T_m-T_1` are used so that only n/2 matvecs are needed.
+    '''
+    dot=lambda x,y: np.sum(x.conjugate()*y,axis=0).real
+    matvec=lambda x: (A.dot(x)-b*x)/a
+    result=np.zeros((n,)+v.shape[1:],dtype=np.float64)
+    v0,v1=v,matvec(v)
+    result[0]=dot(v0,v0)
+    if n>1: result[1]=dot(v0,v1)
+    v0,v1,m=v1,2*matvec(v1)-v0,1
+    while 2*m<n:
+        result[2*m]=2*dot(v0,v0)-result[0]
+        if 2*m+1<n: result[2*m+1]=2*dot(v1,v0)-result[1]
+        v0,v1,m=v1,2*matvec(v1)-v0,m+1
+    return result.T
+
+def kpmbounds(A,pad=0.01,tol=10**-6):
+    '''
+    The rescaling of a Hermitian operator so that its spectrum lies in (-1,1).
+
+    Parameters
+    ----------
+    A : csr_matrix, LinearOperator, etc
+        The Hermitian operator.
+    pad : float, optional
+        The relative padding of the spectral bounds.
+    tol : float, optional
+        The tolerance of the Lanczos estimations of the spectral bounds.
+
+    Returns
+    -------
+    a,b : float
+        The rescaling of the operator, i.e. `(A-b)/a`.
+    '''
+    emin=eigsh(A,k=1,which='SA',tol=tol,return_eigenvectors=False)[0]
+    emax=eigsh(A,k=1,which='LA',tol=tol,return_eigenvectors=False)[0]
+    return (emax-emin)/2*(1+pad)+tol,(emax+emin)/2
+
+_KPM_={}
+
+def _kpmmoments_(task):
+    '''
+    The Chebyshev moments of the operator in `_KPM_` with a block of random-phase vectors.
+    '''
+    seed,nvector=task
+    A,a,b,nmoment=_KPM_['A'],_KPM_['a'],_KPM_['b'],_KPM_['nmoment']
+    v=np.exp(2j*np.pi*np.random.RandomState(seed).random_sample((A.shape[0],nvector)))
+    return chebmoments(A,v,nmoment,a,b)
+
+def kpmmoments(A,nmoment,nvector=16,bounds=None,nblock=8,nprocess=None):
+    '''
+    The stochastic estimations of the traces of the Chebyshev polynomials of a rescaled Hermitian operator.
+
+    Parameters
+    ----------
+    A : csr_matrix, LinearOperator, etc
+        The Hermitian operator.
+    nmoment : int
+        The number of the moments.
+    nvector : int, optional
+        The number of the random-phase vectors.
+    bounds : 2-tuple, optional
+        The lower and upper bounds of the spectrum. When None, they will be estimated by Lanczos.
+    nblock : int, optional
+        The number of the random-phase vectors multiplied by the operator at once.
+    nprocess : int, optional
+        The number of the processes over which the blocks of the random-phase vectors are distributed.
+
+    Returns
+    -------
+    a,b : float
+        The rescaling of the operator, i.e. `(A-b)/a`.
+    moments : 2d ndarray
+        The moments, one row for each random-phase vector, whose mean is the estimation of the traces.
+
+    Notes
+    -----
+        * The seeds of the blocks are drawn from `numpy.random` in the calling process, so that the results do not depend on the number of the processes.
+        * The operator is shared with the forked processes rather than pickled.
+    '''
+    if bounds is None:
+        a,b=kpmbounds(A)
+    else:
+        a,b=(bounds[1]-bounds[0])/2.0,(bounds[1]+bounds[0])/2.0
+    tasks=[(seed,min(nblock,nvector-i)) for i,seed in zip(xrange(0,nvector,nblock),np.random.randint(2**31-1,size=(nvector-1)/nblock+1))]
+    _KPM_.update(A=A,a=a,b=b,nmoment=nmoment)
+    try:
+        if (nprocess or 1)>1 and len(tasks)>1 and not mp.current_process().daemon:
+            pool=mp.Pool(min(nprocess,len(tasks)))
+            try:
+                results=pool.map(_kpmmoments_,tasks)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            results=[_kpmmoments_(task) for task in tasks]
+    finally:
+        _KPM_.clear()
+    return a,b,np.concatenate(results)
+
+def kpmkernel(n,kernel='jackson',lamb=4.0):
+    '''
+    The damping factors of the Chebyshev moments.
+
+    Parameters
+    ----------
+    n : int
+        The number of the moments.
+    kernel : 'jackson', 'lorentz' or None, optional
+        The kernel.
+    lamb : float, optional
+        The parameter of the Lorentz kernel.
+
+    Returns
+    -------
+    1d ndarray
+        The damping factors.
+    '''
+    ns=np.arange(n)
+    if kernel=='jackson':
+        return ((n-ns+1)*np.cos(np.pi*ns/(n+1))+np.sin(np.pi*ns/(n+1))/np.tan(np.pi/(n+1)))/(n+1)
+    elif kernel=='lorentz':
+        return np.sinh(lamb*(1-ns*1.0/n))/np.sinh(lamb)
+    elif kernel is None:
+        return np.ones(n)
+    else:
+        raise ValueError('kpmkernel error: not supported kernel(%s).'%kernel)
+
+def kpmdos(moments,a,b,es,kernel='jackson',lamb=4.0,nnode=None):
+    '''
+    The spectral density reconstructed from the Chebyshev moments.
+
+    Parameters
+    ----------
+    moments : 1d/2d ndarray
+        The Chebyshev moments, one row for each set when 2d.
+    a,b : float
+        The rescaling of the operator, i.e. `(A-b)/a`.
+    es : 1d ndarray
+        The energies at which to reconstruct the spectral density.
+    kernel : 'jackson', 'lorentz' or None, optional
+        The kernel.
+    lamb : float, optional
+        The parameter of the Lorentz kernel.
+    nnode : int, optional
+        The number of the Chebyshev nodes, which is 4 times the number of the moments by default.
+
+    Returns
+    -------
+    1d/2d ndarray
+        The spectral density at the energies, one row for each set of moments when 2d.
+
+    Notes
+    -----
+    The density is obtained on the Chebyshev nodes by a type-III discrete cosine transform and then interpolated linearly to the energies.
+    The density has the normalization of the moments, i.e. when the moments are traces its integration over the energy is the dimension of the operator.
+    '''
+    moments=np.asarray(moments)
+    nmoment=moments.shape[-1]
+    nnode=4*nmoment if nnode is None else nnode
+    xs=np.cos(np.pi*(np.arange(nnode)[::-1]+0.5)/nnode)
+    ys=dct(moments*kpmkernel(nmoment,kernel,lamb),type=3,n=nnode,axis=-1)[...,::-1]/(np.pi*np.sqrt(1-xs**2))/a
+    xe=(np.asarray(es)-b)/a
+    if ys.ndim==1: return np.interp(xe,xs,ys,left=0.0,right=0.0)
+    return np.array([np.interp(xe,xs,y,left=0.0,right=0.0) for y in ys])
@@ -5,11 +5,11 @@ Linear algebras
 
 Linear algebras as a supplement to `numpy.linalg`, `scipy.linalg` and 'scipy.sparse.linalg', including
     * constants: TOL
-    * classes: Lanczos, LinearOperator
-    * functions: kron, overlap, reorder, dagger, truncated_svd, eigsh, block_diag, solve, deparallelization
+    * classes: Lanczos, LinearOperator, OOCCSR
+    * functions: kron, overlap, reorder, dagger, truncated_svd, eigsh, lobpcg, block_diag, solve, deparallelization
 '''
 
-__all__=['TOL','Lanczos','LinearOperator','kron','overlap','reorder','dagger','truncated_svd','eigsh','block_diag','solve','deparallelization']
+__all__=['TOL','Lanczos','LinearOperator','OOCCSR','kron','overlap','reorder','dagger','truncated_svd','eigsh','lobpcg','block_diag','solve','deparallelization']
 
 import numpy as np
 import numpy.linalg as nl
@@ -17,7 +17,10 @@ import scipy.sparse as sp
 import scipy.sparse.linalg as pl
 import scipy.linalg as sl
 import itertools as it
+import multiprocessing as mp
+import os,shutil,tempfile
 from copy import copy
+from multiprocessing.pool import ThreadPool
 from fkron import *
 
 TOL=5*10**-12
@@ -188,6 +191,171 @@ class LinearOperator(pl.LinearOperator):
         self.count+=1
         return self._matvec_(v)
 
+class OOCCSR(LinearOperator):
+    '''
+    Out-of-core csr matrix, whose rows are split into chunks stored as memory-mapped `.npy` files.
+
+    Attributes
+    ----------
+    dir : str
+        The directory where the chunks are stored.
+    bounds : list of int
+        The row bounds of the chunks.
+    nnz : int
+        The number of the stored values.
+    nthread : int
+        The number of threads used in the multiplications.
+    '''
+
+    def __init__(self,chunks,shape,dtype,dir=None,nthread=None):
+        '''
+        Constructor.
+
+        Parameters
+        ----------
+        chunks : iterable of csr_matrix
+            The successive row chunks of the matrix.
+        shape : 2-tuple
+            The shape of the matrix.
+        dtype : np.float64, np.complex128, etc
+            The data type of the matrix.
+        dir : str, optional
+            The scratch directory under which the chunks are stored.
+        nthread : int, optional
+            The number of threads used in the multiplications.
+        '''
+        super(OOCCSR,self).__init__(shape=shape,matvec=None,dtype=dtype)
+        self.dir=tempfile.mkdtemp(prefix='OOCCSR-',dir=dir)
+        self.bounds=[0]
+        self.nnz=0
+        self.nthread=mp.cpu_count() if nthread is None else nthread
+        self._owner_=os.getpid()
+        self._pool_=None
+        for i,chunk in enumerate(chunks):
+            chunk=sp.csr_matrix(chunk,dtype=dtype)
+            assert chunk.shape[1]==shape[1]
+            for name in ('data','indices','indptr'): np.save('%s/%s_%s.npy'%(self.dir,i,name),getattr(chunk,name))
+            self.bounds.append(self.bounds[-1]+chunk.shape[0])
+            self.nnz+=chunk.nnz
+        assert self.bounds[-1]==shape[0]
+
+    @staticmethod
+    def fromcsr(matrix,nrow,dir=None,nthread=None):
+        '''
+        Construct an out-of-core csr matrix from an in-core one.
+
+        Parameters
+        ----------
+        matrix : csr_matrix
+            The in-core csr matrix.
+        nrow : int
+            The number of rows of each chunk.
+        dir : str, optional
+            The scratch directory under which the chunks are stored.
+        nthread : int, optional
+            The number of threads used in the multiplications.
+
+        Returns
+        -------
+        OOCCSR
+            The out-of-core csr matrix.
+        '''
+        matrix=sp.csr_matrix(matrix)
+        chunks=(matrix[start:min(start+nrow,matrix.shape[0])] for start in xrange(0,matrix.shape[0],nrow))
+        return OOCCSR(chunks,shape=matrix.shape,dtype=matrix.dtype,dir=dir,nthread=nthread)
+
+    @property
+    def nchunk(self):
+        '''
+        The number of chunks.
+        '''
+        return len(self.bounds)-1
+
+    def chunk(self,i,mmap=True):
+        '''
+        The ith chunk.
+
+        Parameters
+        ----------
+        i : int
+            The index of the chunk.
+        mmap : logical, optional
+            True for memory-mapping the chunk and False for reading it into memory.
+
+        Returns
+        -------
+        csr_matrix
+            The chunk.
+        '''
+        data,indices,indptr=[np.load('%s/%s_%s.npy'%(self.dir,i,name),mmap_mode='r' if mmap else None) for name in ('data','indices','indptr')]
+        return sp.csr_matrix((data,indices,indptr),shape=(self.bounds[i+1]-self.bounds[i],self.shape[1]),copy=False)
+
+    def diagonal(self):
+        '''
+        The diagonal of the matrix.
+        '''
+        return np.concatenate([sp.csr_matrix(self.chunk(i)[:,self.bounds[i]:self.bounds[i+1]]).diagonal() for i in xrange(self.nchunk)])
+
+    def _multiply_(self,v):
+        '''
+        Stream the chunks and multiply them with a vector or a block of vectors.
+        '''
+        result=np.zeros((self.shape[0],)+v.shape[1:],dtype=np.find_common_type([self.dtype,v.dtype],[]))
+        def multiply(i):
+            result[self.bounds[i]:self.bounds[i+1]]=self.chunk(i,mmap=False).dot(v)
+        if self.nthread>1 and self.nchunk>1:
+            if self._pool_ is None: self._pool_=ThreadPool(self.nthread)
+            self._pool_.map(multiply,xrange(self.nchunk),chunksize=1)
+        else:
+            for i in xrange(self.nchunk): multiply(i)
+        return result
+
+    def _matvec(self,v):
+        '''
+        Matrix-vector multiplication.
+        '''
+        self.count+=1
+        return self._multiply_(v)
+
+    def _matmat(self,m):
+        '''
+        Matrix-matrix multiplication.
+        '''
+        self.count+=m.shape[1]
+        return self._multiply_(m)
+
+    def close(self):
+        '''
+        Close the thread pool and remove the chunks if they are owned by this instance.
+        '''
+        if getattr(self,'_pool_',None) is not None:
+            self._pool_.terminate()
+            self._pool_=None
+        if getattr(self,'_owner_',None)==os.getpid():
+            shutil.rmtree(self.dir,ignore_errors=True)
+            self._owner_=None
+
+    def __del__(self):
+        '''
+        Destructor.
+        '''
+        self.close()
+
+    def __getstate__(self):
+        '''
+        The state for copy and pickle, in which the thread pool is excluded.
+        '''
+        result=self.__dict__.copy()
+        result['_pool_']=None
+        return result
+
+    def __setstate__(self,state):
+        '''
+        Set the state for copy and pickle. The copies do not own the chunks.
+        '''
+        self.__dict__.update(state)
+        self._owner_=None
+
 def kron(m1,m2,rcs=None,timers=None):
     '''
     Kronecker product of two matrices.
@@ -341,7 +509,7 @@ def truncated_svd(m,nmax=None,tol=None,return_truncation_err=False,**karg):
         u,s,v=u[:,indices],s[indices],v[indices,:]
         return u,s,v
 
-def eigsh(A,max_try=6,return_eigenvectors=True,**karg):
+def eigsh(A,max_try=6,return_eigenvectors=True,method='arpack',**karg):
     '''
     Find the eigenvalues and eigenvectors of the real symmetric square matrix or complex hermitian matrix A.
     This is a wrapper for scipy.sparse.linalg.eigsh to handle the exceptions it raises.
@@ -354,6 +522,8 @@ def eigsh(A,max_try=6,return_eigenvectors=True,**karg):
         The maximum number of tries to do the computation when the computed eigenvalues/eigenvectors do not converge.
     return_eigenvectors : logical, optional
         True for returning the eigenvectors and False for not.
+    method : 'arpack' or 'lobpcg', optional
+        'arpack' for the ARPACK Lanczos solver and 'lobpcg' for the block solver `lobpcg`, which only supports the lowest eigenvalues.
     karg : dict
         Please refer to https://docs.scipy.org/doc/scipy-0.14.0/reference/generated/scipy.sparse.linalg.eigsh.html for details.
     '''
@@ -363,7 +533,11 @@ def eigsh(A,max_try=6,return_eigenvectors=True,**karg):
             return A.dot(np.ones(1)).reshape(-1).real,np.ones((1,1),dtype=A.dtype)
         else:
             return A.dot(np.ones(1)).reshape(-1).real
+    elif method=='lobpcg':
+        assert karg.pop('which','SA')=='SA' and 'M' not in karg and 'sigma' not in karg
+        return lobpcg(A,return_eigenvectors=return_eigenvectors,**karg)
     else:
+        assert method=='arpack'
         ntry=1
         while True:
             try:
@@ -376,6 +550,81 @@ def eigsh(A,max_try=6,return_eigenvectors=True,**karg):
                     raise err
         return result
 
+def lobpcg(A,k=1,v0=None,diagonal=None,nbuffer=None,tol=10**-9,maxiter=None,return_eigenvectors=True):
+    '''
+    Find the lowest k eigenvalues and eigenvectors of the real symmetric square matrix or complex hermitian matrix A by the locally optimal block preconditioned conjugate gradient method.
+
+    Parameters
+    ----------
+    A : An NxN matrix, array, sparse matrix, or LinearOperator
+        The matrix whose eigenvalues and eigenvectors is to be computed.
+    k : integer, optional
+        The number of eigenvalues to be computed.
+    v0 : 1d ndarray, optional
+        The starting vector.
+    diagonal : 1d ndarray, optional
+        The diagonal of A used by the preconditioner. When not assigned, it will be taken from A if A supports it, otherwise no preconditioner will be used.
+    nbuffer : integer, optional
+        The number of buffer vectors in the block, which speed up the convergence of the highest wanted eigenvalues.
+    tol : float, optional
+        The relative tolerance of the residuals.
+    maxiter : integer, optional
+        The maximum number of iterations.
+    return_eigenvectors : logical, optional
+        True for returning the eigenvectors and False for not.
+
+    Returns
+    -------
+    es : 1d ndarray
+        The lowest k eigenvalues in ascending order.
+    vs : 2d ndarray, optional
+        The corresponding eigenvectors as the columns.
+
+    Notes
+    -----
+        * The whole block is multiplied by A at once, and the Rayleigh-Ritz procedure is performed on the subspace spanned by the block, the preconditioned residuals and the previous search directions.
+        * The preconditioner is the diagonal one, i.e. the residual of the ith Ritz pair is divided by abs(diag(A)-e_i).
+        * Converged eigenpairs are soft locked, i.e. they stay in the Rayleigh-Ritz procedure but are no longer searched along.
+        * Preconditioned residuals that vanish after the projection against the block are dropped from the search subspace.
+        * A ValueError is raised when the wanted eigenpairs are not converged within `maxiter` iterations.
+    '''
+    n,dtype=A.shape[0],np.find_common_type([A.dtype],[np.float64])
+    nb=min(k+(max(k/2,2) if nbuffer is None else nbuffer),n)
+    if diagonal is None and hasattr(A,'diagonal'): diagonal=np.asarray(A.diagonal()).real
+    if n<=5*nb:
+        es,vs=sl.eigh(A.toarray() if sp.issparse(A) else A.dot(np.identity(n,dtype=dtype)))
+        return (es[:k],vs[:,:k]) if return_eigenvectors else es[:k]
+    X=np.random.random((n,nb))-0.5
+    if issubclass(dtype.type,np.complexfloating): X=X+1j*(np.random.random((n,nb))-0.5)
+    if v0 is not None: X[:,0]=v0
+    X=sl.qr(X.astype(dtype),mode='economic')[0]
+    AX=A.dot(X)
+    es,C=sl.eigh(dagger(X).dot(AX))
+    X,AX,P,AP=X.dot(C),AX.dot(C),None,None
+    for niter in xrange(maxiter or max(n,1000)):
+        R=AX-X*es
+        active=np.sqrt(np.sum(np.abs(R)**2,axis=0))>tol*np.maximum(np.abs(es),1.0)
+        if not np.any(active[:k]): break
+        active[k:]=True
+        W=R[:,active] if diagonal is None else R[:,active]/np.maximum(np.abs(diagonal[:,np.newaxis]-es[active]),tol)
+        norms=np.sqrt(np.sum(np.abs(W)**2,axis=0))
+        W-=X.dot(dagger(X).dot(W))
+        W=W[:,np.sqrt(np.sum(np.abs(W)**2,axis=0))>norms*TOL]
+        W/=np.sqrt(np.sum(np.abs(W)**2,axis=0))
+        AW=A.dot(W)
+        S,AS=(np.hstack([X,W]),np.hstack([AX,AW])) if P is None else (np.hstack([X,W,P[:,active]]),np.hstack([AX,AW,AP[:,active]]))
+        gs,T=sl.eigh(dagger(S).dot(S))
+        T=T[:,gs>gs.max()*TOL]/np.sqrt(gs[gs>gs.max()*TOL])
+        H=dagger(T).dot(dagger(S).dot(AS)).dot(T)
+        es,C=sl.eigh((H+dagger(H))/2)
+        es,C=es[:nb],T.dot(C[:,:nb])
+        X,AX=S.dot(C),AS.dot(C)
+        P,AP=S[:,nb:].dot(C[nb:]),AS[:,nb:].dot(C[nb:])
+    else:
+        if np.any(np.sqrt(np.sum(np.abs(AX[:,:k]-X[:,:k]*es[:k])**2,axis=0))>tol*np.maximum(np.abs(es[:k]),1.0)):
+            raise ValueError('lobpcg error: not converged after %s iterations.'%(niter+1))
+    return (es[:k],X[:,:k]) if return_eigenvectors else es[:k]
+
 def block_diag(*ms):
     '''
     Create a block diagonal matrix from provided ones.
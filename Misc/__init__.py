@@ -5,15 +5,17 @@ Introduction
 
 This subpackage contains miscellaneous classes and functions as aids to the algorithms.
 
-==========    ===================
+==========    ========================
 MODULES       DESCRIPTION
-==========    ===================
+==========    ========================
 `Tree`        Tree data structure
 `Linalg`      Linear algebras
 `Calculus`    Calculus related
-==========    ===================
+`KPM`         Kernel polynomial method
+==========    ========================
 '''
 
 from Tree import *
 from Linalg import *
 from Calculus import *
+from KPM import *
@@ -1,2 +1,4 @@
 from test_Tree import *
 from test_Linalg import *
+from test_Calculus import *
+from test_KPM import *
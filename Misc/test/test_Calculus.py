@@ -0,0 +1,71 @@
+'''
+Calculus test (4 tests in total).
+'''
+
+__all__=['calculus']
+
+import numpy as np
+import multiprocessing as mp
+from HamiltonianPy.Misc import fpapprox,quadapprox,newton,quadvec
+from scipy.integrate import quad
+from unittest import TestCase,TestLoader,TestSuite
+
+def saddle(x,c):
+    d=np.asarray(x)-c
+    return d[0]**2-d[1]**2+0.5*d[2]**2+0.2*d[0]*d[2]+0.1*d[0]**4+0.05*d[1]**4-0.1*d[1]*d[2]**2
+
+class TestCalculus(TestCase):
+    def setUp(self):
+        self.c=np.array([0.3,-0.2,0.1])
+        self.pool=mp.Pool(3)
+
+    def tearDown(self):
+        self.pool.terminate()
+
+    def test_stencil(self):
+        x0,basis=np.array([0.5,0.1,-0.2]),np.linalg.qr(np.random.random((3,3)))[0]
+        for fpmode in (0,1):
+            for b in (None,basis):
+                serial=fpapprox(saddle,x0,args=(self.c,),fpmode=fpmode,basis=b)
+                parallel=fpapprox(saddle,x0,args=(self.c,),fpmode=fpmode,basis=b,executor=self.pool)
+                self.assertTrue(np.array_equal(serial,parallel))
+        for b in (None,basis):
+            serial=quadapprox(saddle,x0,args=(self.c,),basis=b)
+            parallel=quadapprox(saddle,x0,args=(self.c,),basis=b,executor=self.pool)
+            for s,p in zip(serial,parallel): self.assertTrue(np.array_equal(s,p))
+        d=x0-self.c
+        fp1=np.array([2*d[0]+0.2*d[2]+0.4*d[0]**3,-2*d[1]+0.2*d[1]**3-0.1*d[2]**2,d[2]+0.2*d[0]-0.2*d[1]*d[2]])
+        self.assertTrue(np.allclose(quadapprox(saddle,x0,args=(self.c,),basis=basis)[1],fp1,atol=10**-4))
+
+    def test_newton(self):
+        print
+        x0=[0.5,0.1,-0.2]
+        serial=newton(saddle,np.array(x0),args=(self.c,),tol=10**-8)
+        parallel=newton(saddle,np.array(x0),args=(self.c,),tol=10**-8,executor=self.pool)
+        self.assertTrue(np.array_equal(serial.x,parallel.x))
+        self.assertEqual(serial.nfev,parallel.nfev)
+        self.assertTrue(np.allclose(serial.x,self.c,atol=10**-6))
+
+    def test_reuse(self):
+        print
+        x0=[0.5,0.1,-0.2]
+        for fpmode in (0,1):
+            plain=newton(saddle,np.array(x0),args=(self.c,),tol=10**-8,fpmode=fpmode)
+            reuse=newton(saddle,np.array(x0),args=(self.c,),tol=10**-8,fpmode=fpmode,reuse=True)
+            print 'fpmode=%s: nfev %s(plain), %s(reuse)'%(fpmode,plain.nfev,reuse.nfev)
+            self.assertTrue(np.allclose(reuse.x,self.c,atol=10**-6))
+            self.assertLess(reuse.nfev,plain.nfev)
+
+    def test_quadvec(self):
+        ps=np.array([0.5,1.0,2.0,8.0])
+        fun=lambda xs: np.array([np.exp(-ps*x)+1j/(x**2+ps**2) for x in xs])
+        result,err,neval=quadvec(fun,0.0,np.inf,epsabs=10**-12,epsrel=10**-12)
+        self.assertTrue(np.allclose(result,1/ps+0.5j*np.pi/ps,rtol=0,atol=10**-11))
+        self.assertLess(err,10**-11)
+        self.assertEqual(neval%15,0)
+        result,err,neval=quadvec(lambda xs: np.sin(np.outer(xs,ps)),0.0,np.pi)
+        self.assertTrue(np.allclose(result,[quad(lambda x: np.sin(p*x),0.0,np.pi)[0] for p in ps],rtol=0,atol=10**-8))
+
+calculus=TestSuite([
+                TestLoader().loadTestsFromTestCase(TestCalculus),
+                ])
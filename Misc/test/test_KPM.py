@@ -0,0 +1,54 @@
+'''
+KPM test (2 tests in total).
+'''
+
+__all__=['kpm']
+
+import numpy as np
+import scipy.sparse as sp
+from HamiltonianPy.Misc import LinearOperator,chebmoments,kpmmoments,kpmdos
+from unittest import TestCase,TestLoader,TestSuite
+
+class TestKPM(TestCase):
+    def setUp(self):
+        np.random.seed(1)
+        N=200
+        m=sp.random(N,N,density=0.05,random_state=1)+1j*sp.random(N,N,density=0.05,random_state=2)
+        self.matrix=(m+m.T.conjugate()).tocsr()
+        self.eigvals=np.linalg.eigvalsh(self.matrix.toarray())
+        self.a,self.b=(self.eigvals[-1]-self.eigvals[0])/2*1.01,(self.eigvals[-1]+self.eigvals[0])/2
+
+    def test_moments(self):
+        v,n=np.exp(2j*np.pi*np.random.random((self.matrix.shape[0],3))),31
+        h=(self.matrix.toarray()-self.b*np.eye(self.matrix.shape[0]))/self.a
+        t0,t1,moments=v,h.dot(v),[np.sum(v.conjugate()*v,axis=0).real,np.sum(v.conjugate()*h.dot(v),axis=0).real]
+        for _ in xrange(n-2):
+            t0,t1=t1,2*h.dot(t1)-t0
+            moments.append(np.sum(v.conjugate()*t1,axis=0).real)
+        self.assertTrue(np.allclose(chebmoments(self.matrix,v,n,self.a,self.b),np.array(moments).T))
+        self.assertTrue(np.allclose(chebmoments(self.matrix,v[:,0],n,self.a,self.b),np.array(moments)[:,0]))
+        operator=LinearOperator(self.matrix.shape,matvec=self.matrix.dot,dtype=self.matrix.dtype)
+        self.assertTrue(np.allclose(chebmoments(operator,v,n,self.a,self.b),np.array(moments).T))
+        bounds=(self.b-self.a,self.b+self.a)
+        np.random.seed(2)
+        serial=kpmmoments(self.matrix,64,nvector=20,bounds=bounds,nblock=4)
+        np.random.seed(2)
+        parallel=kpmmoments(self.matrix,64,nvector=20,bounds=bounds,nblock=4,nprocess=3)
+        self.assertTrue(np.array_equal(serial[2],parallel[2]))
+        self.assertEqual(serial[2].shape,(20,64))
+
+    def test_dos(self):
+        n,es=256,np.linspace(self.b-self.a,self.b+self.a,2001)
+        moments=np.cos(np.arange(n)[:,np.newaxis]*np.arccos((self.eigvals-self.b)/self.a)[np.newaxis,:]).sum(axis=1)
+        for kernel in ('jackson','lorentz'):
+            dos=kpmdos(moments,self.a,self.b,es,kernel=kernel)
+            self.assertAlmostEqual(dos.sum()*(es[1]-es[0]),len(self.eigvals),delta=10**-2*len(self.eigvals))
+            self.assertTrue(np.allclose(kpmdos(np.array([moments,2*moments]),self.a,self.b,es,kernel=kernel),[dos,2*dos]))
+        dos=kpmdos(moments,self.a,self.b,es)
+        for e in (-5.0,0.0,5.0):
+            i=np.searchsorted(es,e)
+            self.assertAlmostEqual(dos[:i].sum()*(es[1]-es[0]),np.searchsorted(self.eigvals,es[i]),delta=3.0)
+
+kpm=TestSuite([
+            TestLoader().loadTestsFromTestCase(TestKPM),
+            ])
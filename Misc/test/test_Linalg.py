@@ -1,14 +1,17 @@
 '''
-Linalg test (5 tests in total).
+Linalg test (11 tests in total).
 '''
 
 __all__=['linalg']
 
+import os,time
+import pickle as pk
 import numpy as np
 import scipy.linalg as sl
+import scipy.sparse as sp
 from copy import deepcopy
 from scipy.sparse.linalg import eigsh
-from HamiltonianPy.Misc import Lanczos
+from HamiltonianPy.Misc import Lanczos,lobpcg,OOCCSR
 from unittest import TestCase,TestLoader,TestSuite
 
 class TestLanczos(TestCase):
@@ -47,6 +50,68 @@ class TestLanczos(TestCase):
         Leigs=self.lanczos.eigs()[:Ne]
         self.assertAlmostEqual(sl.norm(exacteigs-Leigs),0.0)
 
+class TestLobpcg(TestCase):
+    def setUp(self):
+        np.random.seed(1)
+        N,k=2000,8
+        m=sp.random(N,N,density=0.005,format='csr')+1j*sp.random(N,N,density=0.005,format='csr')
+        self.matrix=m+m.T.conjugate()+sp.diags(np.arange(N)*0.01)
+        self.k=k
+
+    def test_eigs(self):
+        exacteigs=sl.eigh(self.matrix.toarray(),eigvals_only=True)[:self.k]
+        es,vs=lobpcg(self.matrix,k=self.k)
+        self.assertAlmostEqual(sl.norm(exacteigs-es),0.0)
+        self.assertAlmostEqual(sl.norm(np.identity(self.k)-vs.T.conjugate().dot(vs)),0.0)
+        self.assertAlmostEqual(sl.norm(self.matrix.dot(vs)-vs*es)/self.k,0.0,delta=10**-6)
+
+    def test_degeneracy(self):
+        matrix=sp.block_diag([self.matrix,self.matrix],format='csr')
+        exacteigs=np.sort(np.concatenate([sl.eigh(self.matrix.toarray(),eigvals_only=True)[:self.k]]*2))[:self.k]
+        es=lobpcg(matrix,k=self.k,return_eigenvectors=False)
+        self.assertAlmostEqual(sl.norm(exacteigs-es),0.0)
+
+    def test_maxiter(self):
+        self.assertRaises(ValueError,lobpcg,self.matrix,k=self.k,maxiter=2)
+
+class TestOOCCSR(TestCase):
+    def setUp(self):
+        np.random.seed(1)
+        N=3000
+        m=sp.random(N,N,density=0.002,format='csr')+1j*sp.random(N,N,density=0.002,format='csr')
+        self.matrix=sp.csr_matrix(m+m.T.conjugate())
+        self.ooc=OOCCSR.fromcsr(self.matrix,nrow=257,nthread=4)
+
+    def tearDown(self):
+        self.ooc.close()
+
+    def test_exactness(self):
+        v,m=np.random.random(self.matrix.shape[0]),np.random.random((self.matrix.shape[0],5))
+        self.assertEqual(self.ooc.nchunk,12)
+        self.assertEqual(self.ooc.nnz,self.matrix.nnz)
+        self.assertTrue(np.array_equal(self.ooc.dot(v),self.matrix.dot(v)))
+        self.assertTrue(np.array_equal(self.ooc.dot(m),self.matrix.dot(m)))
+        self.assertTrue(np.array_equal(self.ooc.diagonal(),self.matrix.diagonal()))
+        l1,l2=Lanczos(self.matrix,[v],maxiter=50),Lanczos(self.ooc,[v],maxiter=50)
+        for _ in xrange(50):
+            l1.iter()
+            l2.iter()
+        self.assertTrue(np.array_equal(l1.T,l2.T))
+        copy=pk.loads(pk.dumps(self.ooc,2))
+        self.assertTrue(np.array_equal(copy.dot(v),self.matrix.dot(v)))
+        del copy
+        self.assertTrue(os.path.isdir(self.ooc.dir))
+
+    def test_throughput(self):
+        print
+        v,nmv=np.random.random(self.matrix.shape[0]),200
+        for name,matrix in [('in-core',self.matrix),('out-of-core',self.ooc)]:
+            t0=time.time()
+            for _ in xrange(nmv): matrix.dot(v)
+            print '%s: %.3es per matvec'%(name,(time.time()-t0)/nmv)
+
 linalg=TestSuite([
                 TestLoader().loadTestsFromTestCase(TestLanczos),
+                TestLoader().loadTestsFromTestCase(TestLobpcg),
+                TestLoader().loadTestsFromTestCase(TestOOCCSR),
                 ])
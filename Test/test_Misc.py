@@ -8,3 +8,5 @@ from unittest import TestSuite
 misc=TestSuite()
 misc.addTest(tree)
 misc.addTest(linalg)
+misc.addTest(calculus)
+misc.addTest(kpm)
@@ -4,17 +4,18 @@ Cluster perturbation theory and variational cluster approach
 ============================================================
 
 CPT and VCA, including:
-    * classes: VG, FVCA, EB, GPM, CPFF, OP, DTBT
+    * classes: VGF, VCA, EB, GP, GPM, CPFF, OP, DTBT
     * functions: VCAEB, VCADOS, VCAFS, VCABC, VCATEB, VCAGP, VCAGPM, VCACPFF, VCAOP, VCADTBT
 '''
 
-__all__=['VGF','VCA','EB','VCAEB','VCADOS','VCAFS','VCABC','VCATEB','VCAGP','GPM','VCAGPM','CPFF','VCACPFF','OP','VCAOP','DTBT','VCADTBT']
+__all__=['VGF','VCA','EB','VCAEB','VCADOS','VCAFS','VCABC','VCATEB','GP','VCAGP','GPM','VCAGPM','CPFF','VCACPFF','OP','VCAOP','DTBT','VCADTBT']
 
 from gf_contract import *
-from numpy.linalg import det,inv
+from numpy.linalg import det,inv,solve
 from scipy.linalg import eigh
 from scipy.integrate import quad
 from scipy.optimize import broyden2
+from scipy.sparse.csgraph import connected_components
 from collections import OrderedDict
 from copy import deepcopy
 import numpy as np
@@ -23,6 +24,8 @@ import HamiltonianPy.FreeSystem as TBA
 import HamiltonianPy.Misc as HM
 import HamiltonianPy.ED as ED
 import itertools as it
+import multiprocessing as mp
+import hashlib
 import matplotlib.pyplot as plt
 import time
 import os
@@ -52,6 +55,32 @@ def _gf_contract_(k,mgf,seqs,coords):
     else:
         raise ValueError("_gf_contract_ error: mgf must be of type np.complex64 or np.complex128.")
 
+def _glquad_(fx,n,nbatch,scale=1.0):
+    '''
+    Integrate a batched function over the semi-infinite interval [0,inf) with the Gauss-Legendre rule.
+
+    Parameters
+    ----------
+    fx : callable
+        The batched integrand, which maps a 1d ndarray of nodes to an ndarray whose first axis is for the nodes.
+    n : int
+        The order of the Gauss-Legendre rule.
+    nbatch : int
+        The number of nodes evaluated at once.
+    scale : float, optional
+        The scale of the map from [0,1) to [0,inf).
+
+    Returns
+    -------
+    result : np.float64 or ndarray
+        The integral.
+    err : np.float64
+        The estimated error of the integral.
+    '''
+    xs,ws,ews=HM.glquad(n,scale=scale)
+    values=np.concatenate([fx(xs[start:start+nbatch]) for start in xrange(0,n,nbatch)])
+    return np.tensordot(ws,values,axes=(0,0)),np.abs(np.tensordot(ws-ews,values,axes=(0,0))).max()
+
 class VGF(ED.GF):
     '''
     VCA single-particle Green's function with baths degrees of freedom.
@@ -159,6 +188,14 @@ class VCA(ED.FED):
         2) 'coords': 3d ndarray of floats
     cache : dict
         The cache during the process of calculation, usually to store some meshes.
+    cgftimers : Timers
+        The timers of the hits and misses of the cache of the cluster Green's function, with one record for each frequency.
+    NPTMESH : int
+        The maximum number of the cached pt meshes.
+    NPROJECTOR : int
+        The maximum number of the cached periodization projectors.
+    CGFMEMORY : int
+        The maximum number of bytes of the cached cluster Green's functions.
 
     Supported methods:
         =========   ======================================================================================================================
@@ -176,6 +213,17 @@ class VCA(ED.FED):
         `VCADTBT`   calculates the distribution of fermions along a path in the Brillouin zone
         =========   ======================================================================================================================
     '''
+    NPTMESH=4
+    NPROJECTOR=4
+    CGFMEMORY=2**27
+
+    def __new__(cls,*arg,**karg):
+        '''
+        Constructor.
+        '''
+        result=ED.FED.__new__(cls,*arg,**karg)
+        result.cgftimers=HP.Timers('Hit','Miss',root='CGF')
+        return result
 
     def __init__(self,cgf,sectors,cell,lattice,config,terms=(),weiss=(),baths=(),mask=('nambu',),dtype=np.complex128,**karg):
         '''
@@ -308,9 +356,10 @@ class VCA(ED.FED):
 
         Returns
         -------
-        csr_matrix
+        csr_matrix or OOCCSR
             The matrix representation of the Hamiltonian.
         '''
+        if self.ooc is not None: return self.oocmatrix(sector)
         if reset:
             self.hgenerator.set_matrix(sector,HP.foptrep,self.sectors[sector],transpose=False,dtype=self.dtype)
             self.wgenerator.set_matrix(sector,HP.foptrep,self.sectors[sector],transpose=False,dtype=self.dtype)
@@ -325,6 +374,9 @@ class VCA(ED.FED):
         '''
         if len(karg)>0:
             self.CGF.virgin=True
+            self.cache.pop('cgf',None)
+            nhit,nmiss,ctime=self.cgfstat(reset=True)
+            if nhit+nmiss>0: self.log<<'::<CGF>:: hits=%s, misses=%s, hit rate=%.1f%%, time=%.4es\n'%(nhit,nmiss,100.0*nhit/(nhit+nmiss),ctime)
             super(ED.ED,self).update(**karg)
             data=self.data
             self.hgenerator.update(**data)
@@ -337,6 +389,7 @@ class VCA(ED.FED):
             self.pthoperators=self.pthgenerator.operators
             self.ptwoperators=self.ptwgenerator.operators
             self.ptboperators=self.ptbgenerator.operators
+            self.cache.pop('pt_coeffs',None)
 
     @property
     def CGF(self):
@@ -386,23 +439,114 @@ class VCA(ED.FED):
 
         Parameters
         ----------
-        omega : np.complex128/np.complex64, optional
-            The frequency of the cluster Green's function.
+        omega : np.complex128/np.complex64 or 1d ndarray, optional
+            The frequency/frequencies of the cluster Green's function.
 
         Returns
         -------
-        2d ndarray
+        2d ndarray or 3d ndarray
             The cluster Green's function.
+
+        Notes
+        -----
+            * The calculated cluster Green's functions are read-only and kept in a LRU cache keyed by the single frequency and the parameters of the engine, so that the frequencies shared by different batches are calculated only once.
+            * The cache holds at most `VCA.CGFMEMORY` bytes, except that the entries of the latest call are always kept.
         '''
         app=self.CGF
         if omega is not None:
-            app.omega=omega
             if app.virgin:
+                app.omega=omega
                 app.virgin=False
                 if app.prepare is not None: app.prepare(self,app)
-            self.records[app.name]=app.run(self,app)
+            omegas,parameters=np.asarray(omega,dtype=np.complex128).reshape(-1),tuple(self.parameters.iteritems())
+            keys=[(omegas[i:i+1].tobytes(),parameters) for i in xrange(len(omegas))]
+            cgfs=self.cache.setdefault('cgf',OrderedDict())
+            misses=[i for i,key in enumerate(keys) if key not in cgfs]
+            if len(misses)>0:
+                with self.cgftimers.get('Miss'):
+                    app.omega=omega if np.ndim(omega)==0 else omegas[misses]
+                    result=app.run(self,app)
+                    for i,cgf in zip(misses,result.reshape((len(misses),)+result.shape[-2:])):
+                        cgfs[keys[i]]=np.array(cgf)
+                        cgfs[keys[i]].flags.writeable=False
+                for i in misses: self.cgftimers.get('Miss').record()
+            with self.cgftimers.get('Hit'):
+                for key in keys: cgfs[key]=cgfs.pop(key)
+            for i in xrange(len(keys)-len(misses)): self.cgftimers.get('Hit').record()
+            if np.ndim(omega)==0:
+                self.records[app.name]=cgfs[keys[0]]
+            else:
+                self.records[app.name]=np.array([cgfs[key] for key in keys]).reshape(np.shape(omega)+cgfs[keys[0]].shape)
+                self.records[app.name].flags.writeable=False
+            nbytes,nkeep=sum(cgf.nbytes for cgf in cgfs.itervalues()),len(set(keys))
+            while nbytes>self.CGFMEMORY and len(cgfs)>nkeep: nbytes-=cgfs.popitem(last=False)[1].nbytes
         return self.records[app.name]
 
+    def cgfstat(self,reset=False):
+        '''
+        Return the statistics of the cache of the cluster Green's function.
+
+        Parameters
+        ----------
+        reset : logical, optional
+            True for resetting the statistics and False for not.
+
+        Returns
+        -------
+        nhit,nmiss : int
+            The number of the frequencies hit and missed in the cache.
+        time : float
+            The time spent on the calculation of the missed cluster Green's functions.
+        '''
+        hit,miss=self.cgftimers.get('Hit'),self.cgftimers.get('Miss')
+        result=len(hit.records),len(miss.records),sum(miss.records)
+        if reset:
+            hit.reset()
+            miss.reset()
+        return result
+
+    def cpoles(self):
+        '''
+        Return the pole representation of the cluster Green's function.
+
+        Returns
+        -------
+        tuple of 1d ndarray and 2d ndarray, or None
+            The poles and the factor of the residues of the cluster Green's function (see ED.fedsppoles for details),
+            or None if the cluster Green's function is not composed by ED.fedspcom.
+        '''
+        app=self.CGF
+        if app.virgin:
+            app.virgin=False
+            if app.prepare is not None: app.prepare(self,app)
+        return ED.fedsppoles(app.blocks) if app.compose is ED.fedspcom else None
+
+    def ptcoeffs(self):
+        '''
+        Returns the coefficients of the perturbations.
+
+        Returns
+        -------
+        icoords : 2d ndarray
+            The icoords of the inter-cluster perturbations.
+        hcoeffs : 2d ndarray
+            The flattened matrix elements of the inter-cluster perturbations, one row for each icoord.
+        ccoeffs : 1d ndarray
+            The flattened matrix elements of the momentum independent perturbations, i.e. the negative Weiss and bath terms.
+        '''
+        if 'pt_coeffs' not in self.cache:
+            ncopt,ndim=self.ncopt,self.lattice.rcoords.shape[1]
+            icoords=np.zeros((len(self.pthoperators),ndim),dtype=np.float64)
+            hcoeffs=np.zeros((len(self.pthoperators),ncopt**2),dtype=np.complex128)
+            ccoeffs=np.zeros(ncopt**2,dtype=np.complex128)
+            for n,opt in enumerate(self.pthoperators.itervalues()):
+                icoords[n]=opt.icoord
+                hcoeffs[n,opt.seqs[0]*ncopt+opt.seqs[1]]+=opt.value
+            for opt in it.chain(self.ptwoperators.itervalues(),self.ptboperators.itervalues()):
+                ccoeffs[opt.seqs[0]*ncopt+opt.seqs[1]]-=opt.value
+            self.cache['pt_coeffs']=(icoords,hcoeffs,ccoeffs)
+        return self.cache['pt_coeffs']
+
     def pt(self,k=()):
         '''
         Returns the matrix form of the perturbations.
@@ -417,13 +561,9 @@ class VCA(ED.FED):
         2d ndarray
             The matrix form of the perturbations.
         '''
-        result=np.zeros((self.ncopt,self.ncopt),dtype=np.complex128)
-        for opt in self.pthoperators.itervalues():
-            result[opt.seqs]+=opt.value*(1 if len(k)==0 else np.exp(-1j*np.inner(k,opt.icoord)))
-        for opt in self.ptwoperators.itervalues():
-            result[opt.seqs]-=opt.value
-        for opt in self.ptboperators.itervalues():
-            result[opt.seqs]-=opt.value
+        icoords,hcoeffs,ccoeffs=self.ptcoeffs()
+        result=(hcoeffs.sum(axis=0) if len(k)==0 else np.exp(-1j*icoords.dot(k)).dot(hcoeffs))+ccoeffs
+        result=result.reshape((self.ncopt,self.ncopt))
         return result+result.T.conjugate()
 
     def pt_kmesh(self,kmesh):
@@ -440,15 +580,51 @@ class VCA(ED.FED):
         -------
         3d ndarray
             The pt mesh.
+
+        Notes
+        -----
+        The pt meshes are cached with the keys determined by the kmesh and the parameters of the engine, and at most `VCA.NPTMESH` of them are kept.
         '''
-        if 'pt_kmesh' in self.cache:
-            return self.cache['pt_kmesh']
-        else:
-            result=np.zeros((kmesh.shape[0],self.ncopt,self.ncopt),dtype=np.complex128)
-            for i,k in enumerate(kmesh):
-                result[i,:,:]=self.pt(k)
-            self.cache['pt_kmesh']=result
-            return result
+        kmesh=np.ascontiguousarray(kmesh,dtype=np.float64)
+        key=(kmesh.shape,hashlib.sha1(kmesh.tobytes()).hexdigest(),tuple(self.parameters.iteritems()))
+        meshes=self.cache.setdefault('pt_kmesh',OrderedDict())
+        if key not in meshes:
+            icoords,hcoeffs,ccoeffs=self.ptcoeffs()
+            result=(np.exp(-1j*kmesh.dot(icoords.T)).dot(hcoeffs)+ccoeffs).reshape((kmesh.shape[0],self.ncopt,self.ncopt))
+            meshes[key]=result+np.swapaxes(result,1,2).conjugate()
+            while len(meshes)>self.NPTMESH: meshes.popitem(last=False)
+        return meshes[key]
+
+    def projector(self,kmesh):
+        '''
+        Returns the periodization projectors of a kmesh.
+
+        Parameters
+        ----------
+        kmesh : (n+1)d ndarray like
+            The kmesh of the projectors.
+            And n is the spatial dimension of the system.
+
+        Returns
+        -------
+        3d ndarray
+            The projectors `U` with the shape (nk,nopt,nclopt), so that the VCA Green's function at the ith k reads `U[i].dot(mgf).dot(U[i].T.conjugate())/(nclopt/nopt)`.
+
+        Notes
+        -----
+        The projectors depend only on the geometry of the system, and are cached with the keys determined by the kmesh. At most `VCA.NPROJECTOR` of them are kept.
+        '''
+        kmesh=np.ascontiguousarray(kmesh,dtype=np.float64)
+        key=(kmesh.shape,hashlib.sha1(kmesh.tobytes()).hexdigest())
+        projectors=self.cache.setdefault('projector',OrderedDict())
+        if key not in projectors:
+            seqs=self.periodization['seqs']-1
+            result=np.zeros((kmesh.shape[0],self.nopt,self.nclopt),dtype=np.complex128)
+            result[:,np.arange(self.nopt)[:,np.newaxis],seqs]=np.exp(-1j*np.einsum('kd,imd->kim',kmesh,self.periodization['coords']))
+            result.flags.writeable=False
+            projectors[key]=result
+            while len(projectors)>self.NPROJECTOR: projectors.popitem(last=False)
+        return projectors[key]
 
     def mgf(self,omega=None,k=()):
         '''
@@ -472,7 +648,23 @@ class VCA(ED.FED):
         else:
             return inv(ginv[self.CGF.lindices,:][:,self.CGF.lindices])
 
-    def mgf_kmesh(self,omega,kmesh):
+    def ptsupport(self):
+        '''
+        Returns the support of the inter-cluster perturbations and the momentum independent perturbations.
+
+        Returns
+        -------
+        indices : 1d ndarray of int
+            The indices of the orbitals coupled by the inter-cluster perturbations.
+        pt0 : 2d ndarray
+            The momentum independent perturbations.
+        '''
+        icoords,hcoeffs,ccoeffs=self.ptcoeffs()
+        mask=(hcoeffs!=0).any(axis=0).reshape((self.ncopt,self.ncopt))
+        pt0=ccoeffs.reshape((self.ncopt,self.ncopt))
+        return np.nonzero(mask.any(axis=0)|mask.any(axis=1))[0],pt0+pt0.T.conjugate()
+
+    def mgf_kmesh(self,omega,kmesh,method=None):
         '''
         Returns the mesh of the Green's functions in the mixed representation with respect to momentums.
 
@@ -483,12 +675,26 @@ class VCA(ED.FED):
         kmesh : (n+1)d ndarray like
             The kmesh of the mixed Green's functions.
             And n is the spatial dimension of the system.
+        method : 'dense' or 'woodbury', optional
+            * 'dense': invert `inv(cgf)-pt(k)` for every k;
+            * 'woodbury': update the Green's function dressed by the momentum independent perturbations with the Woodbury identity restricted to the orbitals coupled by the inter-cluster perturbations, which raises a ValueError with baths.
+            When None, 'woodbury' is used only if there are no baths and its cost is lower.
 
         Returns
         -------
         3d ndarray
             The mesh of the mixed Green's functions.
         '''
+        assert method in (None,'dense','woodbury')
+        if method=='woodbury' and self.ncbopt>0: raise ValueError('mgf_kmesh error: woodbury is not available with baths.')
+        if method!='dense' and self.ncbopt==0:
+            indices,pt0=self.ptsupport()
+            nr,nc=len(indices),self.ncopt
+            if method=='woodbury' or nr**3+nc**2*nr<nc**3:
+                gt=inv(inv(self.cgf(omega))-pt0)
+                pts=self.pt_kmesh(kmesh)[:,indices,:][:,:,indices]-pt0[indices,:][:,indices]
+                ms=solve(np.eye(nr)-np.matmul(pts,gt[indices,:][:,indices]),pts)
+                return gt+np.matmul(np.matmul(gt[:,indices],ms),gt[indices,:])
         ginv=inv(self.cgf(omega))-self.pt_kmesh(kmesh)
         if self.ncbopt==0:
             return inv(ginv)
@@ -530,10 +736,62 @@ class VCA(ED.FED):
         3d ndarray
             The mesh of the VCA Green's functions.
         '''
-        mgf_kmesh=self.mgf_kmesh(omega,kmesh)
-        result=np.zeros((kmesh.shape[0],self.nopt,self.nopt),dtype=np.complex128)
-        for n,k in enumerate(kmesh):
-            result[n,:,:]=_gf_contract_(k,mgf_kmesh[n,:,:],self.periodization['seqs'],self.periodization['coords'])
+        U=self.projector(kmesh)
+        return np.matmul(np.matmul(U,self.mgf_kmesh(omega,kmesh)),np.swapaxes(U.conjugate(),1,2))/(self.nclopt/self.nopt)
+
+    def mgf_batch(self,omegas,pts):
+        '''
+        Returns the batch of the Green's functions in the mixed representation with respect to frequencies and perturbations.
+
+        Parameters
+        ----------
+        omegas : 1d ndarray
+            The frequencies of the mixed Green's functions.
+        pts : 3d ndarray
+            The stack of the perturbations, e.g. the pt mesh returned by `pt_kmesh`.
+
+        Returns
+        -------
+        4d ndarray
+            The batch of the mixed Green's functions, with the first axis for the frequencies and the second for the perturbations.
+        '''
+        ginv=inv(self.cgf(np.asarray(omegas)))[:,np.newaxis,:,:]-pts[np.newaxis,:,:,:]
+        if self.ncbopt==0:
+            return inv(ginv)
+        else:
+            return inv(ginv[:,:,self.CGF.lindices,:][:,:,:,self.CGF.lindices])
+
+    def gf_batch(self,omegas,kmesh,pts=None,nbatch=None):
+        '''
+        Returns the batch of the VCA Green's functions with respect to frequencies and momentums.
+
+        Parameters
+        ----------
+        omegas : 1d ndarray
+            The frequencies of the VCA Green's functions.
+        kmesh : (n+1)d ndarray like
+            The kmesh of the VCA Green's functions.
+            And n is the spatial dimension of the system.
+        pts : 3d ndarray, optional
+            The precomputed pt mesh of the kmesh.
+        nbatch : int, optional
+            The number of frequencies treated at once.
+
+        Returns
+        -------
+        4d ndarray
+            The batch of the VCA Green's functions, with the first axis for the frequencies and the second for the momentums.
+        '''
+        omegas,kmesh=np.asarray(omegas).reshape(-1),np.asarray(kmesh)
+        if pts is None: pts=self.pt_kmesh(kmesh)
+        if nbatch is None: nbatch=max(2**22/(kmesh.shape[0]*self.ncopt**2),1)
+        U=self.projector(kmesh)
+        UD=np.swapaxes(U.conjugate(),-1,-2)
+        result=np.zeros((len(omegas),kmesh.shape[0],self.nopt,self.nopt),dtype=np.complex128)
+        for start in xrange(0,len(omegas),nbatch):
+            ginv=inv(self.cgf(omegas[start:start+nbatch]))[:,np.newaxis,:,:]-pts[np.newaxis,:,:,:]
+            if self.ncbopt>0: ginv=ginv[:,:,self.CGF.lindices,:][:,:,:,self.CGF.lindices]
+            result[start:start+nbatch]=np.matmul(U,solve(ginv,np.broadcast_to(UD,ginv.shape[:2]+UD.shape[1:])))
         return result/(self.nclopt/self.nopt)
 
     def totba(self,weisson=False):
@@ -602,13 +860,14 @@ def VCAEB(engine,app):
     This method calculates the single particle spectrum along a path in the Brillouin zone.
     '''
     engine.rundependences(app.name)
-    engine.cache.pop('pt_kmesh',None)
     erange,kmesh,nk=np.linspace(app.emin,app.emax,app.ne),app.path.mesh('k'),app.path.rank('k')
     result=np.zeros((nk,app.ne,3))
     result[:,:,0]=np.tensordot(np.array(xrange(nk)),np.ones(app.ne),axes=0)
     result[:,:,1]=np.tensordot(np.ones(nk),erange,axes=0)
-    for i,omega in enumerate(erange):
-        result[:,i,2]=-(np.trace(engine.gf_kmesh(omega+app.mu+app.eta*1j,kmesh),axis1=1,axis2=2)).imag/engine.nopt/np.pi
+    pts,nbatch=engine.pt_kmesh(kmesh),max(2**22/(nk*engine.ncopt**2),1)
+    for start in xrange(0,app.ne,nbatch):
+        gfs=engine.gf_batch(erange[start:start+nbatch]+app.mu+app.eta*1j,kmesh,pts=pts,nbatch=nbatch)
+        result[:,start:start+nbatch,2]=-np.trace(gfs,axis1=2,axis2=3).T.imag/engine.nopt/np.pi
     name='%s_%s'%(engine,app.name)
     if app.savedata: np.savetxt('%s/%s.dat'%(engine.dout,name),result.reshape((nk*app.ne,3)))
     if app.plot: app.figure('P',result,'%s/%s'%(engine.dout,name))
@@ -619,12 +878,13 @@ def VCADOS(engine,app):
     This method calculates the density of the single particle states.
     '''
     engine.rundependences(app.name)
-    engine.cache.pop('pt_kmesh',None)
     erange,kmesh,nk=np.linspace(app.emin,app.emax,app.ne),app.BZ.mesh('k'),app.BZ.rank('k')
     result=np.zeros((app.ne,2))
-    for i,omega in enumerate(erange):
-        result[i,0]=omega
-        result[i,1]=-np.trace(engine.mgf_kmesh(omega+app.mu+app.eta*1j,kmesh),axis1=1,axis2=2).sum().imag/engine.nclopt/nk/np.pi
+    result[:,0]=erange
+    pts,nbatch=engine.pt_kmesh(kmesh),max(2**22/(nk*engine.ncopt**2),1)
+    for start in xrange(0,app.ne,nbatch):
+        mgfs=engine.mgf_batch(erange[start:start+nbatch]+app.mu+app.eta*1j,pts)
+        result[start:start+nbatch,1]=-np.trace(mgfs,axis1=2,axis2=3).sum(axis=1).imag/engine.nclopt/nk/np.pi
     engine.log<<'Sum of DOS: %s\n'%(sum(result[:,1])*(app.emax-app.emin)/app.ne)
     name='%s_%s'%(engine,app.name)
     if app.savedata: np.savetxt('%s/%s.dat'%(engine.dout,name),result)
@@ -636,7 +896,6 @@ def VCAFS(engine,app):
     This method calculates the single particle spectrum at the Fermi surface.
     '''
     engine.rundependences(app.name)
-    engine.cache.pop('pt_kmesh',None)
     kmesh,nk=app.BZ.mesh('k'),app.BZ.rank('k')
     result=np.zeros((nk,3))
     result[:,0:2]=kmesh
@@ -652,8 +911,8 @@ def VCABC(engine,app):
     '''
     engine.rundependences(app.name)
     mu,app.mu=app.mu,0.0
-    engine.gf(omega=mu)
-    bc,cn=app.set(H=lambda kx,ky: -inv(engine.gf(k=[kx,ky])))
+    engine.cgf(omega=mu)
+    bc,cn=app.set(H=lambda kx,ky: -inv(engine.gf(k=[kx,ky])),Hs=lambda ks: -inv(engine.gf_kmesh(mu,ks)))
     app.mu=mu
     engine.log<<'Chern number(mu): %s(%s)\n'%(cn,app.mu)
     kmesh,nk=app.BZ.mesh('k'),app.BZ.rank('k')
@@ -681,21 +940,77 @@ def VCATEB(engine,app):
     if app.plot: app.figure('L',result,'%s/%s'%(engine.dout,name))
     if app.returndata: return result
 
+class GP(HP.GP):
+    '''
+    Grand potential.
+
+    Attributes
+    ----------
+    method : 'pole' or 'quad'
+        * 'pole': the exact sum over the poles of the VCA Green's function;
+        * 'quad': the numerical integration over the imaginary frequencies.
+    nquad : int
+        The order of the Gauss-Legendre rule used by the 'quad' method, None for the adaptive quadrature.
+    scale : float
+        The scale of the map from [0,1) to the imaginary frequencies [0,inf) of the Gauss-Legendre rule.
+    '''
+
+    def __init__(self,method='pole',nquad=None,scale=1.0,**karg):
+        '''
+        Constructor.
+
+        Parameters
+        ----------
+        method : 'pole' or 'quad', optional
+            The method to calculate the grand potential.
+        nquad : int, optional
+            The order of the Gauss-Legendre rule used by the 'quad' method.
+        scale : float, optional
+            The scale of the map from [0,1) to the imaginary frequencies [0,inf) of the Gauss-Legendre rule.
+        '''
+        assert method in ('pole','quad')
+        super(GP,self).__init__(**karg)
+        self.method=method
+        self.nquad=nquad
+        self.scale=scale
+
 def VCAGP(engine,app):
     '''
     This method calculates the grand potential.
+
+    Notes
+    -----
+    With the cluster Green's function written as `Q(omega-Lambda)^-1 Q^dagger`, the poles of the VCA Green's function at k are the eigenvalues of
+    `Lambda+Q^dagger pt(k) Q`, and the frequency integral of `log|det(1-pt(k)cgf)|` reduces to sums of the negative ones.
     '''
     engine.rundependences(app.name)
-    engine.cache.pop('pt_kmesh',None)
     stime=time.time()
     cgf,pt_kmesh,nk=engine.CGF,engine.pt_kmesh(app.BZ.mesh('k')),app.BZ.rank('k')
-    fx=lambda omega: np.log(np.abs(det(np.eye(engine.ncopt)-np.tensordot(pt_kmesh,engine.cgf(omega=omega*1j+app.mu),axes=(2,0))))).sum()
-    rquad=quad(fx,0,np.float(np.inf),full_output=2,epsrel=1.49e-12)
-    part1=-rquad[0]/np.pi
+    poles=engine.cpoles() if getattr(app,'method','quad')=='pole' else None
+    if poles is None and getattr(app,'nquad',None) is not None:
+        fx=lambda omegas: np.log(np.abs(det(np.eye(engine.ncopt)-np.matmul(pt_kmesh[np.newaxis],engine.cgf(omega=omegas*1j+app.mu)[:,np.newaxis])))).sum(axis=1)
+        result,err=_glquad_(fx,app.nquad,max(2**22/(nk*engine.ncopt**2),1),getattr(app,'scale',1.0))
+        part1=-result/np.pi
+        info='err=%.2e,nquad=%s'%(err,app.nquad)
+    elif poles is None:
+        fx=lambda omega: np.log(np.abs(det(np.eye(engine.ncopt)-np.tensordot(pt_kmesh,engine.cgf(omega=omega*1j+app.mu),axes=(2,0))))).sum()
+        rquad=quad(fx,0,np.float(np.inf),full_output=2,epsrel=1.49e-12)
+        part1=-rquad[0]/np.pi
+        info='err=%.2e,neval=%s'%(rquad[1],rquad[2]['neval'])
+    else:
+        Lambda,Q=poles
+        Lambda=Lambda-app.mu
+        ncomponent,labels=connected_components(np.abs(Q.T).dot(np.abs(pt_kmesh).sum(axis=0)).dot(np.abs(Q))>0,directed=False)
+        part1=-np.minimum(Lambda,0.0).sum()*nk-np.einsum('kij,ji->',pt_kmesh,Q.dot(Q.T.conjugate())).real/2
+        for component in (np.nonzero(labels==i)[0] for i in xrange(ncomponent)):
+            Qc,nbatch=Q[:,component],max(2**22/len(component)**2,1)
+            for start in xrange(0,nk,nbatch):
+                part1+=np.minimum(np.linalg.eigvalsh(np.matmul(Qc.T.conjugate(),np.matmul(pt_kmesh[start:start+nbatch],Qc))+np.diag(Lambda[component])),0.0).sum()
+        info='npole=%s'%len(Lambda)
     part2=np.trace(pt_kmesh,axis1=1,axis2=2).sum().real/2
     gp=(cgf.gse+(part1+part2)/nk)/(engine.nclopt/engine.nopt)/len(engine.cell)
     etime=time.time()
-    engine.log<<'gp(mu=%s,err=%.2e,neval=%s,time=%.2es): %s\n\n'%(HP.decimaltostr(app.mu),rquad[1],rquad[2]['neval'],etime-stime,gp)
+    engine.log<<'gp(mu=%s,%s,time=%.2es): %s\n\n'%(HP.decimaltostr(app.mu),info,etime-stime,gp)
     if app.returndata: return gp
 
 class GPM(HP.App):
@@ -711,9 +1026,18 @@ class GPM(HP.App):
         The extra options.
             * BS is BaseSpace: entry 'nder','minormax'
             * BS is dict: see HamiltonianPy.Misc.fstable for details.
+    journal : logical
+        True for recording the computed grand potentials in a journal file so that an interrupted task can be resumed, otherwise False.
+
+    Notes
+    -----
+    When `np` is larger than 1, the grand potentials are computed by `np` forked processes, each of which works on its own copy of the engine.
+    For a BaseSpace `BS` the grid points are distributed among them, and for a dict `BS` with the 'Newton' method all the stencil points of each step are.
+    The journal file is named after a digest of `BS` and of the `mu`, `BZ`, `method`, `nquad` and `scale` of the grand potential app, so that a change of them starts a new journal.
+    In all cases the engine is restored to its original parameters afterwards.
     '''
 
-    def __init__(self,BS,options=None,**karg):
+    def __init__(self,BS,options=None,journal=False,**karg):
         '''
         Constructor.
 
@@ -726,44 +1050,123 @@ class GPM(HP.App):
             The extra options.
                 * BS is BaseSpace: entry 'nder','minormax'
                 * BS is dict: see HamiltonianPy.Misc.fstable for details.
+        journal : logical, optional
+            True for recording the computed grand potentials in a journal file so that an interrupted task can be resumed, otherwise False.
         '''
         assert isinstance(BS,HP.BaseSpace) or isinstance(BS,dict)
         self.BS=BS
         self.options={} if options is None else options
+        self.journal=journal
+
+_GPM_={}
+
+def _gpm_(values,keys):
+    '''
+    Compute the grand potential of the engine in `_GPM_` at the given parameters.
+    '''
+    engine,app=_GPM_['engine'],_GPM_['app']
+    engine.update(**{key:value for key,value in zip(keys,values)})
+    engine.rundependences(app.name)
+    return engine.records[app.dependences[0]]
+
+def _gpmdigest_(engine,app):
+    '''
+    The digest of the settings that determine the grand potentials recorded in the journal of VCAGPM.
+    '''
+    gp=engine.apps[app.dependences[0]]
+    bz=getattr(gp,'BZ',None)
+    settings=[getattr(gp,'method',None),getattr(gp,'nquad',None),getattr(gp,'scale',None),repr(float(gp.mu))]
+    settings.append(None if bz is None else hashlib.sha1(np.ascontiguousarray(bz.mesh('k')).tobytes()).hexdigest())
+    settings.append(hashlib.sha1(np.ascontiguousarray([paras.values() for paras in app.BS('+')]).tobytes()).hexdigest() if isinstance(app.BS,HP.BaseSpace) else sorted(app.BS.iteritems()))
+    return hashlib.sha1(repr(settings)).hexdigest()[:12]
+
+def _gpm_worker_(args):
+    '''
+    The worker of the process pool of VCAGPM.
+    '''
+    return _gpm_(*args)
+
+class _GPMExecutor_(object):
+    '''
+    The executor of VCAGPM for HamiltonianPy.Misc.fstable, which evaluates the grand potentials at a batch of points in a process pool.
+    '''
+
+    def __init__(self,pool,keys,records,record):
+        self.pool=pool
+        self.keys=keys
+        self.records=records
+        self.record=record
+
+    def map(self,fun,xs):
+        todos=OrderedDict((tuple(x),None) for x in xs if tuple(x) not in self.records).keys()
+        for values,value in zip(todos,self.pool.imap(_gpm_worker_,[(values,self.keys) for values in todos])):
+            self.record(values,value)
+        return [fun(x) for x in xs]
 
 def VCAGPM(engine,app):
     '''
     This method implements the grand potential based methods.
     '''
-    records={}
+    keys=app.BS.tags if isinstance(app.BS,HP.BaseSpace) else app.BS.keys()
+    records,journal,origin={},None,{key:engine.parameters[key] for key in keys if key in engine.parameters}
+    if app.journal:
+        path='%s/%s_%s_%s.journal'%(engine.dout,engine.tostr(mask=keys),app.name,_gpmdigest_(engine,app))
+        if os.path.isfile(path):
+            for line in open(path,'r'):
+                data=[float(value) for value in line.split()]
+                if len(data)==len(keys)+1: records[tuple(data[:-1])]=data[-1]
+        journal=open(path,'a')
+    def record(values,gp):
+        records[tuple(values)]=gp
+        if journal is not None:
+            journal.write('%s\n'%' '.join(repr(float(value)) for value in tuple(values)+(gp,)))
+            journal.flush()
     def gp(values,keys):
-        if tuple(values) not in records:
-            engine.cache.pop('pt_kmesh',None)
-            engine.update(**{key:value for key,value in zip(keys,values)})
-            engine.rundependences(app.name)
-            records[tuple(values)]=engine.records[app.dependences[0]]
+        if tuple(values) not in records: record(values,_gpm_(values,keys))
         return records[tuple(values)]
-    if isinstance(app.BS,HP.BaseSpace):
-        mode,nbs,nder,minormax='+',len(app.BS.tags),app.options.get('nder',0),app.options.get('minormax','min')
-        result=np.zeros((app.BS.rank(0),nbs+nder+1))
-        for i,paras in enumerate(app.BS(mode)):
-            result[i,0:nbs]=np.array(paras.values())
-            result[i,nbs]=gp(paras.values(),paras.keys())
-        if nder>0:result[:,nbs+1:]=HM.derivatives(result[:,0],result[:,nbs],ders=range(1,nder+1)).T
-        index=np.argmin(result[:,-1]) if minormax=='min' else np.argmax(result[:,-1]) if minormax=='max' else np.argmax(np.abs(result[:,-1]))
-        engine.log<<'Summary:\n%s\n'%HP.Sheet(
-                                cols=           app.BS.tags+['%sgp'%('' if nder==0 else '%s der of '%HP.ordinal(nder-1))],
-                                contents=       np.append(result[index,0:nbs],result[index,-1]).reshape((1,-1))
-                                )
-        name='%s_%s'%(engine.tostr(mask=app.BS.tags),app.name)
-        if app.savedata: np.savetxt('%s/%s.dat'%(engine.dout,name),result)
-        if app.plot: app.figure('L',result,'%s/%s'%(engine.dout,name),interpolate=True,legend=['%sgp'%('%s der of '%HP.ordinal(k-1) if k>0 else '') for k in xrange(nder+1)])
-        if app.returndata: return result
-    else:
-        result=HM.fstable(gp,app.BS.values(),args=(app.BS.keys(),),**app.options)
-        engine.log<<'Summary:\n%s\n'%HP.Sheet(cols=app.BS.keys()+['niter','nfev','gp'],contents=np.append(result.x,[result.nit,result.nfev,result.fun]).reshape((1,-1)))
-        if app.savedata: np.savetxt('%s/%s_%s.dat'%(engine.dout,engine.tostr(mask=app.BS.keys()),app.name),np.append(result.x,result.fun))
-        if app.returndata: return {key:value for key,value in zip(app.BS.keys(),result.x)},result.fun
+    _GPM_.update(engine=engine,app=app)
+    try:
+        if isinstance(app.BS,HP.BaseSpace):
+            mode,nbs,nder,minormax='+',len(app.BS.tags),app.options.get('nder',0),app.options.get('minormax','min')
+            result=np.zeros((app.BS.rank(0),nbs+nder+1))
+            for i,paras in enumerate(app.BS(mode)):
+                result[i,0:nbs]=np.array(paras.values())
+            todos=OrderedDict((tuple(values),None) for values in result[:,0:nbs] if tuple(values) not in records).keys()
+            if (app.np or 1)>1 and len(todos)>1:
+                pool=mp.Pool(min(app.np,len(todos)))
+                try:
+                    for values,value in zip(todos,pool.imap(_gpm_worker_,[(values,keys) for values in todos])):
+                        record(values,value)
+                finally:
+                    pool.terminate()
+            for i in xrange(result.shape[0]):
+                result[i,nbs]=gp(result[i,0:nbs],keys)
+            if nder>0:result[:,nbs+1:]=HM.derivatives(result[:,0],result[:,nbs],ders=range(1,nder+1)).T
+            index=np.argmin(result[:,-1]) if minormax=='min' else np.argmax(result[:,-1]) if minormax=='max' else np.argmax(np.abs(result[:,-1]))
+            engine.log<<'Summary:\n%s\n'%HP.Sheet(
+                                    cols=           app.BS.tags+['%sgp'%('' if nder==0 else '%s der of '%HP.ordinal(nder-1))],
+                                    contents=       np.append(result[index,0:nbs],result[index,-1]).reshape((1,-1))
+                                    )
+            name='%s_%s'%(engine.tostr(mask=app.BS.tags),app.name)
+            if app.savedata: np.savetxt('%s/%s.dat'%(engine.dout,name),result)
+            if app.plot: app.figure('L',result,'%s/%s'%(engine.dout,name),interpolate=True,legend=['%sgp'%('%s der of '%HP.ordinal(k-1) if k>0 else '') for k in xrange(nder+1)])
+            if app.returndata: return result
+        else:
+            options,pool=app.options,None
+            if (app.np or 1)>1 and app.options.get('method','Newton')=='Newton':
+                pool=mp.Pool(app.np)
+                options=dict(app.options,options=dict(app.options.get('options') or {},executor=_GPMExecutor_(pool,keys,records,record)))
+            try:
+                result=HM.fstable(gp,app.BS.values(),args=(app.BS.keys(),),**options)
+            finally:
+                if pool is not None: pool.terminate()
+            engine.log<<'Summary:\n%s\n'%HP.Sheet(cols=app.BS.keys()+['niter','nfev','gp'],contents=np.append(result.x,[result.nit,result.nfev,result.fun]).reshape((1,-1)))
+            if app.savedata: np.savetxt('%s/%s_%s.dat'%(engine.dout,engine.tostr(mask=app.BS.keys()),app.name),np.append(result.x,result.fun))
+            if app.returndata: return {key:value for key,value in zip(app.BS.keys(),result.x)},result.fun
+    finally:
+        _GPM_.clear()
+        if journal is not None: journal.close()
+        engine.update(**origin)
 
 class CPFF(HP.CPFF):
     '''
@@ -773,11 +1176,15 @@ class CPFF(HP.CPFF):
     ----------
     p : np.float64
         A tunable parameter used in the calculation. Refer arXiv:0806.2690 for details.
+    nquad : int
+        The order of the Gauss-Legendre rule for the frequency integration, None for the adaptive quadrature.
+    scale : float
+        The scale of the map from [0,1) to the imaginary frequencies [0,inf) of the Gauss-Legendre rule.
     options : dict
         Extra options.
     '''
 
-    def __init__(self,p=1.0,options=None,**karg):
+    def __init__(self,p=1.0,nquad=None,scale=1.0,options=None,**karg):
         '''
         Constructor.
 
@@ -785,11 +1192,17 @@ class CPFF(HP.CPFF):
         -----------
         p : np.float64, optional
             A tunable parameter used in the calculation.
+        nquad : int, optional
+            The order of the Gauss-Legendre rule for the frequency integration.
+        scale : float, optional
+            The scale of the map from [0,1) to the imaginary frequencies [0,inf) of the Gauss-Legendre rule.
         options : dict, optional
             Extra options.
         '''
         super(CPFF,self).__init__(**karg)
         self.p=p
+        self.nquad=nquad
+        self.scale=scale
         self.options={} if options is None else options
 
 def VCACPFF(engine,app):
@@ -797,18 +1210,25 @@ def VCACPFF(engine,app):
     This method calculates the chemical potential or filling factor.
     '''
     engine.rundependences(app.name)
-    engine.cache.pop('pt_kmesh',None)
     kmesh,nk=app.BZ.mesh('k'),app.BZ.rank('k')
-    fx=lambda omega,mu: (np.trace(engine.mgf_kmesh(omega=mu+1j*omega,kmesh=kmesh),axis1=1,axis2=2)-engine.nclopt/(1j*omega-app.p)).sum().real
+    if app.nquad is None:
+        fx=lambda omega,mu: (np.trace(engine.mgf_kmesh(omega=mu+1j*omega,kmesh=kmesh),axis1=1,axis2=2)-engine.nclopt/(1j*omega-app.p)).sum().real
+        integrate=lambda mu: quad(fx,0,np.float(np.inf),args=mu,full_output=2)
+        info=lambda rquad: 'err=%.2e,neval=%s'%(rquad[1],rquad[2]['neval'])
+    else:
+        pts,nbatch=engine.pt_kmesh(kmesh),max(2**22/(nk*engine.ncopt**2),1)
+        fx=lambda omegas,mu: (np.trace(engine.mgf_batch(mu+1j*omegas,pts),axis1=2,axis2=3).sum(axis=1)-engine.nclopt*nk/(1j*omegas-app.p)).real
+        integrate=lambda mu: _glquad_(lambda omegas: fx(omegas,mu),app.nquad,nbatch,app.scale)
+        info=lambda rquad: 'err=%.2e,nquad=%s'%(rquad[1],app.nquad)
     if app.task=='CP':
-        gx=lambda mu: quad(fx,0,np.float(np.inf),args=mu)[0]/nk/engine.nclopt/np.pi-app.cf
+        gx=lambda mu: integrate(mu)[0]/nk/engine.nclopt/np.pi-app.cf
         mu=broyden2(gx,app.options.pop('x0',0.0),**app.options)
         engine.log<<'mu(error): %s(%s)\n'%(mu,gx(mu))
         if app.returndata: return mu
     else:
-        rquad=quad(fx,0,np.float(np.inf),args=app.cf,full_output=2)
+        rquad=integrate(app.cf)
         filling=rquad[0]/nk/engine.nclopt/np.pi
-        engine.log<<'Filling factor(mu=%s,err=%.2e,neval=%s): %s\n'%(HP.decimaltostr(app.cf),rquad[1],rquad[2]['neval'],filling)
+        engine.log<<'Filling factor(mu=%s,%s): %s\n'%(HP.decimaltostr(app.cf),info(rquad),filling)
         if app.returndata: return filling
 
 class OP(HP.App):
@@ -827,9 +1247,13 @@ class OP(HP.App):
         A tunable parameter used in the calculation. Refer arXiv:0806.2690 for details.
     dtypes : list of np.float32/np.float64/np.complex64/np.complex128
         The data types of the order parameters.
+    nquad : int
+        The order of the Gauss-Legendre rule for the frequency integration, None for the adaptive quadrature.
+    scale : float
+        The scale of the map from [0,1) to the imaginary frequencies [0,inf) of the Gauss-Legendre rule.
     '''
 
-    def __init__(self,terms,BZ=None,mu=0.0,p=1.0,dtypes=None,**karg):
+    def __init__(self,terms,BZ=None,mu=0.0,p=1.0,dtypes=None,nquad=None,scale=1.0,**karg):
         '''
         Constructor.
 
@@ -845,12 +1269,18 @@ class OP(HP.App):
             A tunable parameter used in the calculation.
         dtypes : list of np.float32/np.float64/np.complex64/np.complex128, optional
             The data types of the order parameters.
+        nquad : int, optional
+            The order of the Gauss-Legendre rule for the frequency integration.
+        scale : float, optional
+            The scale of the map from [0,1) to the imaginary frequencies [0,inf) of the Gauss-Legendre rule.
         '''
         self.terms=terms
         self.BZ=BZ
         self.mu=mu
         self.p=p
         self.dtypes=[np.float64]*len(terms) if dtypes is None else dtypes
+        self.nquad=nquad
+        self.scale=scale
         assert len(self.dtypes)==len(self.terms)
 
 def VCAOP(engine,app):
@@ -858,20 +1288,27 @@ def VCAOP(engine,app):
     This method calculates the order parameters.
     '''
     engine.rundependences(app.name)
-    engine.cache.pop('pt_kmesh',None)
     cgf,kmesh,nk=engine.CGF,app.BZ.mesh('k'),app.BZ.rank('k')
     ops,ms={},np.zeros((len(app.terms),engine.nclopt,engine.nclopt),dtype=np.complex128)
-    table=HP.Table([operator.index for operator in cgf.loperators])
-    for i,term in enumerate(app.terms):
-        order=deepcopy(term)
-        order.value=1.0
-        for opt in HP.Generator(engine.lattice.bonds,engine.config,table=table,terms=[order],half=True).operators.itervalues():
-            ms[i,opt.seqs[0],opt.seqs[1]]+=opt.value
-        ms[i,:,:]+=ms[i,:,:].T.conjugate()
-    fx=lambda omega,m: (np.trace(np.tensordot(engine.mgf_kmesh(omega=app.mu+1j*omega,kmesh=kmesh),m,axes=(2,0)),axis1=1,axis2=2)-np.trace(m)/(1j*omega-app.p)).sum().real
-    for term,m,dtype in zip(app.terms,ms,app.dtypes):
-        ops[term.id]=quad(fx,0,np.float(np.inf),args=m)[0]/nk/engine.nclopt*2/np.pi
-        if dtype in (np.float32,np.float64): ops[term.id]=ops[term.id].real
+    table,orders=HP.Table([operator.index for operator in cgf.loperators]),[term.unit for term in app.terms]
+    for bond in engine.lattice.bonds:
+        for i,order in enumerate(orders):
+            for opt in order.operators(bond,engine.config,table=table,half=True).itervalues():
+                ms[i,opt.seqs[0],opt.seqs[1]]+=opt.value
+    ms+=np.swapaxes(ms.conjugate(),1,2)
+    traces=np.trace(ms,axis1=1,axis2=2)
+    pts,nbatch=engine.pt_kmesh(kmesh),max(2**22/(nk*engine.ncopt**2),1)
+    gx=lambda omegas: (np.einsum('wkij,tji->wt',engine.mgf_batch(app.mu+1j*omegas,pts),ms)-traces*nk/(1j*omegas-app.p)[:,np.newaxis]).real
+    fx=lambda omegas: np.concatenate([gx(omegas[start:start+nbatch]) for start in xrange(0,len(omegas),nbatch)])
+    if app.nquad is None:
+        values,err,neval=HM.quadvec(fx,0.0,np.float(np.inf))
+        info='err=%.2e,neval=%s'%(err/nk/engine.nclopt*2/np.pi,neval)
+    else:
+        values,err=_glquad_(fx,app.nquad,nbatch,app.scale)
+        info='err=%.2e,nquad=%s'%(err/nk/engine.nclopt*2/np.pi,app.nquad)
+    for term,value,dtype in zip(app.terms,values/nk/engine.nclopt*2/np.pi,app.dtypes):
+        ops[term.id]=value.real if dtype in (np.float32,np.float64) else value
+    engine.log<<'Order parameters(mu=%s,%s):\n'%(HP.decimaltostr(app.mu),info)
     engine.log<<HP.Sheet(corner='Order',rows=['Value'],cols=ops.keys(),contents=np.array(ops.values()).reshape((1,-1)))<<'\n'
     if app.returndata: return ops
 
@@ -887,9 +1324,13 @@ class DTBT(HP.App):
         The Fermi level.
     p : np.float64
         A tunable parameter used in the calculation.
+    nquad : int
+        The order of the Gauss-Legendre rule for the frequency integration, None for the adaptive quadrature.
+    scale : float
+        The scale of the map from [0,1) to the imaginary frequencies [0,inf) of the Gauss-Legendre rule.
     '''
 
-    def __init__(self,path,mu,p=1.0,**karg):
+    def __init__(self,path,mu,p=1.0,nquad=None,scale=1.0,**karg):
         '''
         Constructor.
 
@@ -901,10 +1342,16 @@ class DTBT(HP.App):
             The Fermi level.
         p : np.float64, optional
             A tunable parameter used in the calculation.
+        nquad : int, optional
+            The order of the Gauss-Legendre rule for the frequency integration.
+        scale : float, optional
+            The scale of the map from [0,1) to the imaginary frequencies [0,inf) of the Gauss-Legendre rule.
         '''
         self.path=path
         self.mu=mu
         self.p=p
+        self.nquad=nquad
+        self.scale=scale
 
 def VCADTBT(engine,app):
     '''
@@ -912,11 +1359,18 @@ def VCADTBT(engine,app):
     '''
     engine.rundependences(app.name)
     nk,kmesh=app.path.rank('k'),app.path.mesh('k')
-    nwk=lambda omega,k: (np.trace(engine.gf(omega*1j+app.mu,k))-engine.nopt/(omega*1j-app.p)).real
     result=np.zeros((nk,2))
     result[:,0]=np.array(xrange(nk))
-    for i,k in enumerate(kmesh):
-        result[i,1]=quad(nwk,0,np.float(np.inf),args=k)[0]/np.pi
+    if app.nquad is None:
+        nwk=lambda omega,k: (np.trace(engine.gf(omega*1j+app.mu,k))-engine.nopt/(omega*1j-app.p)).real
+        for i,k in enumerate(kmesh):
+            result[i,1]=quad(nwk,0,np.float(np.inf),args=k)[0]/np.pi
+    else:
+        pts,nbatch=engine.pt_kmesh(kmesh),max(2**22/(nk*engine.ncopt**2),1)
+        nwk=lambda omegas: (np.trace(engine.gf_batch(omegas*1j+app.mu,kmesh,pts=pts,nbatch=nbatch),axis1=2,axis2=3)-engine.nopt/(omegas*1j-app.p)[:,np.newaxis]).real
+        values,err=_glquad_(nwk,app.nquad,nbatch,app.scale)
+        result[:,1]=values/np.pi
+        engine.log<<'Distribution(mu=%s,err=%.2e,nquad=%s)\n'%(HP.decimaltostr(app.mu),err/np.pi,app.nquad)
     name='%s_%s'%(engine,app.name)
     if app.savedata: np.savetxt('%s/%s.dat'%(engine.dout,name),result)
     if app.plot: app.figure('L',result,'%s/%s'%(engine.dout,name))
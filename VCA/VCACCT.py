@@ -15,8 +15,11 @@ from copy import deepcopy
 from collections import Counter,OrderedDict
 import numpy as np
 import HamiltonianPy as HP
+import HamiltonianPy.Misc as HM
 import HamiltonianPy.ED as ED
 import itertools as it
+import multiprocessing as mp
+import hashlib
 
 class SubVCA(ED.FED):
     '''
@@ -111,6 +114,23 @@ class SubVCA(ED.FED):
             self.bgenerator.update(**data)
             self.operators=self.hgenerator.operators+self.wgenerator.operators+self.bgenerator.operators
 
+    def fingerprint(self):
+        '''
+        The fingerprint of the subsystem.
+
+        Returns
+        -------
+        str
+            The sha1 digest of the sectors, the table sequences, nambu indices and values of the operators, and the table sequences of the operators of the Green's function.
+            Subsystems with the same fingerprint share the same Hamiltonian and Green's function.
+        '''
+        gf=self.apps['gf']
+        contents=[np.dtype(self.dtype).name,gf.method,gf.nstep]
+        contents.extend(sorted(self.sectors))
+        contents.extend(sorted((operator.seqs,tuple(index.nambu for index in operator.indices),complex(operator.value)) for operator in self.operators.itervalues()))
+        contents.extend(operator.seqs for operator in gf.operators)
+        return hashlib.sha1(repr(contents)).hexdigest()
+
 class VCACCT(VCA):
     '''
     This class implements the algorithm of the variational cluster approach of an electron system composed of several subsystems.
@@ -126,9 +146,11 @@ class VCACCT(VCA):
             The group of the subsystems.
         * value: SubVCA
             A representative subsystem of the same group.
+    nprocess : int
+        The number of worker processes to solve the subsystems.
     '''
 
-    def __init__(self,cgf,cell,lattice,config,terms=(),weiss=(),baths=(),mask=('nambu',),subsystems=None,dtype=np.complex128,**karg):
+    def __init__(self,cgf,cell,lattice,config,terms=(),weiss=(),baths=(),mask=('nambu',),subsystems=None,dtype=np.complex128,nprocess=None,**karg):
         '''
         Constructor.
 
@@ -143,6 +165,8 @@ class VCACCT(VCA):
                 The lattice of the subsystem.
             * entry 'group': any hashable object, optional
                 The group of the subsystem.
+        nprocess : int, optional
+            The number of worker processes to solve the subsystems.
         '''
         assert isinstance(cgf,VGF)
         subconfigs=[HP.IDFConfig(priority=config.priority,pids=subsystem['lattice'].pids,map=config.map) for subsystem in subsystems]
@@ -157,6 +181,7 @@ class VCACCT(VCA):
         self.baths=baths
         self.mask=mask
         self.dtype=dtype
+        self.nprocess=nprocess
         self.groups=[subsystem.get('group',subsystem['lattice'].name) for subsystem in subsystems]
         self.subsystems={}
         extras={key:value for key,value in karg.iteritems() if key!='name'}
@@ -225,6 +250,9 @@ class VCACCT(VCA):
         '''
         if len(karg)>0:
             self.CGF.virgin=True
+            self.cache.pop('cgf',None)
+            nhit,nmiss,ctime=self.cgfstat(reset=True)
+            if nhit+nmiss>0: self.log<<'::<CGF>:: hits=%s, misses=%s, hit rate=%.1f%%, time=%.4es\n'%(nhit,nmiss,100.0*nhit/(nhit+nmiss),ctime)
             for subsystem in self.subsystems.itervalues():
                 subsystem.update(**karg)
             super(ED.ED,self).update(**karg)
@@ -235,16 +263,72 @@ class VCACCT(VCA):
             self.pthoperators=self.pthgenerator.operators
             self.ptwoperators=self.ptwgenerator.operators
             self.ptboperators=self.ptbgenerator.operators
+            self.cache.pop('pt_coeffs',None)
+
+    def cpoles(self):
+        '''
+        Return the pole representation of the cluster Green's function.
+
+        Returns
+        -------
+        tuple of 1d ndarray and 2d ndarray, or None
+            The poles and the factor of the residues of the cluster Green's function (see ED.fedsppoles for details),
+            or None if the Green's function of any subsystem is not composed by ED.fedspcom.
+        '''
+        app=self.CGF
+        if app.virgin:
+            app.virgin=False
+            if app.prepare is not None: app.prepare(self,app)
+        poles={}
+        for group,subsystem in self.subsystems.iteritems():
+            gf=subsystem.apps['gf']
+            if gf.compose is not ED.fedspcom: return None
+            poles[group]=ED.fedsppoles(gf.blocks)
+        return np.concatenate([poles[group][0] for group in self.groups]),HM.block_diag(*[poles[group][1] for group in self.groups])
+
+_VCACCT_={}
+
+def _vcacctgfp_(group):
+    '''
+    Solve the subsystem of a group of the engine in `_VCACCT_` and return its groundstate sector and energy and its Lanczos coefficients.
+    '''
+    subsystem=_VCACCT_['engine'].subsystems[group]
+    gf=subsystem.apps['gf']
+    gf.prepare(subsystem,gf)
+    return subsystem.sector,gf.gse,gf.blocks
 
 def VCACCTGFP(engine,app):
     '''
     This method prepares the cluster Green's function.
+
+    Notes
+    -----
+    Groups whose subsystems have the same fingerprint are solved only once, and when `engine.nprocess` is larger than 1, the distinct ones are solved in a process pool.
+    Only the groundstate sectors and energies and the Lanczos coefficients are sent back from the pool, the groundstates themselves stay in the workers.
     '''
     app.gse=0.0
-    counter=Counter(engine.groups)
-    for group,subsystem in engine.subsystems.iteritems():
-        subsystem.apps['gf'].prepare(subsystem,subsystem.apps['gf'])
-        app.gse+=subsystem.apps['gf'].gse*counter[group]
+    counter,groups=Counter(engine.groups),OrderedDict()
+    for group in OrderedDict.fromkeys(engine.groups):
+        groups.setdefault(engine.subsystems[group].fingerprint(),[]).append(group)
+    todos=[members[0] for members in groups.itervalues()]
+    _VCACCT_.update(engine=engine)
+    try:
+        if (engine.nprocess or 1)>1 and len(todos)>1 and not mp.current_process().daemon:
+            pool=mp.Pool(min(engine.nprocess,len(todos)))
+            try:
+                results=pool.map(_vcacctgfp_,todos)
+            finally:
+                pool.terminate()
+        else:
+            results=[_vcacctgfp_(group) for group in todos]
+    finally:
+        _VCACCT_.clear()
+    for members,(sector,gse,blocks) in zip(groups.itervalues(),results):
+        for group in members:
+            subsystem,gf=engine.subsystems[group],engine.subsystems[group].apps['gf']
+            subsystem.sector,gf.gse,gf.blocks=sector,gse,blocks
+            app.gse+=gse*counter[group]
+    if len(todos)<len(counter): engine.log<<'::<Subsystems>:: %s groups, %s distinct\n'%(len(counter),len(todos))
 
 def VCACCTGF(engine,app):
     '''
@@ -257,14 +341,11 @@ def VCACCTGF(engine,app):
             gf=subsystem.apps['gf']
             gf.omega=app.omega
             gfs[group]=gf.run(subsystem,gf)
-        if cgf is None:
-            cgf=np.zeros((app.nopt,app.nopt),dtype=app.dtype)
-        else:
-            cgf[...]=0
+        cgf=np.zeros(np.shape(app.omega)+(app.nopt,app.nopt),dtype=app.dtype)
         row,col=0,0
         for gf in (gfs[group] for group in engine.groups):
-            cgf[row:row+gf.shape[0],col:col+gf.shape[1]]=gf
-            row+=gf.shape[0]
-            col+=gf.shape[1]
+            cgf[...,row:row+gf.shape[-2],col:col+gf.shape[-1]]=gf
+            row+=gf.shape[-2]
+            col+=gf.shape[-1]
         engine.records[app.name]=cgf
     return cgf
@@ -1,5 +1,5 @@
 '''
-VCA test (1 test in total).
+VCA test (11 tests in total).
 '''
 
 __all__=['vca']
@@ -7,18 +7,20 @@ __all__=['vca']
 import HamiltonianPy.ED as ED
 import HamiltonianPy.VCA as VCA
 import numpy as np
+import os,shutil,tempfile,time
+from copy import deepcopy
 from HamiltonianPy import *
+from HamiltonianPy.VCA.VCA import _gf_contract_
+from scipy.integrate import quad
 from unittest import TestCase,TestLoader,TestSuite
 
 class TestVCA(TestCase):
-    def test_vca(self):
-        print
-        t,U,m,n=-1.0,8.0,2,2
+    def vcaconstruct(self,t,U,m,n,method='S'):
         basis=FBasis(2*m*n,m*n,0.0)
         cell=Square('S1')('1P-1P',1)
         lattice=Square('S1')('%sP-%sP'%(m,n),1)
         config=IDFConfig(priority=DEFAULT_FERMIONIC_PRIORITY,pids=lattice.pids,map=lambda pid: Fermi(atom=0,norbital=1,nspin=2,nnambu=1))
-        cgf=VCA.VGF(nstep=200,prepare=ED.EDGFP,savedata=False,run=ED.EDGF)
+        cgf=VCA.VGF(nstep=200,method=method,prepare=ED.EDGFP,savedata=False,run=ED.EDGF)
         vca=VCA.VCA(
                 name=       'WG-%s-%s'%(lattice.name,basis.rep),
                 cgf=        cgf,
@@ -31,6 +33,12 @@ class TestVCA(TestCase):
                 mask=       ['nambu'],
                 dtype=      np.float64
                 )
+        return vca,lattice
+
+    def test_vca(self):
+        print
+        t,U,m,n=-1.0,8.0,2,2
+        vca,lattice=self.vcaconstruct(t,U,m,n)
         vca.add(GP(name='GP',mu=U/2,BZ=square_bz(reciprocals=lattice.reciprocals,nk=100),run=VCA.VCAGP))
         vca.register(VCA.GPM(name='afm-1',BS=BaseSpace(('afm',np.linspace(0.0,0.3,16))),dependences=['GP'],savedata=False,run=VCA.VCAGPM))
         vca.register(VCA.GPM(name='afm-2',BS={'afm':0.1},options={'method':'BFGS','tol':10**-4},dependences=['GP'],savedata=False,run=VCA.VCAGPM))
@@ -43,6 +51,271 @@ class TestVCA(TestCase):
         #vca.register(VCA.CPFF(name='CP',task='CP',cf=0.5,BZ=KSpace(reciprocals=lattice.reciprocals,nk=100),options={'x0':1.0,'x_tol':10**-6,'maxiter':20},run=VCA.VCACPFF))
         vca.summary()
 
+    def test_batch(self):
+        print
+        t,U,m,n=-1.0,8.0,2,2
+        for method in ('S','B'):
+            vca,lattice=self.vcaconstruct(t,U,m,n,method=method)
+            vca.update(afm=0.2)
+            kmesh=KSpace(reciprocals=lattice.reciprocals,nk=64).mesh('k')
+            omegas=np.linspace(-6.0,6.0,16)+U/2+0.05j
+            pts=vca.pt_kmesh(kmesh)
+            self.assertTrue(np.allclose(vca.cgf(omegas)[5],vca.cgf(omegas[5]),rtol=10**-12,atol=10**-12))
+            t0=time.time()
+            gfs=np.array([vca.gf_kmesh(omega,kmesh) for omega in omegas])
+            t1=time.time()
+            bgfs=vca.gf_batch(omegas,kmesh,pts=pts)
+            t2=time.time()
+            self.assertTrue(np.allclose(bgfs,gfs,rtol=10**-10,atol=10**-10))
+            self.assertTrue(np.allclose(vca.gf_batch(omegas,kmesh,pts=pts,nbatch=3),bgfs,rtol=10**-12,atol=10**-12))
+            self.assertTrue(np.allclose(vca.mgf_batch(omegas[:2],pts),[vca.mgf_kmesh(omega,kmesh) for omega in omegas[:2]],rtol=10**-10,atol=10**-10))
+            print '%s: looped %.3es, batched %.3es, speedup %.1fx'%(method,t1-t0,t2-t1,(t1-t0)/(t2-t1))
+
+    def test_gp(self):
+        print
+        t,U,m,n=-1.0,8.0,2,2
+        vca,lattice=self.vcaconstruct(t,U,m,n)
+        vca.update(afm=0.2)
+        for mu in (U/2,1.0):
+            vca.add(VCA.GP(name='GP-pole',method='pole',mu=mu,BZ=square_bz(reciprocals=lattice.reciprocals,nk=20),run=VCA.VCAGP))
+            vca.add(VCA.GP(name='GP-quad',method='quad',mu=mu,BZ=square_bz(reciprocals=lattice.reciprocals,nk=20),run=VCA.VCAGP))
+            pgp=vca.apps['GP-pole'].run(vca,vca.apps['GP-pole'])
+            qgp=vca.apps['GP-quad'].run(vca,vca.apps['GP-quad'])
+            self.assertAlmostEqual(pgp,qgp,delta=10**-8)
+
+    def test_gpm(self):
+        print
+        t,U,m,n=-1.0,8.0,2,2
+        vca,lattice=self.vcaconstruct(t,U,m,n)
+        vca.dout=tempfile.mkdtemp()
+        try:
+            vca.add(VCA.GP(name='GP',mu=U/2,BZ=square_bz(reciprocals=lattice.reciprocals,nk=20),run=VCA.VCAGP))
+            BS,gpms=BaseSpace(('afm',np.linspace(0.0,0.3,6))),{}
+            vca.update(afm=0.05)
+            for name,nproc,journal in [('serial',None,False),('parallel',3,False),('journal',2,True)]:
+                vca.add(VCA.GPM(name=name,BS=BS,np=nproc,journal=journal,dependences=['GP'],plot=False,savedata=False,run=VCA.VCAGPM))
+                gpms[name]=vca.apps[name].run(vca,vca.apps[name])
+                self.assertEqual(vca.parameters['afm'],0.05)
+            self.assertTrue(np.allclose(gpms['parallel'],gpms['serial'],rtol=10**-10,atol=10**-10))
+            self.assertTrue(np.allclose(gpms['journal'],gpms['serial'],rtol=10**-10,atol=10**-10))
+            path=['%s/%s'%(vca.dout,name) for name in os.listdir(vca.dout) if name.endswith('.journal')][0]
+            journal=[line for line in open(path)]
+            self.assertEqual(len(journal),6)
+            with open(path,'w') as fout: fout.writelines(journal[:3])
+            gpms['resumed']=vca.apps['journal'].run(vca,vca.apps['journal'])
+            self.assertTrue(np.allclose(gpms['resumed'],gpms['serial'],rtol=10**-10,atol=10**-10))
+            self.assertEqual(len([line for line in open(path)]),6)
+            vca.apps['GP'].method,vca.apps['GP'].nquad='quad',4
+            gpms['coarse']=vca.apps['journal'].run(vca,vca.apps['journal'])
+            self.assertFalse(np.allclose(gpms['coarse'][:,1],gpms['serial'][:,1],rtol=10**-10,atol=10**-10))
+            self.assertEqual(len([name for name in os.listdir(vca.dout) if name.endswith('.journal')]),2)
+        finally:
+            shutil.rmtree(vca.dout)
+
+    def test_pt(self):
+        print
+        t,U,m,n=-1.0,8.0,2,2
+        vca,lattice=self.vcaconstruct(t,U,m,n)
+        vca.update(afm=0.2)
+        def pt(k):
+            result=np.zeros((vca.ncopt,vca.ncopt),dtype=np.complex128)
+            for opt in vca.pthoperators.itervalues():
+                result[opt.seqs]+=opt.value*np.exp(-1j*np.inner(k,opt.icoord))
+            for opt in vca.ptwoperators.itervalues():
+                result[opt.seqs]-=opt.value
+            return result+result.T.conjugate()
+        kmesh=KSpace(reciprocals=lattice.reciprocals,nk=200).mesh('k')
+        t0=time.time()
+        pts=np.array([pt(k) for k in kmesh[:2000]])
+        t1=time.time()
+        pt_kmesh=vca.pt_kmesh(kmesh)
+        t2=time.time()
+        self.assertTrue(np.allclose(pt_kmesh[:2000],pts,rtol=10**-13,atol=10**-13))
+        self.assertTrue(np.allclose(vca.pt(kmesh[7]),pts[7],rtol=10**-13,atol=10**-13))
+        self.assertIs(vca.pt_kmesh(kmesh.copy()),pt_kmesh)
+        vca.update(afm=0.1)
+        self.assertIsNot(vca.pt_kmesh(kmesh),pt_kmesh)
+        self.assertTrue(np.allclose(vca.pt_kmesh(kmesh)[:2000],[pt(k) for k in kmesh[:2000]],rtol=10**-13,atol=10**-13))
+        print '200x200 pt mesh: looped %.3es (extrapolated), vectorized %.3es'%((t1-t0)*len(kmesh)/2000,t2-t1)
+
+    def test_woodbury(self):
+        print
+        t,U,m=-1.0,4.0,8
+        cell=Square('S1')('1P-1O',1)
+        lattice=Square('S1')('%sP-1O'%m,1)
+        config=IDFConfig(priority=DEFAULT_FERMIONIC_PRIORITY,pids=lattice.pids,map=lambda pid: Fermi(atom=0,norbital=1,nspin=2,nnambu=1))
+        vca=VCA.VCA(
+                name=       'WB-%s'%lattice.name,
+                cgf=        VCA.VGF(nstep=200,prepare=ED.EDGFP,savedata=False,run=ED.EDGF),
+                sectors=    [FBasis(2*m,m,0.0)],
+                cell=       cell,
+                lattice=    lattice,
+                config=     config,
+                terms=      [Hopping('t',t,neighbour=1),Hubbard('U',U)],
+                weiss=      [Onsite('afm',0.1,indexpacks=sigmaz('sp'),amplitude=lambda bond: (-1)**bond.spoint.pid.site,modulate=True)],
+                mask=       ['nambu'],
+                dtype=      np.float64
+                )
+        self.assertEqual(len(vca.ptsupport()[0]),4)
+        kmesh=KSpace(reciprocals=lattice.reciprocals,nk=2000).mesh('k')
+        omega=U/2+0.3+0.05j
+        vca.pt_kmesh(kmesh)
+        vca.cgf(omega)
+        t0=time.time()
+        dense=vca.mgf_kmesh(omega,kmesh,method='dense')
+        t1=time.time()
+        woodbury=vca.mgf_kmesh(omega,kmesh,method='woodbury')
+        t2=time.time()
+        self.assertTrue(np.allclose(woodbury,dense,rtol=10**-12,atol=10**-12))
+        self.assertTrue(np.allclose(vca.mgf_kmesh(omega,kmesh),dense,rtol=10**-12,atol=10**-12))
+        print 'mgf_kmesh: dense %.3es, woodbury %.3es'%(t1-t0,t2-t1)
+        vca.CGF.bindices=np.array([0])
+        self.assertRaises(ValueError,vca.mgf_kmesh,omega,kmesh,method='woodbury')
+
+    def test_cgf(self):
+        print
+        t,U,m,n=-1.0,8.0,2,2
+        vca,lattice=self.vcaconstruct(t,U,m,n)
+        vca.update(afm=0.2)
+        BZ=square_bz(reciprocals=lattice.reciprocals,nk=20)
+        vca.register(VCA.GP(name='GP',method='quad',mu=U/2,BZ=BZ,run=VCA.VCAGP))
+        ngp=vca.cgfstat()[1]
+        vca.register(VCA.OP(name='OP',mu=U/2,terms=vca.weiss,BZ=BZ,run=VCA.VCAOP))
+        vca.register(VCA.CPFF(name='FF',task='FF',cf=U/2,BZ=BZ,run=VCA.VCACPFF))
+        vca.summary()
+        nhit,nmiss,ctime=vca.cgfstat(reset=True)
+        print 'cgf cache: %s hits, %s misses, %.3es'%(nhit,nmiss,ctime)
+        self.assertEqual(nmiss,ngp)
+        self.assertLess(nmiss,0.5*(nhit+nmiss))
+        vca.register(VCA.GP(name='GP-GL',method='quad',mu=U/2,BZ=BZ,nquad=64,run=VCA.VCAGP))
+        vca.register(VCA.OP(name='OP-GL',mu=U/2,terms=vca.weiss,BZ=BZ,nquad=64,run=VCA.VCAOP))
+        vca.register(VCA.CPFF(name='FF-GL',task='FF',cf=U/2,BZ=BZ,nquad=64,run=VCA.VCACPFF))
+        nhit,nmiss,ctime=vca.cgfstat()
+        print 'cgf cache with the Gauss-Legendre rule: %s hits, %s misses, %.3es'%(nhit,nmiss,ctime)
+        self.assertGreaterEqual(nhit,0.6*(nhit+nmiss))
+        omegas=U/2+1j*np.linspace(0.1,2.0,16)
+        vca.CGFMEMORY=3*vca.cgf(omegas).nbytes
+        for i in xrange(5): vca.cgf(omegas+0.1*(i+1))
+        self.assertLessEqual(sum(cgf.nbytes for cgf in vca.cache['cgf'].itervalues()),vca.CGFMEMORY)
+        self.assertEqual(len(vca.cache['cgf']),3*len(omegas))
+        cgf=vca.cgf(U/2+1.0j)
+        self.assertFalse(cgf.flags.writeable)
+        self.assertIs(vca.cgf(U/2+1.0j),cgf)
+        vca.update(afm=0.1)
+        self.assertEqual(vca.cgfstat(),(0,0,0))
+        self.assertFalse(np.allclose(vca.cgf(U/2+1.0j),cgf))
+
+    def test_glquad(self):
+        print
+        t,U,m,n=-1.0,8.0,2,2
+        vca,lattice=self.vcaconstruct(t,U,m,n)
+        vca.update(afm=0.2)
+        BZ,path,results,times=KSpace(reciprocals=lattice.reciprocals,nk=48),square_gxm(nk=20),{},{}
+        for nquad in (None,64):
+            vca.add(VCA.GP(name='GP-%s'%nquad,method='quad',nquad=nquad,mu=U/2,BZ=BZ,run=VCA.VCAGP))
+            vca.add(VCA.OP(name='OP-%s'%nquad,mu=U/2,terms=vca.weiss,BZ=BZ,nquad=nquad,run=VCA.VCAOP))
+            vca.add(VCA.CPFF(name='FF-%s'%nquad,task='FF',cf=U/2,BZ=BZ,nquad=nquad,run=VCA.VCACPFF))
+            vca.add(VCA.DTBT(name='DTBT-%s'%nquad,path=path,mu=U/2,nquad=nquad,savedata=False,plot=False,run=VCA.VCADTBT))
+            for name in ('GP','OP','FF','DTBT'):
+                app,stime=vca.apps['%s-%s'%(name,nquad)],time.time()
+                results[(name,nquad)]=app.run(vca,app)
+                times[(name,nquad)]=time.time()-stime
+        for name in ('GP','OP','FF'):
+            print '%s: quad %.3es, glquad %.3es'%(name,times[(name,None)],times[(name,64)])
+            qresult,gresult=results[(name,None)],results[(name,64)]
+            if name=='OP': qresult,gresult=[qresult[key] for key in sorted(qresult)],[gresult[key] for key in sorted(qresult)]
+            self.assertTrue(np.allclose(gresult,qresult,rtol=0,atol=10**-8))
+        print 'DTBT: quad %.3es, glquad %.3es'%(times[('DTBT',None)],times[('DTBT',64)])
+        for scale in (0.5,4.0):
+            vca.add(VCA.GP(name='GP-scale',method='quad',nquad=64,scale=scale,mu=U/2,BZ=BZ,run=VCA.VCAGP))
+            vca.add(VCA.OP(name='OP-scale',mu=U/2,terms=vca.weiss,BZ=BZ,nquad=64,scale=scale,run=VCA.VCAOP))
+            self.assertAlmostEqual(vca.apps['GP-scale'].run(vca,vca.apps['GP-scale']),results[('GP',None)],delta=10**-8)
+            self.assertTrue(np.allclose(vca.apps['OP-scale'].run(vca,vca.apps['OP-scale']).values(),results[('OP',None)].values(),rtol=0,atol=10**-8))
+        nwk=lambda omega,k: (np.trace(vca.gf(omega*1j+U/2,k))-vca.nopt/(omega*1j-1.0)).real
+        for k,result in zip(path.mesh('k'),results[('DTBT',64)][:,1]):
+            self.assertAlmostEqual(result,quad(nwk,0,np.inf,args=(k,),epsabs=10**-12,epsrel=10**-12,limit=200)[0]/np.pi,delta=10**-8)
+
+    def test_op(self):
+        print
+        t,U,m,n=-1.0,8.0,2,2
+        vca,lattice=self.vcaconstruct(t,U,m,n)
+        vca.update(afm=0.2)
+        BZ=KSpace(reciprocals=lattice.reciprocals,nk=20)
+        terms=[ vca.weiss[0],
+                Onsite('cdw',1.0,amplitude=lambda bond: 1 if bond.spoint.pid.site in (0,3) else -1),
+                Onsite('fm',1.0,indexpacks=sigmaz('sp')),
+                Hopping('kin',1.0,neighbour=1)
+                ]
+        stime=time.time()
+        references=[self.opreference(vca,term,U/2,BZ) for term in terms]
+        etime=time.time()
+        for nquad,delta in ((None,10**-10),(64,10**-8)):
+            vca.cache.pop('cgf',None)
+            vca.add(VCA.OP(name='OP-%s'%nquad,mu=U/2,terms=terms,BZ=BZ,nquad=nquad,run=VCA.VCAOP))
+            vca.rundependences('OP-%s'%nquad)
+            t0=time.time()
+            ops=vca.apps['OP-%s'%nquad].run(vca,vca.apps['OP-%s'%nquad])
+            t1=time.time()
+            for term,reference in zip(terms,references): self.assertAlmostEqual(ops[term.id],reference,delta=delta)
+            print 'OP(nquad=%s): all terms %.3es, term by term %.3es'%(nquad,t1-t0,etime-stime)
+
+    def opreference(self,vca,term,mu,BZ):
+        cgf,kmesh,nk=vca.CGF,BZ.mesh('k'),BZ.rank('k')
+        order,m=deepcopy(term),np.zeros((vca.nclopt,vca.nclopt),dtype=np.complex128)
+        order.value=1.0
+        for opt in Generator(vca.lattice.bonds,vca.config,table=Table([operator.index for operator in cgf.loperators]),terms=[order],half=True).operators.itervalues():
+            m[opt.seqs[0],opt.seqs[1]]+=opt.value
+        m+=m.T.conjugate()
+        fx=lambda omega: (np.trace(np.tensordot(vca.mgf_kmesh(omega=mu+1j*omega,kmesh=kmesh),m,axes=(2,0)),axis1=1,axis2=2)-np.trace(m)/(1j*omega-1.0)).sum().real
+        return quad(fx,0,np.inf,epsabs=10**-12,epsrel=10**-12,limit=200)[0]/nk/vca.nclopt*2/np.pi
+
+    def test_projector(self):
+        print
+        t,U,m,n=-1.0,8.0,2,2
+        vca,lattice=self.vcaconstruct(t,U,m,n)
+        vca.update(afm=0.2)
+        path=square_gxm(nk=134)
+        kmesh,erange=path.mesh('k'),np.linspace(-6.0,6.0,2000)
+        self.assertIs(vca.projector(kmesh),vca.projector(path.mesh('k')))
+        self.assertFalse(vca.projector(kmesh).flags.writeable)
+        for omega in erange[::500]+U/2+0.05j:
+            fortran=np.array([vca.gf(omega,k) for k in kmesh])
+            self.assertTrue(np.allclose(vca.gf_kmesh(omega,kmesh),fortran,rtol=10**-12,atol=10**-12))
+        vca.add(VCA.EB(name='EB',path=path,mu=U/2,emin=-6.0,emax=6.0,eta=0.05,ne=len(erange),savedata=False,plot=False,run=VCA.VCAEB))
+        stime=time.time()
+        eb=vca.apps['EB'].run(vca,vca.apps['EB'])
+        etime=time.time()
+        fortran=np.zeros((len(kmesh),len(erange)))
+        for i,omega in enumerate(erange+U/2+0.05j):
+            mgf_kmesh=vca.mgf_kmesh(omega,kmesh)
+            fortran[:,i]=[-np.trace(_gf_contract_(k,mgf,vca.periodization['seqs'],vca.periodization['coords'])).imag/vca.nclopt/np.pi for k,mgf in zip(kmesh,mgf_kmesh)]
+        print 'EB(nk=%s,ne=%s): projector %.3es, fortran %.3es'%(len(kmesh),len(erange),etime-stime,time.time()-etime)
+        self.assertTrue(np.allclose(eb[:,:,2],fortran,rtol=10**-10,atol=10**-10))
+
+    def test_bc(self):
+        print
+        U=2.0
+        def haldane_hopping(bond):
+            theta=azimuthd(bond.rcoord)
+            return 1 if abs(theta)<RZERO or abs(theta-120)<RZERO or abs(theta-240)<RZERO else -1
+        lattice=Hexagon(name='H2')('1P-1P',2)
+        config=IDFConfig(priority=DEFAULT_FERMIONIC_PRIORITY,pids=lattice.pids,map=lambda pid: Fermi(atom=pid.site%2,norbital=1,nspin=2,nnambu=1))
+        vca=VCA.VCA(
+                name=       'Haldane-Hubbard',
+                cgf=        VCA.VGF(nstep=100,method='S',prepare=ED.EDGFP,savedata=False,run=ED.EDGF),
+                sectors=    [FBasis(4,2,0.0)],
+                cell=       Hexagon(name='H2')('1P-1P',2),
+                lattice=    lattice,
+                config=     config,
+                terms=      [Hopping('t1',-1.0),Hopping('t2',0.2j,indexpacks=sigmaz('sl'),amplitude=haldane_hopping,neighbour=2),Hubbard('U',U)],
+                mask=       ['nambu'],
+                dtype=      np.complex128
+                )
+        vca.register(BC(name='FHS',BZ=KSpace(reciprocals=lattice.reciprocals,nk=12),mu=U/2,method='fhs',savedata=False,plot=False,returndata=True,run=VCA.VCABC))
+        vca.register(BC(name='Kubo',BZ=KSpace(reciprocals=lattice.reciprocals,nk=40),mu=U/2,method='kubo',savedata=False,plot=False,returndata=True,run=VCA.VCABC))
+        self.assertAlmostEqual(vca.records['FHS'][0],2.0,delta=10**-10)
+        self.assertAlmostEqual(vca.records['Kubo'][0],2.0,delta=10**-3)
+
 vca=TestSuite([
             TestLoader().loadTestsFromTestCase(TestVCA),
             ])
@@ -1,5 +1,5 @@
 '''
-VCACCT test (1 test in total).
+VCACCT test (2 tests in total).
 '''
 
 __all__=['vcacct']
@@ -11,9 +11,7 @@ from HamiltonianPy.VCA import *
 from unittest import TestCase,TestLoader,TestSuite
 
 class TestVCACCT(TestCase):
-    def test_vcacct(self):
-        print
-        t1,U,afm=-1.0,8.0,0.0
+    def vcacctconstruct(self,t1,U,afm,nprocess=None):
         H2,H4C=Hexagon('H2'),Hexagon('H4C')
         cell,LA,LB,lattice=H2('1P-1P',nneighbour=1),H4C.sublattice(0,nneighbour=1),H4C.sublattice(1,nneighbour=1),H4C('1P-1P',nneighbour=1)
         map=lambda ndx: Fermi(atom=0 if (ndx.scope in ('H4C-0','H2') and ndx.site==0) or (ndx.scope=='H4C-1' and ndx.site>0) else 1,norbital=1,nspin=2,nnambu=1)
@@ -33,13 +31,42 @@ class TestVCACCT(TestCase):
             subsystems=[    {'sectors':[FBasis(nstate=2*len(LA),nparticle=len(LA),spinz=0.0)],'lattice':LA},
                             {'sectors':[FBasis(nstate=2*len(LB),nparticle=len(LB),spinz=0.0)],'lattice':LB}
                             ],
+            nprocess=       nprocess
             )
+        return vcacct,lattice
+
+    def test_vcacct(self):
+        print
+        t1,U,afm=-1.0,8.0,0.0
+        vcacct,lattice=self.vcacctconstruct(t1,U,afm)
         vcacct.add(GP(name='GP',mu=U/2,BZ=KSpace(reciprocals=lattice.reciprocals,nk=100),run=VCAGP))
         vcacct.register(GPM(name='afm',BS=BaseSpace(('afm',np.linspace(0.0,0.1,11))),dependences=['GP'],savedata=False,run=VCAGPM))
         vcacct.register(EB(name='EB',parameters={'afm':0.0},path=hexagon_gkm(nk=100),mu=U/2,emax=6.0,emin=-6.0,eta=0.05,ne=400,savedata=False,run=VCAEB))
         vcacct.register(DOS(name='DOS',parameters={'afm':0.0},BZ=KSpace(reciprocals=lattice.reciprocals,nk=50),mu=U/2,emin=-5,emax=5,ne=400,eta=0.05,savedata=False,run=VCADOS))
         vcacct.summary()
 
+    def test_parallel(self):
+        print
+        t1,U=-1.0,8.0
+        reference,lattice=self.vcacctconstruct(t1,U,0.0)
+        serial,lattice=self.vcacctconstruct(t1,U,0.0)
+        parallel,lattice=self.vcacctconstruct(t1,U,0.0,nprocess=2)
+        for name,subsystem in reference.subsystems.iteritems(): subsystem.fingerprint=lambda name=name: repr(name)
+        for afm,ndistinct in ((0.0,1),(0.1,2)):
+            gps=[]
+            for vcacct in (reference,serial,parallel):
+                vcacct.update(afm=afm)
+                if vcacct is not reference: self.assertEqual(len(set(subsystem.fingerprint() for subsystem in vcacct.subsystems.itervalues())),ndistinct)
+                vcacct.add(GP(name='GP',mu=U/2,BZ=KSpace(reciprocals=lattice.reciprocals,nk=20),run=VCAGP))
+                v0s=[subsystem.apps['gf'].v0 for subsystem in vcacct.subsystems.itervalues()]
+                gps.append(vcacct.apps['GP'].run(vcacct,vcacct.apps['GP']))
+                if vcacct is parallel and ndistinct>1:
+                    self.assertTrue(all(subsystem.apps['gf'].v0 is v0 for subsystem,v0 in zip(vcacct.subsystems.itervalues(),v0s)))
+            for vcacct,gp in zip((serial,parallel),gps[1:]):
+                self.assertAlmostEqual(gp,gps[0],delta=10**-10)
+                self.assertAlmostEqual(vcacct.CGF.gse,reference.CGF.gse,delta=10**-10)
+                self.assertTrue(np.allclose(vcacct.cgf(U/2+0.5j),reference.cgf(U/2+0.5j),rtol=10**-8,atol=10**-8))
+
 vcacct=TestSuite([
             TestLoader().loadTestsFromTestCase(TestVCACCT),
             ])